@@ -0,0 +1,136 @@
+"""Synthetic archives for the benchmarks.
+
+Content is half random and half repeated text, so it compresses about 2:1
+and decompression costs something without dominating the run. Every
+generator takes a ``scale`` factor applied to the number or size of files.
+"""
+
+import gzip
+import io
+import os
+import random
+import tarfile
+import typing
+import zipfile
+import zlib
+
+_TEXT = b" ".join(
+    bytes(random.Random(i).choice(b"abcdefghijklmnopqrstuvwxyz") for _ in range(8))
+    for i in range(512)
+)
+
+
+def content(size: int, seed: int) -> bytes:
+    """Returns ``size`` bytes, roughly 2:1 compressible."""
+    rng = random.Random(seed)
+    half = size // 2
+    text = (_TEXT * (half // len(_TEXT) + 1))[:half]
+    offset = rng.randrange(len(_TEXT))
+    return rng.randbytes(size - half) + text[offset:] + text[:offset]
+
+
+def _zip(path: str, files: typing.Iterable[tuple]) -> None:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, size in files:
+            if name.endswith("/"):
+                zf.writestr(name, b"")
+            else:
+                zf.writestr(name, content(size, zlib.crc32(name.encode())))
+
+
+def _tar(path: str, mode: str, files: typing.Iterable[tuple]) -> None:
+    with tarfile.open(path, mode) as tf:
+        for name, size in files:
+            info = tarfile.TarInfo(name)
+            info.mtime = 1700000000
+            if name.endswith("/"):
+                info.type = tarfile.DIRTYPE
+                tf.addfile(info)
+                continue
+            data = content(size, zlib.crc32(name.encode()))
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+
+def many_small_files(scale: float) -> typing.Iterator[tuple]:
+    """Thousands of small documents in a few folders, the most common case."""
+    for i in range(int(5000 * scale)):
+        yield f"documents/folder_{i % 50}/file_{i}.txt", 1024 + (i * 37) % 8192
+
+
+def few_huge_files(scale: float) -> typing.Iterator[tuple]:
+    for i in range(3):
+        yield f"media/video_{i}.bin", int(64 * 1024 * 1024 * scale)
+
+
+def deep_tree(scale: float, depth: int = 10, fanout: int = 2) -> typing.Iterator[tuple]:
+    """A binary tree of folders, ``depth`` levels deep, with a few files per folder."""
+    files_per_folder = max(1, int(3 * scale))
+    folders = [""]
+    for level in range(depth):
+        folders = [f"{x}level{level}_{i}/" for x in folders for i in range(fanout)]
+        for folder in folders:
+            yield folder, 0
+            for j in range(files_per_folder):
+                yield f"{folder}file_{j}.txt", 2048
+
+
+def mixed_sizes(scale: float) -> typing.Iterator[tuple]:
+    """Mostly small files with a few large ones, like a photo export."""
+    rng = random.Random(1)
+    for i in range(int(1000 * scale)):
+        size = rng.choice((4096, 65536, 524288, 4 * 1024 * 1024))
+        yield f"export/album_{i % 20}/item_{i}.dat", size
+
+
+def _single_gz(path: str, scale: float) -> None:
+    with gzip.open(path, "wb", compresslevel=1) as f:
+        for i in range(max(1, int(32 * scale))):
+            f.write(content(1024 * 1024, i))
+
+
+# name -> (file name, MIME type, writer(path, scale))
+SCENARIOS = {
+    "many_small_zip": (
+        "many_small.zip",
+        "application/zip",
+        lambda path, scale: _zip(path, many_small_files(scale)),
+    ),
+    "few_huge_zip": (
+        "few_huge.zip",
+        "application/zip",
+        lambda path, scale: _zip(path, few_huge_files(scale)),
+    ),
+    "deep_tree_zip": (
+        "deep_tree.zip",
+        "application/zip",
+        lambda path, scale: _zip(path, deep_tree(scale)),
+    ),
+    "many_small_tar_gz": (
+        "many_small.tar.gz",
+        "application/x-compressed-tar",
+        lambda path, scale: _tar(path, "w:gz", many_small_files(scale)),
+    ),
+    "mixed_tar_xz": (
+        "mixed.tar.xz",
+        "application/x-xz-compressed-tar",
+        lambda path, scale: _tar(path, "w:xz", mixed_sizes(scale / 4)),
+    ),
+    "mixed_zip": (
+        "mixed.zip",
+        "application/zip",
+        lambda path, scale: _zip(path, mixed_sizes(scale)),
+    ),
+    "single_gz": ("single.bin.gz", "application/gzip", _single_gz),
+}
+
+
+def generate(name: str, directory: str, scale: float = 1.0) -> str:
+    """Writes the archive of a scenario to ``directory`` once and returns its path."""
+    file_name, _, writer = SCENARIOS[name]
+    path = os.path.join(directory, f"{scale:g}_{file_name}")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        writer(path + ".part", scale)
+        os.replace(path + ".part", path)
+    return path
@@ -0,0 +1,90 @@
+"""Scaling of zip decompression with the number of processes.
+
+Usage: python benchmarks/parallel_decompress.py [members] [member_kb]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib")
+)
+
+from engines import ZipEngine  # noqa: E402
+from parallel_extract import (  # noqa: E402
+    extract_parallel,
+    get_process_pool,
+    shutdown_process_pool,
+)
+
+BUFFER_SIZE = 1024 * 1024
+
+
+def make_archive(path: str, members: int, member_size: int) -> None:
+    """Writes a zip of text-like members, compressible about 3:1 like most documents."""
+    words = [
+        "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8))
+        for _ in range(2000)
+    ]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(members):
+            text = " ".join(random.choice(words) for _ in range(member_size // 9))
+            zip_ref.writestr(f"folder_{i % 16}/file_{i}.txt", text)
+
+
+def run(zip_path: str, workers: int) -> float:
+    destination = tempfile.mkdtemp()
+    entries = [x for x in ZipEngine(zip_path).entries() if not x.is_dir]
+    items = [(x, os.path.join(destination, x.name)) for x in entries]
+    if workers > 1:
+        # start the processes outside of the measurement, the app keeps them running
+        list(get_process_pool(workers).map(abs, range(workers * 4)))
+    start = time.monotonic()
+    if workers == 1:
+        with zipfile.ZipFile(zip_path) as zip_ref:
+            for entry, filename in items:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with zip_ref.open(entry.name) as reader, open(filename, "wb") as f:
+                    shutil.copyfileobj(reader, f, BUFFER_SIZE)
+    else:
+        extract_parallel(
+            zip_path, items, lambda size: None, lambda *args: None, BUFFER_SIZE, workers
+        )
+    elapsed = time.monotonic() - start
+    shutil.rmtree(destination)
+    # the shared pool keeps its size, a new one is needed for the next worker count
+    shutdown_process_pool()
+    return elapsed
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    member_size = (int(sys.argv[2]) if len(sys.argv) > 2 else 256) * 1024
+    workdir = tempfile.mkdtemp()
+    zip_path = os.path.join(workdir, "bench.zip")
+    print(f"Creating {members} members of {member_size // 1024} KB...")
+    make_archive(zip_path, members, member_size)
+    total_mb = members * member_size / 1048576
+    print(
+        f"Archive: {os.path.getsize(zip_path) / 1048576:.1f} MB, {total_mb:.1f} MB uncompressed"
+    )
+    print(f"{'workers':>8} {'seconds':>8} {'MB/s':>8} {'speedup':>8}")
+    baseline = None
+    for workers in (1, 2, 4, 8):
+        if workers > 1 and workers > (os.cpu_count() or 1) * 2:
+            break
+        elapsed = run(zip_path, workers)
+        baseline = baseline or elapsed
+        print(
+            f"{workers:>8} {elapsed:>8.2f} {total_mb / elapsed:>8.1f} {baseline / elapsed:>8.2f}"
+        )
+    shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
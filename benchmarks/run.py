@@ -0,0 +1,247 @@
+"""End-to-end extraction benchmarks against the local stand-in server.
+
+Every scenario uploads a synthetic archive to the stand-in and runs
+``extract_to_auto`` on it in a fresh process, so peak memory is measured per
+scenario. Reports files/s, MB/s (extracted bytes), peak RSS and peak
+temp-disk use of the workspaces.
+
+Usage:
+    python benchmarks/run.py [scenario ...] [--scale 1] [--latency-ms 2]
+        [--bandwidth-mbps 0] [--no-bulk] [--local] [--set EXTRACT_UPLOAD_WORKERS=16] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LIB_DIR = os.path.join(BENCH_DIR, "..", "lib")
+sys.path.insert(0, BENCH_DIR)
+
+from archives import SCENARIOS, generate  # noqa: E402
+from stand_in import StandInServer  # noqa: E402
+
+USER = "bench"
+RESULT_PREFIX = "BENCHMARK_RESULT "
+SAMPLE_INTERVAL = 0.05
+
+
+def run_child(config: dict) -> None:
+    """Runs one extraction in this process, prints its measurements as JSON."""
+    sys.path.insert(0, LIB_DIR)
+    from nc_py_api import FsNode, NextcloudApp
+
+    import main
+    from workspace import WORKSPACES, directory_size
+
+    nc = NextcloudApp()
+    nc.set_user(USER)
+    node = FsNode(
+        f"files/{USER}/{config['path']}",
+        etag=config["etag"],
+        size=config["size"],
+        content_length=config["size"],
+        file_id=f"{config['file_id']:08d}ocstandin",
+        fileid=config["file_id"],
+        mimetype=config["mimetype"],
+        permissions="RGDNVW",
+    )
+    peak_disk = 0
+    done = threading.Event()
+
+    def sample_disk():
+        nonlocal peak_disk
+        while not done.is_set():
+            used = directory_size(WORKSPACES.root)
+            if main.LOCAL_WORKSPACES is not None:
+                used += directory_size(main.LOCAL_WORKSPACES.root)
+            peak_disk = max(peak_disk, used)
+            done.wait(SAMPLE_INTERVAL)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sampler = threading.Thread(target=sample_disk, daemon=True)
+    sampler.start()
+    start = time.monotonic()
+    error = None
+    try:
+        main.extract_to_auto(node, nc, USER, config["mode"])
+    except Exception as ex:
+        error = str(ex)
+    elapsed = time.monotonic() - start
+    done.set()
+    sampler.join()
+    main.shutdown_process_pool()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {
+        "seconds": elapsed,
+        "error": error,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "rss_growth_mb": (usage.ru_maxrss - rss_before) / 1024,
+        "peak_child_rss_mb": children.ru_maxrss / 1024,
+        "peak_temp_mb": peak_disk / 1048576,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def run_scenario(name: str, args, server: StandInServer, work_dir: str) -> dict:
+    file_name, mimetype, _ = SCENARIOS[name]
+    print(f"[{name}] generating archive (scale {args.scale:g})...", flush=True)
+    archive = generate(name, os.path.join(work_dir, "archives"), args.scale)
+    folder = f"files/{USER}/{name}"
+    shutil.rmtree(server.state.local_path(folder), ignore_errors=True)
+    local_archive = server.state.add_file(f"{folder}/{file_name}", archive)
+    workspace_dir = os.path.join(work_dir, "workspaces")
+    os.makedirs(workspace_dir, exist_ok=True)
+
+    env = dict(os.environ)
+    env.update(
+        {
+            "NEXTCLOUD_URL": server.url,
+            "APP_ID": "extract_archives_nc_py_api",
+            "APP_SECRET": "benchmark",
+            "APP_VERSION": "0.0.0",
+            "AA_VERSION": "2.6.0",
+            "EXTRACT_WORKSPACE_DIR": workspace_dir,
+        }
+    )
+    if args.local:
+        env["EXTRACT_DATA_DIR"] = server.root
+    env.update(dict(x.split("=", 1) for x in args.set))
+    config = {
+        "path": f"{name}/{file_name}",
+        "size": os.path.getsize(local_archive),
+        "etag": server.state.etag(local_archive),
+        "file_id": server.state.file_id(local_archive),
+        "mimetype": mimetype,
+        "mode": args.mode,
+    }
+    server.state.reset_counters()
+    print(f"[{name}] extracting...", flush=True)
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)],
+        env=env,
+        cwd=LIB_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    lines = [x for x in process.stdout.splitlines() if x.startswith(RESULT_PREFIX)]
+    if not lines:
+        print(process.stdout[-4000:])
+        raise RuntimeError(f"{name} did not report a result")
+    result = json.loads(lines[-1][len(RESULT_PREFIX) :])
+
+    files = 0
+    extracted_bytes = 0
+    for root, _, names in os.walk(server.state.local_path(folder)):
+        for x in names:
+            path = os.path.join(root, x)
+            if path != local_archive:
+                files += 1
+                extracted_bytes += os.path.getsize(path)
+    counters = server.state.counters()
+    seconds = max(result["seconds"], 1e-6)
+    result.update(
+        {
+            "scenario": name,
+            "archive_mb": config["size"] / 1048576,
+            "files": files,
+            "extracted_mb": extracted_bytes / 1048576,
+            "files_per_s": files / seconds,
+            "mb_per_s": extracted_bytes / 1048576 / seconds,
+            "requests": counters["requests"],
+            "notifications": len(counters["notifications"]),
+        }
+    )
+    if not args.keep:
+        shutil.rmtree(server.state.local_path(folder), ignore_errors=True)
+    return result
+
+
+def print_table(results: list) -> None:
+    # title, width, result key, number format
+    columns = [
+        ("files", 7, "files", "d"),
+        ("MB", 8, "extracted_mb", ".1f"),
+        ("seconds", 8, "seconds", ".2f"),
+        ("files/s", 9, "files_per_s", ".1f"),
+        ("MB/s", 7, "mb_per_s", ".1f"),
+        ("RSS MB", 7, "peak_rss_mb", ".0f"),
+        ("+RSS MB", 8, "rss_growth_mb", ".0f"),
+        ("temp MB", 8, "peak_temp_mb", ".1f"),
+        ("requests", 9, "requests", "d"),
+    ]
+    print("scenario".ljust(18), *(title.rjust(width) for title, width, _, _ in columns))
+    for result in results:
+        values = dict(result, requests=sum(result["requests"].values()))
+        print(
+            result["scenario"].ljust(18),
+            *(format(values[key], fmt).rjust(width) for _, width, key, fmt in columns),
+        )
+        if result["error"]:
+            print(f"    error: {result['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scenarios", nargs="*", help=", ".join(SCENARIOS))
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--latency-ms", type=float, default=2)
+    parser.add_argument("--bandwidth-mbps", type=float, default=0)
+    parser.add_argument(
+        "--no-bulk", action="store_true", help="stand-in without bulk upload"
+    )
+    parser.add_argument(
+        "--local", action="store_true", help="extract through the data directory"
+    )
+    parser.add_argument("--mode", default="auto", choices=("auto", "parent"))
+    parser.add_argument(
+        "--set", action="append", default=[], metavar="NAME=VALUE", help="app setting"
+    )
+    parser.add_argument("--work-dir", help="keeps generated archives between runs")
+    parser.add_argument("--keep", action="store_true", help="keep extracted files")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(json.loads(args.child))
+
+    scenarios = args.scenarios or list(SCENARIOS)
+    unknown = [x for x in scenarios if x not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="extract_bench_")
+    server = StandInServer(
+        os.path.join(work_dir, "server"),
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mbps * 125000,
+        bulk_upload=not args.no_bulk,
+    ).start()
+    os.makedirs(server.state.local_path(f"files/{USER}"), exist_ok=True)
+    results = []
+    try:
+        for name in scenarios:
+            results.append(run_scenario(name, args, server, work_dir))
+    finally:
+        server.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
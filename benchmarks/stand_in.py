@@ -0,0 +1,541 @@
+"""Local stand-in for the Nextcloud endpoints used by the ExApp.
+
+Implements enough of WebDAV (GET with Range, PUT, MKCOL, PROPFIND, MOVE,
+DELETE, both chunked upload flavours and bulk upload) and OCS (capabilities,
+log, notifications) to run extractions end to end without a Nextcloud server.
+Files are kept in a local directory laid out like Nextcloud's data directory. Every request is delayed by a fixed
+latency and every body is throttled to a bandwidth, to mimic a remote server.
+Authentication headers are accepted as they are.
+
+Usage: python benchmarks/stand_in.py [--port 8080] [--latency-ms 5] [--bandwidth-mbps 0]
+    [--no-bulk]
+"""
+
+import argparse
+import base64
+import email.utils
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+DAV_PREFIX = "/remote.php/dav"
+OCS_PREFIX = "/ocs/v1.php"
+READ_SIZE = 1024 * 1024
+
+
+class StandInState:
+    """Storage and counters shared by all request handlers."""
+
+    def __init__(
+        self,
+        root: str,
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        bulk_upload: bool = True,
+    ):
+        self.root = root
+        self.latency = latency
+        # bytes per second for each request body or response, 0 is unlimited
+        self.bandwidth = bandwidth
+        # advertise and serve /remote.php/dav/bulk
+        self.bulk_upload = bulk_upload
+        self.lock = threading.Lock()
+        self.file_ids = {}
+        self.checksums = {}
+        self.requests = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.notifications = []
+        self.log_messages = 0
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.notifications = []
+            self.log_messages = 0
+
+    def counters(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "notifications": list(self.notifications),
+                "log_messages": self.log_messages,
+            }
+
+    def local_path(self, dav_path: str) -> str:
+        """Maps ``files/<user>/...`` and ``uploads/<user>/...`` to ``<root>/<user>/files/...``
+        and ``<root>/<user>/uploads/...``, like a Nextcloud data directory."""
+        parts = [x for x in dav_path.split("/") if x not in ("", ".")]
+        if ".." in parts:
+            raise ValueError(f"Invalid path: {dav_path}")
+        if len(parts) >= 2 and parts[0] in ("files", "uploads"):
+            parts[0], parts[1] = parts[1], parts[0]
+        return os.path.join(self.root, *parts)
+
+    def dav_path(self, local_path: str) -> str:
+        """Inverse of :py:meth:`local_path`."""
+        parts = os.path.relpath(local_path, self.root).split(os.sep)
+        if len(parts) >= 2 and parts[1] in ("files", "uploads"):
+            parts[0], parts[1] = parts[1], parts[0]
+        return "/".join(parts)
+
+    def file_id(self, local_path: str) -> int:
+        with self.lock:
+            return self.file_ids.setdefault(local_path, len(self.file_ids) + 1)
+
+    def etag(self, local_path: str) -> str:
+        """Etag of a file or folder, without the quotes of the ETag header."""
+        return (
+            f"{int(os.path.getmtime(local_path) * 1000):x}{self.file_id(local_path):x}"
+        )
+
+    def put_file(self, dav_path: str, local_path: str) -> None:
+        """Registers the checksum of a file just written, like Nextcloud does on upload."""
+        digest = hashlib.sha1()
+        with open(local_path, "rb") as f:
+            for block in iter(lambda: f.read(READ_SIZE), b""):
+                digest.update(block)
+        with self.lock:
+            self.checksums[local_path] = digest.hexdigest()
+
+    def add_file(self, dav_path: str, source: str) -> str:
+        """Copies a local file into the storage, e.g. an archive to extract."""
+        local_path = self.local_path(dav_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        shutil.copyfile(source, local_path)
+        self.put_file(dav_path, local_path)
+        return local_path
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StandInState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- helpers ---
+
+    def _path(self) -> str:
+        return unquote(urlsplit(self.path).path)
+
+    def _count(self, kind: str) -> None:
+        """Counts a request and pays its latency, called first by every handler."""
+        with self.state.lock:
+            self.state.requests[kind] += 1
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+    def _throttle(self, size: int) -> None:
+        if self.state.bandwidth and size:
+            time.sleep(size / self.state.bandwidth)
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b"".join(parts)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+        self._throttle(len(body))
+        with self.state.lock:
+            self.state.bytes_in += len(body)
+        return body
+
+    def _send(self, code: int, body: bytes = b"", headers=None) -> None:
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self._throttle(len(body))
+            self.wfile.write(body)
+            with self.state.lock:
+                self.state.bytes_out += len(body)
+
+    def _send_ocs(self, data, code: int = 200) -> None:
+        body = {
+            "ocs": {
+                "meta": {"status": "ok", "statuscode": 100, "message": "OK"},
+                "data": data,
+            }
+        }
+        self._send(
+            code, json.dumps(body).encode(), {"Content-Type": "application/json"}
+        )
+
+    def _node_headers(self, local_path: str) -> dict:
+        file_id = self.state.file_id(local_path)
+        etag = f'"{self.state.etag(local_path)}"'
+        return {
+            "OC-FileId": f"{file_id:08d}ocstandin",
+            "OC-Etag": etag,
+            "ETag": etag,
+        }
+
+    def _dav_path(self) -> str:
+        path = self._path()
+        if not path.startswith(DAV_PREFIX + "/"):
+            raise ValueError(path)
+        return path[len(DAV_PREFIX) :]
+
+    def _set_mtime(self, local_path: str) -> None:
+        mtime = self.headers.get("X-OC-Mtime")
+        if mtime:
+            os.utime(local_path, (float(mtime), float(mtime)))
+
+    # --- OCS ---
+
+    def do_POST(self):
+        path = self._path()
+        body = self._read_body()
+        if path == DAV_PREFIX + "/bulk":
+            return self._bulk_upload(body)
+        self._count("OCS")
+        if path.endswith("/log"):
+            with self.state.lock:
+                self.state.log_messages += 1
+            return self._send_ocs([])
+        if path.endswith("/notification"):
+            with self.state.lock:
+                self.state.notifications.append(json.loads(body or b"{}"))
+            return self._send_ocs({"object_id": "standin"})
+        return self._send_ocs([])
+
+    def _ocs_get(self, path: str):
+        self._count("OCS")
+        if path.endswith("/cloud/capabilities"):
+            return self._send_ocs(
+                {
+                    "version": {
+                        "major": 30,
+                        "minor": 0,
+                        "micro": 0,
+                        "string": "30.0.0",
+                        "edition": "",
+                        "extendedSupport": False,
+                    },
+                    "capabilities": {
+                        "app_api": {"loglevel": 2, "version": "2.6.0"},
+                        "notifications": {"ocs-endpoints": ["list", "get"]},
+                        "files": {"bigfilechunking": True},
+                        "dav": dict(
+                            {"chunking": "1.0"},
+                            **({"bulkupload": "1.0"} if self.state.bulk_upload else {}),
+                        ),
+                    },
+                }
+            )
+        if path.endswith("/cloud/user"):
+            return self._send_ocs({"id": "bench"})
+        return self._send_ocs([])
+
+    # --- WebDAV ---
+
+    def do_GET(self):
+        path = self._path()
+        if path.startswith(OCS_PREFIX):
+            return self._ocs_get(path)
+        self._count("GET")
+        local_path = self.state.local_path(self._dav_path())
+        if not os.path.isfile(local_path):
+            return self._send(404)
+        size = os.path.getsize(local_path)
+        start, end = 0, size - 1
+        code = 200
+        headers = self._node_headers(local_path)
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first) if first else max(size - int(last), 0)
+            end = min(int(last), size - 1) if first and last else size - 1
+            code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        length = max(end - start + 1, 0)
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        with open(local_path, "rb") as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                data = f.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                self._throttle(len(data))
+                self.wfile.write(data)
+                remaining -= len(data)
+        with self.state.lock:
+            self.state.bytes_out += length
+
+    def do_PUT(self):
+        self._count("PUT")
+        dav_path = self._dav_path()
+        local_path = self.state.local_path(dav_path)
+        body = self._read_body()
+        if dav_path.startswith("/files/") and not os.path.isdir(
+            os.path.dirname(local_path)
+        ):
+            return self._send(409)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        existed = os.path.exists(local_path)
+        with open(local_path, "wb") as f:
+            f.write(body)
+        if dav_path.startswith("/files/"):
+            self._set_mtime(local_path)
+            self.state.put_file(dav_path, local_path)
+        headers = self._node_headers(local_path)
+        if self.headers.get("X-OC-Mtime"):
+            headers["X-OC-Mtime"] = "accepted"
+        self._send(204 if existed else 201, headers=headers)
+
+    def _bulk_upload(self, body: bytes):
+        """Stores the parts of a multipart/related body, answers per file like Nextcloud."""
+        self._count("BULK")
+        if not self.state.bulk_upload:
+            return self._send(404)
+        auth = base64.b64decode(self.headers.get("AUTHORIZATION-APP-API", "")).decode()
+        user = auth.split(":", 1)[0]
+        boundary = self.headers.get("Content-Type", "").partition("boundary=")[2]
+        delimiter = b"--" + boundary.strip('"').encode()
+        results = {}
+        offset = body.index(delimiter)
+        while True:
+            offset += len(delimiter)
+            if body[offset : offset + 2] == b"--":
+                break
+            headers_end = body.index(b"\r\n\r\n", offset)
+            headers = {}
+            for line in body[offset:headers_end].decode().split("\r\n"):
+                if ":" in line:
+                    key, _, value = line.partition(":")
+                    headers[key.strip().lower()] = value.strip()
+            start = headers_end + 4
+            data = body[start : start + int(headers["content-length"])]
+            offset = body.index(delimiter, start + len(data))
+            path = headers["x-file-path"]
+            dav_path = f"/files/{user}{path}"
+            local_path = self.state.local_path(dav_path)
+            if hashlib.md5(data).hexdigest() != headers.get("x-file-md5"):
+                results[path] = {
+                    "error": True,
+                    "message": "Computed md5 hash is incorrect.",
+                }
+                continue
+            if not os.path.isdir(os.path.dirname(local_path)):
+                results[path] = {"error": True, "message": "Parent folder not found."}
+                continue
+            with open(local_path, "wb") as f:
+                f.write(data)
+            mtime = headers.get("x-file-mtime")
+            if mtime:
+                os.utime(local_path, (float(mtime), float(mtime)))
+            self.state.put_file(dav_path, local_path)
+            node = self._node_headers(local_path)
+            results[path] = {
+                "error": False,
+                "etag": node["ETag"],
+                "fileid": node["OC-FileId"],
+                "permissions": 27,
+            }
+        self._send(
+            200, json.dumps(results).encode(), {"Content-Type": "application/json"}
+        )
+
+    def do_MKCOL(self):
+        self._count("MKCOL")
+        self._read_body()
+        dav_path = self._dav_path()
+        local_path = self.state.local_path(dav_path)
+        if os.path.exists(local_path):
+            return self._send(405)
+        if dav_path.startswith("/uploads/"):
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        if not os.path.isdir(os.path.dirname(local_path)):
+            return self._send(409)
+        os.mkdir(local_path)
+        self._send(201, headers=self._node_headers(local_path))
+
+    def do_DELETE(self):
+        self._count("DELETE")
+        local_path = self.state.local_path(self._dav_path())
+        if os.path.isdir(local_path):
+            shutil.rmtree(local_path)
+        elif os.path.exists(local_path):
+            os.remove(local_path)
+        else:
+            return self._send(404)
+        self._send(204)
+
+    def do_MOVE(self):
+        self._count("MOVE")
+        self._read_body()
+        source = self._dav_path()
+        destination = unquote(urlsplit(self.headers["Destination"]).path)
+        destination = destination[destination.index(DAV_PREFIX) + len(DAV_PREFIX) :]
+        target = self.state.local_path(destination)
+        if not os.path.isdir(os.path.dirname(target)):
+            return self._send(409)
+        existed = os.path.exists(target)
+        if source.startswith("/uploads/") and source.endswith("/.file"):
+            upload = self.state.local_path(os.path.dirname(source))
+            if not os.path.isdir(upload):
+                return self._send(404)
+            chunks = sorted(
+                os.listdir(upload), key=lambda x: (len(x), x) if x.isdigit() else (0, x)
+            )
+            with open(target, "wb") as f:
+                for chunk in chunks:
+                    with open(os.path.join(upload, chunk), "rb") as part:
+                        shutil.copyfileobj(part, f, READ_SIZE)
+            shutil.rmtree(upload)
+        else:
+            shutil.move(self.state.local_path(source), target)
+        self._set_mtime(target)
+        if os.path.isfile(target):
+            self.state.put_file(destination, target)
+        self._send(204 if existed else 201, headers=self._node_headers(target))
+
+    def do_PROPFIND(self):
+        self._count("PROPFIND")
+        self._read_body()
+        dav_path = self._dav_path()
+        local_path = self.state.local_path(dav_path)
+        if not os.path.exists(local_path):
+            return self._send(404)
+        depth = self.headers.get("Depth", "1")
+        paths = [local_path]
+        if os.path.isdir(local_path) and depth != "0":
+            if depth == "1":
+                paths += [os.path.join(local_path, x) for x in os.listdir(local_path)]
+            else:
+                for root, dirs, files in os.walk(local_path):
+                    paths += [os.path.join(root, x) for x in dirs + files]
+        responses = "".join(self._propfind_response(x) for x in paths)
+        body = (
+            '<?xml version="1.0"?><d:multistatus xmlns:d="DAV:" '
+            'xmlns:oc="http://owncloud.org/ns" xmlns:nc="http://nextcloud.org/ns">'
+            f"{responses}</d:multistatus>"
+        ).encode()
+        self._send(207, body, {"Content-Type": "application/xml; charset=utf-8"})
+
+    def _propfind_response(self, local_path: str) -> str:
+        is_dir = os.path.isdir(local_path)
+        href = quote(
+            f"{DAV_PREFIX}/{self.state.dav_path(local_path)}" + ("/" if is_dir else "")
+        )
+        headers = self._node_headers(local_path)
+        mtime = email.utils.formatdate(os.path.getmtime(local_path), usegmt=True)
+        props = [
+            f"<d:getlastmodified>{mtime}</d:getlastmodified>",
+            f"<d:getetag>{escape(headers['ETag'])}</d:getetag>",
+            f"<oc:fileid>{self.state.file_id(local_path)}</oc:fileid>",
+            f"<oc:id>{headers['OC-FileId']}</oc:id>",
+            "<oc:permissions>RGDNVW</oc:permissions>",
+        ]
+        if is_dir:
+            props.append("<d:resourcetype><d:collection/></d:resourcetype>")
+        else:
+            props.append("<d:resourcetype/>")
+            props.append(
+                f"<d:getcontentlength>{os.path.getsize(local_path)}</d:getcontentlength>"
+            )
+            checksum = self.state.checksums.get(local_path)
+            if checksum:
+                props.append(
+                    f"<oc:checksums><oc:checksum>SHA1:{checksum}</oc:checksum></oc:checksums>"
+                )
+        return (
+            f"<d:response><d:href>{href}</d:href><d:propstat><d:prop>{''.join(props)}"
+            "</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+        )
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # many clients connect at once, the default backlog of 5 stalls them in SYN retries
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # clients closing pooled connections are expected, not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandInServer:
+    """Runs the stand-in in a background thread."""
+
+    def __init__(
+        self,
+        root: str = None,
+        port: int = 0,
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        bulk_upload: bool = True,
+    ):
+        self.root = root or tempfile.mkdtemp(prefix="nc_stand_in_")
+        self.state = StandInState(self.root, latency, bandwidth, bulk_upload)
+        handler = type("Handler", (StandInHandler,), {"state": self.state})
+        self.server = _Server(("127.0.0.1", port), handler)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--root", help="storage directory, a temp directory by default")
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--bandwidth-mbps", type=float, default=0)
+    parser.add_argument("--no-bulk", action="store_true", help="no bulk upload")
+    args = parser.parse_args()
+    server = StandInServer(
+        args.root,
+        args.port,
+        args.latency_ms / 1000,
+        args.bandwidth_mbps * 125000,
+        not args.no_bulk,
+    )
+    print(f"Serving {server.root} on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Buffered logging to the Nextcloud log.
+
+Every ``nc.log`` call is a synchronous OCS request, so messages are queued here
+and sent in batches from a background thread instead.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from nc_py_api import NextcloudApp
+from nc_py_api.ex_app import LogLvl
+
+# Seconds between two flushes of the log buffer.
+LOG_FLUSH_INTERVAL = float(os.environ.get("EXTRACT_LOG_FLUSH_INTERVAL", "2"))
+# Messages joined into one request to the Nextcloud log.
+LOG_BATCH_SIZE = int(os.environ.get("EXTRACT_LOG_BATCH_SIZE", "50"))
+# Per-file messages sent per flush, the rest are only counted.
+LOG_PER_FILE_LIMIT = int(os.environ.get("EXTRACT_LOG_PER_FILE_LIMIT", "20"))
+# Messages kept in memory while waiting for a flush, newer ones are dropped.
+LOG_MAX_BUFFERED = int(os.environ.get("EXTRACT_LOG_MAX_BUFFERED", "10000"))
+# Seconds the server's log level is cached for.
+LOG_LEVEL_REFRESH = 300
+
+_QUEUE = deque()
+_LOCK = threading.Lock()
+_WAKEUP = threading.Event()
+_FLUSHED = threading.Condition(_LOCK)
+_STATE = {"thread": None, "level": None, "level_time": 0.0, "dropped": 0, "pending": 0}
+
+
+def _server_log_level(nc: NextcloudApp):
+    if (
+        _STATE["level"] is None
+        or time.monotonic() - _STATE["level_time"] > LOG_LEVEL_REFRESH
+    ):
+        try:
+            _STATE["level"] = int(nc.capabilities["app_api"].get("loglevel", 0))
+        except Exception:
+            _STATE["level"] = int(LogLvl.DEBUG)
+        _STATE["level_time"] = time.monotonic()
+    return _STATE["level"]
+
+
+def app_log(
+    nc: NextcloudApp, log_lvl: LogLvl, content: str, per_file: bool = False
+) -> None:
+    """Queues a message for the Nextcloud log, never waits for the network.
+
+    :param per_file: the message is one of many similar per-file messages, above
+        ``EXTRACT_LOG_PER_FILE_LIMIT`` per flush they are summarized as a count.
+    """
+    level = _STATE["level"]
+    if level is not None and int(log_lvl) < level:
+        return
+    with _LOCK:
+        if len(_QUEUE) >= LOG_MAX_BUFFERED:
+            _STATE["dropped"] += 1
+            return
+        _QUEUE.append((nc, int(log_lvl), content, per_file))
+        _STATE["pending"] += 1
+        if _STATE["thread"] is None:
+            _STATE["thread"] = threading.Thread(
+                target=_flush_loop, name="app_log", daemon=True
+            )
+            _STATE["thread"].start()
+    if len(_QUEUE) >= LOG_BATCH_SIZE:
+        _WAKEUP.set()
+
+
+def flush_logs(timeout: float = 0) -> None:
+    """Asks the background thread to send queued messages now.
+
+    :param timeout: seconds to wait for the queue to be sent, ``0`` does not wait.
+    """
+    _WAKEUP.set()
+    if timeout:
+        with _LOCK:
+            _FLUSHED.wait_for(lambda: not _STATE["pending"], timeout=timeout)
+
+
+def _flush_loop() -> None:
+    while True:
+        _WAKEUP.wait(LOG_FLUSH_INTERVAL)
+        _WAKEUP.clear()
+        with _LOCK:
+            messages = list(_QUEUE)
+            _QUEUE.clear()
+            dropped, _STATE["dropped"] = _STATE["dropped"], 0
+        if messages:
+            try:
+                _send(messages, dropped)
+            except Exception as ex:
+                print(f"Error sending logs: {ex}")
+        with _LOCK:
+            _STATE["pending"] -= len(messages)
+            _FLUSHED.notify_all()
+
+
+def _send(messages: list, dropped: int) -> None:
+    level = _server_log_level(messages[0][0])
+    batches = {}  # (nc, level) -> list of messages, in order of appearance
+    per_file_sent = 0
+    suppressed = {}
+    for nc, log_lvl, content, per_file in messages:
+        if log_lvl < level:
+            continue
+        if per_file:
+            if per_file_sent >= LOG_PER_FILE_LIMIT:
+                suppressed[(nc, log_lvl)] = suppressed.get((nc, log_lvl), 0) + 1
+                continue
+            per_file_sent += 1
+        batches.setdefault((nc, log_lvl), []).append(content)
+
+    for (nc, log_lvl), count in suppressed.items():
+        batches.setdefault((nc, log_lvl), []).append(
+            f"... {count} more per-file messages suppressed"
+        )
+    if dropped:
+        nc, log_lvl = next(iter(batches), (messages[-1][0], int(LogLvl.WARNING)))
+        batches.setdefault((nc, log_lvl), []).append(
+            f"... {dropped} log messages dropped, log buffer was full"
+        )
+
+    for (nc, log_lvl), contents in batches.items():
+        for i in range(0, len(contents), LOG_BATCH_SIZE):
+            nc.log(
+                LogLvl(log_lvl),
+                "\n".join(contents[i : i + LOG_BATCH_SIZE]),
+                fast_send=True,
+            )
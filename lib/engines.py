@@ -0,0 +1,376 @@
+"""In-process archive format engines.
+
+Each engine lists the entries of one family of formats and streams its regular
+files in archive order. Formats without an engine are extracted with pyunpack.
+"""
+
+import bz2
+import contextlib
+import fnmatch
+import gzip
+import lzma
+import os
+import struct
+import tarfile
+import time
+import typing
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Uncompressed bytes assumed per compressed byte where a format does not record the size.
+ESTIMATED_COMPRESSION_RATIO = 4
+
+# gzip records the uncompressed size modulo 2^32
+GZIP_ISIZE_MODULO = 2**32
+
+
+class ArchiveEntry(typing.NamedTuple):
+    name: str
+    size: int
+    compressed_size: int
+    is_dir: bool
+    mtime: float
+
+
+class ArchiveEngine:
+    """Base class of the format engines, see :py:func:`register_engine`."""
+
+    name = ""
+    mimetypes: tuple = ()
+
+    def __init__(self, path):
+        # engines that read from a seekable file object accept one instead of a path,
+        # engines reading front to back accept a callable opening a new stream per pass
+        self.path = path if hasattr(path, "read") or callable(path) else str(path)
+
+    @classmethod
+    def detect(cls, path) -> bool:
+        """Returns ``True`` if the file at ``path`` can be read by this engine."""
+        raise NotImplementedError()
+
+    def entries(self) -> list:
+        """Returns all entries (files and folders) of the archive."""
+        raise NotImplementedError()
+
+    def iter_files(
+        self, names: typing.Optional[set] = None
+    ) -> typing.Iterator[typing.Tuple[ArchiveEntry, typing.BinaryIO]]:
+        """Yields regular files with a reader, valid until the next file is requested.
+
+        :param names: only files with these entry names are yielded and read.
+        """
+        raise NotImplementedError()
+
+
+ENGINES: list = []
+
+
+def register_engine(engine: typing.Type[ArchiveEngine]):
+    ENGINES.append(engine)
+    return engine
+
+
+def get_engine(path) -> typing.Optional[ArchiveEngine]:
+    """Returns an engine for the archive at ``path`` or ``None`` if no engine can read it."""
+    for engine in ENGINES:
+        try:
+            if engine.detect(path):
+                return engine(path)
+        except OSError:
+            continue
+    return None
+
+
+def supported_mimetypes() -> list:
+    return sorted({mime for engine in ENGINES for mime in engine.mimetypes})
+
+
+def safe_entry_path(destination_path, name: str) -> typing.Optional[str]:
+    """Returns where an entry is extracted to, ``None`` for names leaving the destination."""
+    parts = [x for x in name.replace("\\", "/").split("/") if x not in ("", ".")]
+    if not parts or ".." in parts or ":" in parts[0]:
+        return None
+    return os.path.join(destination_path, *parts)
+
+
+def normalize_entry_name(name: str) -> str:
+    return "/".join(x for x in name.replace("\\", "/").split("/") if x not in ("", "."))
+
+
+def is_selected(name: str, patterns=(), names=()) -> bool:
+    """Matches an entry or extracted file path against a selection.
+
+    :param patterns: glob patterns matched against the whole path, see :py:func:`glob_match`.
+    :param names: entry names, a folder selects everything below it.
+    """
+    name = normalize_entry_name(name)
+    for selected in names:
+        selected = normalize_entry_name(selected)
+        if name == selected or name.startswith(selected + "/"):
+            return True
+    return any(glob_match(name, pattern) for pattern in patterns)
+
+
+def glob_match(name: str, pattern: str) -> bool:
+    """Matches a path against a glob one segment at a time.
+
+    ``*``, ``?`` and ``[...]`` never match a ``/``, so ``docs/*`` selects the files
+    directly in ``docs``. A ``**`` segment matches any number of folders, e.g.
+    ``docs/**`` or ``**/*.jpg``.
+    """
+    return _match_segments(
+        normalize_entry_name(name).split("/"),
+        normalize_entry_name(pattern).split("/"),
+    )
+
+
+def _match_segments(parts: list, pattern: list) -> bool:
+    if not pattern:
+        return not parts
+    if pattern[0] == "**":
+        return any(
+            _match_segments(parts[i:], pattern[1:]) for i in range(len(parts) + 1)
+        )
+    return (
+        bool(parts)
+        and fnmatch.fnmatchcase(parts[0], pattern[0])
+        and _match_segments(parts[1:], pattern[1:])
+    )
+
+
+def select_entries(entries, patterns=(), names=()) -> list:
+    return [x for x in entries if is_selected(x.name, patterns, names)]
+
+
+def _read_magic(path, size: int = 6) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(size)
+
+
+@register_engine
+class ZipEngine(ArchiveEngine):
+    """Zip archives, from a path or any seekable file object."""
+
+    name = "zip"
+    mimetypes = ("application/zip", "application/x-zip-compressed")
+
+    @classmethod
+    def detect(cls, path) -> bool:
+        return zipfile.is_zipfile(path)
+
+    def entries(self) -> list:
+        with zipfile.ZipFile(self.path, "r") as zip_ref:
+            return [self._entry(info) for info in zip_ref.infolist()]
+
+    def iter_files(self, names=None):
+        with zipfile.ZipFile(self.path, "r") as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir() or (names is not None and info.filename not in names):
+                    continue
+                with zip_ref.open(info) as reader:
+                    yield self._entry(info), reader
+
+    @staticmethod
+    def _entry(info: zipfile.ZipInfo) -> ArchiveEntry:
+        try:
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+        except (OverflowError, ValueError):
+            mtime = 0.0
+        return ArchiveEntry(
+            info.filename, info.file_size, info.compress_size, info.is_dir(), mtime
+        )
+
+
+@register_engine
+class TarEngine(ArchiveEngine):
+    """Plain, gzip, bzip2 and xz compressed tar archives."""
+
+    name = "tar"
+    mimetypes = (
+        "application/x-tar",
+        "application/x-gtar",
+        "application/x-compressed-tar",
+        "application/x-bzip-compressed-tar",
+        "application/x-xz-compressed-tar",
+    )
+
+    @classmethod
+    def detect(cls, path) -> bool:
+        return tarfile.is_tarfile(path)
+
+    @contextlib.contextmanager
+    def _open(self) -> typing.Iterator[tarfile.TarFile]:
+        # stream mode reads the archive once, front to back
+        if not callable(self.path):
+            with tarfile.open(self.path, "r|*") as tar:
+                yield tar
+            return
+        with self.path() as stream, tarfile.open(fileobj=stream, mode="r|*") as tar:
+            yield tar
+
+    def entries(self) -> list:
+        with self._open() as tar:
+            return [
+                self._entry(member)
+                for member in tar
+                if member.isfile() or member.isdir()
+            ]
+
+    def iter_files(self, names=None):
+        with self._open() as tar:
+            for member in tar:
+                if not member.isfile() or (
+                    names is not None and member.name not in names
+                ):
+                    continue
+                reader = tar.extractfile(member)
+                yield self._entry(member), reader
+
+    @staticmethod
+    def _entry(member: tarfile.TarInfo) -> ArchiveEntry:
+        return ArchiveEntry(
+            member.name,
+            member.size,
+            member.size,
+            member.isdir(),
+            float(member.mtime),
+        )
+
+
+@register_engine
+class CompressedFileEngine(ArchiveEngine):
+    """A single gzip, bzip2 or xz compressed file, extracted without its extension."""
+
+    name = "compressed"
+    mimetypes = (
+        "application/gzip",
+        "application/x-gzip",
+        "application/x-bzip2",
+        "application/x-xz",
+    )
+    openers = {
+        b"\x1f\x8b": gzip.open,
+        b"BZh": bz2.open,
+        b"\xfd7zXZ\x00": lzma.open,
+    }
+
+    @classmethod
+    def detect(cls, path) -> bool:
+        return cls._opener(_read_magic(path)) is not None
+
+    @classmethod
+    def _opener(cls, magic: bytes):
+        for prefix, opener in cls.openers.items():
+            if magic.startswith(prefix):
+                return opener
+        return None
+
+    def _entry(self) -> ArchiveEntry:
+        name = os.path.basename(self.path)
+        stem, ext = os.path.splitext(name)
+        compressed_size = os.path.getsize(self.path)
+        # bzip2 and xz do not record the size, it is estimated
+        size = compressed_size * ESTIMATED_COMPRESSION_RATIO
+        if self._opener(_read_magic(self.path)) is gzip.open and compressed_size >= 4:
+            with open(self.path, "rb") as f:
+                f.seek(-4, os.SEEK_END)
+                isize = struct.unpack("<I", f.read(4))[0]
+            # the ISIZE trailer is exact unless the size may have wrapped around
+            if size < GZIP_ISIZE_MODULO:
+                size = isize
+            else:
+                size = max(isize, size)
+        return ArchiveEntry(
+            stem if ext else name + ".out",
+            size,
+            compressed_size,
+            False,
+            os.path.getmtime(self.path),
+        )
+
+    def entries(self) -> list:
+        return [self._entry()]
+
+    def iter_files(self, names=None):
+        entry = self._entry()
+        if names is not None and entry.name not in names:
+            return
+        with self._opener(_read_magic(self.path))(self.path, "rb") as reader:
+            yield entry, reader
+
+
+if zstandard is not None:
+
+    @register_engine
+    class ZstdEngine(ArchiveEngine):
+        """Zstandard compressed tar archives and single files."""
+
+        name = "zstd"
+        mimetypes = ("application/zstd", "application/x-zstd-compressed-tar")
+        magic = b"\x28\xb5\x2f\xfd"
+
+        @classmethod
+        def detect(cls, path) -> bool:
+            return _read_magic(path, 4) == cls.magic
+
+        def _open_stream(self):
+            return zstandard.open(self.path, "rb")
+
+        def _is_tar(self) -> bool:
+            with self._open_stream() as stream:
+                header = stream.read(tarfile.BLOCKSIZE)
+            try:
+                tarfile.TarInfo.frombuf(header, tarfile.ENCODING, "surrogateescape")
+                return True
+            except tarfile.HeaderError:
+                return False
+
+        def _single_entry(self) -> ArchiveEntry:
+            stem, ext = os.path.splitext(os.path.basename(self.path))
+            compressed_size = os.path.getsize(self.path)
+            try:
+                # a frame header, at most 18 bytes, has the size unless the file was
+                # compressed as a stream
+                size = zstandard.frame_content_size(_read_magic(self.path, 18))
+            except zstandard.ZstdError:
+                size = -1
+            if size < 0:
+                size = compressed_size * ESTIMATED_COMPRESSION_RATIO
+            return ArchiveEntry(
+                stem if ext else stem + ".out",
+                size,
+                compressed_size,
+                False,
+                os.path.getmtime(self.path),
+            )
+
+        def entries(self) -> list:
+            if not self._is_tar():
+                return [self._single_entry()]
+            with self._open_stream() as stream:
+                with tarfile.open(fileobj=stream, mode="r|") as tar:
+                    return [
+                        TarEngine._entry(member)
+                        for member in tar
+                        if member.isfile() or member.isdir()
+                    ]
+
+        def iter_files(self, names=None):
+            if not self._is_tar():
+                entry = self._single_entry()
+                if names is None or entry.name in names:
+                    with self._open_stream() as reader:
+                        yield entry, reader
+                return
+            with self._open_stream() as stream:
+                with tarfile.open(fileobj=stream, mode="r|") as tar:
+                    for member in tar:
+                        if not member.isfile() or (
+                            names is not None and member.name not in names
+                        ):
+                            continue
+                        yield TarEngine._entry(member), tar.extractfile(member)
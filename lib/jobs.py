@@ -0,0 +1,439 @@
+"""Persistent extraction job queue backed by SQLite."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from collections import deque
+
+from nc_py_api.ex_app import persistent_storage
+
+from metrics import JOB_WAIT_SECONDS, JOBS_FINISHED, PHASE_SECONDS
+
+# Extraction jobs running at the same time.
+JOB_WORKERS = int(os.environ.get("EXTRACT_JOB_WORKERS", "2"))
+# Jobs waiting in the queue, further jobs are refused.
+JOB_QUEUE_LIMIT = int(os.environ.get("EXTRACT_JOB_QUEUE_LIMIT", "100"))
+# Jobs waiting or running for one user, further jobs of this user are refused.
+JOB_USER_LIMIT = int(os.environ.get("EXTRACT_JOB_USER_LIMIT", "10"))
+# Starts of a job, a job still unfinished after that many is marked failed on the next start.
+JOB_MAX_ATTEMPTS = int(os.environ.get("EXTRACT_JOB_MAX_ATTEMPTS", "3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+# Seconds of history used for the current transfer rate.
+RATE_WINDOW = 10
+
+# Uploaded entries written to the journal at once, or after JOURNAL_FLUSH_SECONDS.
+JOURNAL_FLUSH_ENTRIES = 200
+JOURNAL_FLUSH_SECONDS = 2.0
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is refused by the admission control."""
+
+
+class JobProgress:
+    """Live counters of a running job, updated from the extraction pipeline."""
+
+    def __init__(self):
+        self.phase = QUEUED
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.started = time.monotonic()
+        self._phase_started = None
+        self._lock = threading.Lock()
+        self._samples = deque()
+
+    def set_phase(self, phase: str, bytes_total: int = 0, files_total: int = 0) -> None:
+        """Starts a new phase (download, analyze, extract, upload) with fresh counters.
+
+        The duration of the previous phase is recorded in ``extract_phase_seconds``.
+        """
+        with self._lock:
+            self._end_phase()
+            self._phase_started = time.monotonic()
+            self.phase = phase
+            self.bytes_total = bytes_total
+            self.files_total = files_total
+            self.bytes_done = 0
+            self.files_done = 0
+            self.files_failed = 0
+            self._samples.clear()
+            self._samples.append((time.monotonic(), 0))
+
+    def extend(self, bytes_total: int = 0, files_total: int = 0) -> None:
+        """Adds work discovered during the current phase, e.g. the content of nested archives."""
+        with self._lock:
+            self.bytes_total += bytes_total
+            self.files_total += files_total
+
+    def end_phase(self) -> None:
+        """Records the duration of the current phase, once."""
+        with self._lock:
+            self._end_phase()
+
+    def _end_phase(self) -> None:
+        if self._phase_started is not None:
+            PHASE_SECONDS.observe(
+                time.monotonic() - self._phase_started, phase=self.phase
+            )
+            self._phase_started = None
+
+    def add(self, bytes_done: int = 0, files_done: int = 0, files_failed: int = 0):
+        with self._lock:
+            self.bytes_done += bytes_done
+            self.files_done += files_done
+            self.files_failed += files_failed
+            now = time.monotonic()
+            self._samples.append((now, self.bytes_done))
+            while len(self._samples) > 2 and now - self._samples[1][0] > RATE_WINDOW:
+                self._samples.popleft()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            rate = 0.0
+            if self._samples:
+                first_time, first_bytes = self._samples[0]
+                if now > first_time:
+                    rate = (self.bytes_done - first_bytes) / (now - first_time)
+            eta = None
+            if rate > 0 and self.bytes_total > self.bytes_done:
+                eta = round((self.bytes_total - self.bytes_done) / rate, 1)
+            return {
+                "phase": self.phase,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "files_failed": self.files_failed,
+                "mb_per_s": round(rate / 1048576, 3),
+                "eta_seconds": eta,
+                "elapsed_seconds": round(now - self.started, 1),
+            }
+
+
+class EntryJournal:
+    """Entries of one archive a job has uploaded, so the job skips them when it is run again.
+
+    The archive is identified by fileId and etag, a changed archive starts with an
+    empty journal. Acknowledgements are written in batches, those lost to a crash
+    are only uploaded again.
+    """
+
+    def __init__(self, queue: "JobQueue", job_id: str, archive: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.archive = archive
+        self.done = queue._journal_entries(job_id, archive)
+        self._pending = []
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def ack(self, path: str) -> None:
+        with self._lock:
+            self._pending.append(path)
+            if (
+                len(self._pending) < JOURNAL_FLUSH_ENTRIES
+                and time.monotonic() - self._flushed < JOURNAL_FLUSH_SECONDS
+            ):
+                return
+            pending, self._pending = self._pending, []
+            self._flushed = time.monotonic()
+        self.queue._journal_add(self.job_id, self.archive, pending)
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._flushed = time.monotonic()
+        if pending:
+            self.queue._journal_add(self.job_id, self.archive, pending)
+
+    def discard(self) -> None:
+        """Forgets the archive's entries, they belong to content that is gone."""
+        with self._lock:
+            self._pending = []
+            self.done = set()
+        self.queue._journal_remove(self.job_id, self.archive)
+
+
+class JobQueue:
+    """Runs jobs with a fixed number of worker threads, keeping their state in SQLite.
+
+    Jobs that were queued or running when the process stopped are run again on start.
+    """
+
+    def __init__(
+        self,
+        handler,
+        db_path: typing.Optional[str] = None,
+        workers: int = JOB_WORKERS,
+        queue_limit: int = JOB_QUEUE_LIMIT,
+        user_limit: int = JOB_USER_LIMIT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.user_limit = user_limit
+        self.max_attempts = max(1, max_attempts)
+        self._db = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._threads = []
+        self._progress = {}
+
+    def start(self) -> None:
+        if self.db_path is None:
+            self.db_path = jobs_db_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._db = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None
+        )
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, action TEXT NOT NULL, "
+                "payload TEXT NOT NULL, state TEXT NOT NULL, created REAL NOT NULL, "
+                "started REAL, finished REAL, error TEXT, progress TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            for column in ("progress TEXT", "attempts INTEGER NOT NULL DEFAULT 0"):
+                try:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    pass  # column already exists
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_entries ("
+                "job_id TEXT NOT NULL, archive TEXT NOT NULL, path TEXT NOT NULL, "
+                "PRIMARY KEY (job_id, archive, path)) WITHOUT ROWID"
+            )
+            given_up = self._db.execute(
+                "SELECT id, action FROM jobs WHERE state = ? AND attempts >= ?",
+                (RUNNING, self.max_attempts),
+            ).fetchall()
+            for row in given_up:
+                JOBS_FINISHED.inc(action=row["action"], state=FAILED)
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, finished = ?, error = ? WHERE id = ?",
+                    (
+                        FAILED,
+                        time.time(),
+                        f"Stopped after {self.max_attempts} attempts",
+                        row["id"],
+                    ),
+                )
+                self._db.execute(
+                    "DELETE FROM job_entries WHERE job_id = ?", (row["id"],)
+                )
+            self._db.execute(
+                "UPDATE jobs SET state = ?, started = NULL WHERE state = ?",
+                (QUEUED, RUNNING),
+            )
+        self._stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"job_worker_{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10) -> None:
+        """Stops taking new jobs and waits up to ``timeout`` seconds for running ones.
+
+        Jobs still running, or failing because the app shuts down under them, stay
+        RUNNING with their journal and are resumed on the next start.
+        """
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+
+    def enqueue(self, user_id: str, action: str, payload: dict) -> str:
+        """Adds a job to the queue and returns its ID.
+
+        :raises JobQueueFull: the queue or the user's share of it is full.
+        """
+        with self._lock:
+            queued = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = ?", (QUEUED,)
+            ).fetchone()[0]
+            if queued >= self.queue_limit:
+                raise JobQueueFull(f"{queued} jobs are already waiting")
+            user_jobs = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND state IN (?, ?)",
+                (user_id, QUEUED, RUNNING),
+            ).fetchone()[0]
+            if user_jobs >= self.user_limit:
+                raise JobQueueFull(f"{user_id} already has {user_jobs} jobs")
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO jobs (id, user_id, action, payload, state, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, action, json.dumps(payload), QUEUED, time.time()),
+            )
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._with_progress(_job_from_row(row)) if row else None
+
+    def list(self, user_id: str, limit: int = 100) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE user_id = ? ORDER BY created DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        return [self._with_progress(_job_from_row(row)) for row in rows]
+
+    def counts(self) -> dict:
+        """Returns the number of queued and running jobs."""
+        with self._lock:
+            if self._db is None:
+                return {QUEUED: 0, RUNNING: 0}
+            rows = self._db.execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE state IN (?, ?) GROUP BY state",
+                (QUEUED, RUNNING),
+            ).fetchall()
+        return {QUEUED: 0, RUNNING: 0, **{row[0]: row[1] for row in rows}}
+
+    def journal(self, job_id: str, archive: str) -> EntryJournal:
+        """Returns the journal of a job's archive, ``archive`` is its fileId and etag."""
+        return EntryJournal(self, job_id, archive)
+
+    def _journal_entries(self, job_id: str, archive: str) -> set:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM job_entries WHERE job_id = ? AND archive = ?",
+                (job_id, archive),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def _journal_add(self, job_id: str, archive: str, paths: list) -> None:
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO job_entries (job_id, archive, path) "
+                "VALUES (?, ?, ?)",
+                [(job_id, archive, x) for x in paths],
+            )
+            self._db.execute("COMMIT")
+
+    def _journal_remove(self, job_id: str, archive: str) -> None:
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute(
+                "DELETE FROM job_entries WHERE job_id = ? AND archive = ?",
+                (job_id, archive),
+            )
+
+    def _with_progress(self, job: dict) -> dict:
+        progress = self._progress.get(job["id"])
+        if progress is not None:
+            job["progress"] = progress.snapshot()
+        return job
+
+    def _claim(self):
+        with self._lock:
+            while not self._stopping:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE state = ? ORDER BY created LIMIT 1",
+                    (QUEUED,),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET state = ?, started = ?, attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (RUNNING, time.time(), row["id"]),
+                    )
+                    self._progress[row["id"]] = JobProgress()
+                    JOB_WAIT_SECONDS.observe(max(time.time() - row["created"], 0))
+                    return _job_from_row(row)
+                self._wakeup.wait(5)
+        return None
+
+    def _finish(self, job: dict, state: str, error=None) -> None:
+        job_id = job["id"]
+        JOBS_FINISHED.inc(action=job["action"], state=state)
+        with self._lock:
+            progress = self._progress.pop(job_id)
+            progress.end_phase()
+            progress.phase = state
+            self._db.execute(
+                "UPDATE jobs SET state = ?, finished = ?, error = ?, progress = ? "
+                "WHERE id = ?",
+                (state, time.time(), error, json.dumps(progress.snapshot()), job_id),
+            )
+            self._db.execute("DELETE FROM job_entries WHERE job_id = ?", (job_id,))
+
+    def _interrupt(self, job: dict) -> None:
+        """Leaves a job stopped by the shutdown RUNNING, the stop does not count as an attempt."""
+        job_id = job["id"]
+        print(f"Job {job_id} was stopped, it is resumed on the next start")
+        with self._lock:
+            progress = self._progress.pop(job_id)
+            progress.end_phase()
+            self._db.execute(
+                "UPDATE jobs SET attempts = attempts - 1, progress = ? WHERE id = ?",
+                (json.dumps(progress.snapshot()), job_id),
+            )
+
+    def _worker(self) -> None:
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            try:
+                self.handler(job, self._progress[job["id"]])
+            except Exception as ex:
+                if self._stopping:
+                    self._interrupt(job)
+                    continue
+                print(f"Job {job['id']} failed: {ex}")
+                self._finish(job, FAILED, str(ex))
+            else:
+                if self._stopping:
+                    # errors of single files are not raised, the job may be incomplete
+                    self._interrupt(job)
+                    continue
+                self._finish(job, DONE)
+
+
+def jobs_db_path() -> str:
+    return os.environ.get(
+        "EXTRACT_JOBS_DB", os.path.join(persistent_storage(), "extract_jobs.sqlite")
+    )
+
+
+def _job_from_row(row) -> dict:
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+    return job
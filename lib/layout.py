@@ -0,0 +1,113 @@
+"""Archive layout analysis, used to choose where an archive is extracted to."""
+
+import os
+import threading
+import typing
+from collections import OrderedDict
+
+# Archive entries kept in the listing cache, summed over all cached archives.
+LISTING_CACHE_ENTRIES = int(os.environ.get("EXTRACT_LISTING_CACHE_ENTRIES", "200000"))
+
+
+class ArchiveLayout(typing.NamedTuple):
+    root_files: int
+    root_folders: list
+    files_in_folders: int
+    total_size: int
+    entry_count: int
+
+
+def analyze_entries(entries) -> ArchiveLayout:
+    """Computes the layout of an archive from its entries in a single pass."""
+    root_files = 0
+    files_in_folders = 0
+    total_size = 0
+    entry_count = 0
+    root_folders = set()
+    for entry in entries:
+        entry_count += 1
+        total_size += entry.size
+        parts = [
+            x for x in entry.name.replace("\\", "/").split("/") if x not in ("", ".")
+        ]
+        if not parts:
+            continue
+        if len(parts) > 1 or entry.is_dir:
+            root_folders.add(parts[0])
+            files_in_folders += 1
+        else:
+            root_files += 1
+    return ArchiveLayout(
+        root_files, sorted(root_folders), files_in_folders, total_size, entry_count
+    )
+
+
+def analyze_directory(path) -> ArchiveLayout:
+    """Computes the layout of an already extracted archive."""
+    root_files = 0
+    files_in_folders = 0
+    total_size = 0
+    entry_count = 0
+    root_folders = []
+    for root, dirs, files in os.walk(path):
+        entry_count += len(dirs) + len(files)
+        for name in files:
+            try:
+                total_size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+        if os.path.samefile(root, path):
+            root_files += len(files)
+            root_folders = sorted(dirs)
+        else:
+            files_in_folders += len(files)
+    return ArchiveLayout(
+        root_files, root_folders, files_in_folders, total_size, entry_count
+    )
+
+
+class ListingCache:
+    """LRU cache of archive listings keyed by Nextcloud fileId and etag.
+
+    A new etag means new content, so entries never have to be invalidated.
+    """
+
+    def __init__(self, max_entries: int = LISTING_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_id, etag) -> typing.Optional[tuple]:
+        """Returns cached ``(entries, layout)`` or ``None``."""
+        with self._lock:
+            item = self._items.get((file_id, etag))
+            if item is not None:
+                self._items.move_to_end((file_id, etag))
+            return item
+
+    def put(self, file_id, etag, entries: list) -> tuple:
+        """Analyzes and caches the entries, returns ``(entries, layout)``."""
+        item = (entries, analyze_entries(entries))
+        if len(entries) > self.max_entries:
+            return item
+        with self._lock:
+            old = self._items.pop((file_id, etag), None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._items[(file_id, etag)] = item
+            self._size += len(entries)
+            while self._size > self.max_entries:
+                _, (old_entries, _) = self._items.popitem(last=False)
+                self._size -= len(old_entries)
+        return item
+
+    def discard(self, file_id, etag) -> None:
+        """Drops a listing, e.g. one that turned out not to match the content of its etag."""
+        with self._lock:
+            old = self._items.pop((file_id, etag), None)
+            if old is not None:
+                self._size -= len(old[0])
+
+
+LISTING_CACHE = ListingCache()
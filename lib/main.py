@@ -1,17 +1,26 @@
 """Simplest example of files_dropdown_menu + notification."""
 
+import asyncio
+import collections
+import concurrent.futures
+import io
 import json
 import os
 import time
-import tempfile
+import threading
+import hashlib
+import hmac
+from email.utils import parsedate_to_datetime
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from os import path
 from typing import Annotated
 
-from fastapi import BackgroundTasks, Depends, FastAPI
-from requests import Response
+from fastapi import Depends, FastAPI
 
-from nc_py_api import FsNode, NextcloudApp
+from nc_py_api import FsNode, NextcloudApp, NextcloudException
+from nc_py_api.files import ActionFileInfo, ActionFileInfoEx
 from nc_py_api.ex_app import (
     AppAPIAuthMiddleware,
     LogLvl,
@@ -24,42 +33,205 @@ from nc_py_api.ex_app import (
 from base64 import b64encode, b64decode
 import httpx
 import json
+import math
+import mmap
 import os
-import tempfile
+import shlex
+import subprocess
 import typing
 import time
 import shutil
 from base64 import b64encode, b64decode
 from random import choice
 from string import ascii_lowercase, ascii_uppercase, digits
-from urllib.parse import quote
+from urllib.parse import quote, unquote
 
 import cv2
 import httpx
 import imageio
 import numpy
 import uvicorn
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, responses, status
+from fastapi import FastAPI, HTTPException, Request, responses, status
 from pydantic import BaseModel
 from pygifsicle import optimize
-from requests import Response
 
-import zipfile
 from pathlib import Path
 from pyunpack import Archive
-import zipfile
 from pathlib import Path
 from pyunpack import Archive
 
+from app_log import app_log, flush_logs
+from engines import (
+    ESTIMATED_COMPRESSION_RATIO,
+    ArchiveEngine,
+    TarEngine,
+    ZipEngine,
+    get_engine,
+    is_selected,
+    safe_entry_path,
+    select_entries,
+    supported_mimetypes,
+)
+from layout import LISTING_CACHE, ArchiveLayout, analyze_directory, analyze_entries
+from remote_file import ChunkStream, RemoteFile
+from workspace import (
+    WORKSPACES,
+    WorkspaceFull,
+    WorkspaceManager,
+    directory_size,
+    track_written,
+)
+from staging import (
+    MEMORY_BUDGET,
+    MemoryEntry,
+    discard_staged,
+    open_staged,
+    read_staged,
+    stage_entry,
+    staged_path,
+    staged_size,
+)
+from jobs import EntryJournal, JobProgress, JobQueue, JobQueueFull
+from metrics import (
+    HTTP_BYTES,
+    HTTP_REQUESTS,
+    HTTP_SECONDS,
+    PHASE_SECONDS,
+    REGISTRY,
+    TRANSFER_BYTES,
+    TRANSFER_FILES,
+)
+from parallel_extract import (
+    DECOMPRESS_WORKERS,
+    PARALLEL_MIN_BYTES,
+    extract_parallel,
+    shutdown_process_pool,
+)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     set_handlers(app, enabled_handler)
+    WORKSPACES.collect_garbage()
+    if LOCAL_WORKSPACES is not None:
+        LOCAL_WORKSPACES.collect_garbage()
+    JOB_QUEUE.start()
     yield
+    JOB_QUEUE.stop()
+    TRANSFER_LOOP.stop()
+    shutdown_process_pool()
+    flush_logs(timeout=5)
+    await close_http_clients()
+
 
+# Token Prometheus sends as "Authorization: Bearer <token>" to read /metrics without
+# AppAPI signing. Empty keeps /metrics behind the AppAPI authentication.
+METRICS_TOKEN = os.environ.get("EXTRACT_METRICS_TOKEN", "")
 
 APP = FastAPI(lifespan=lifespan)
-APP.add_middleware(AppAPIAuthMiddleware)
+APP.add_middleware(
+    AppAPIAuthMiddleware, disable_for=["metrics"] if METRICS_TOKEN else []
+)
+
+# Number of extracted files uploaded at the same time. Most of the upload time
+# is WebDAV round-trip latency, so this can be well above the CPU count.
+UPLOAD_WORKERS = int(os.environ.get("EXTRACT_UPLOAD_WORKERS", "8"))
+# Archives of one batch job extracted at the same time, they share the upload pool.
+BATCH_WORKERS = int(os.environ.get("EXTRACT_BATCH_WORKERS", "2"))
+# Extracted bytes allowed to wait on the temp disk for their upload.
+UPLOAD_BUFFER_BYTES = (
+    int(os.environ.get("EXTRACT_UPLOAD_BUFFER_MB", "512")) * 1024 * 1024
+)
+
+# Re-extracting only uploads entries that are new or changed on the server, off by default.
+INCREMENTAL = os.environ.get("EXTRACT_INCREMENTAL", "0") == "1"
+
+# Read archives on the server instead of downloading them: zip archives through
+# Range requests, tar archives as a stream (read twice when not in the listing cache).
+STREAM_ARCHIVES = os.environ.get("EXTRACT_STREAM_ARCHIVES", "0") == "1"
+
+# Nextcloud's data directory as mounted in this container, empty to only use WebDAV.
+# Archives found under <data>/<user>/files are read in place and extracted into it.
+DATA_DIR = os.environ.get("EXTRACT_DATA_DIR", "")
+# Command making Nextcloud pick up the extracted files, "{path}" becomes /<user>/files/<folder>.
+# Empty walks the folder with PROPFIND instead, enough with 'filesystem_check_changes' => 1.
+RESCAN_COMMAND = os.environ.get("EXTRACT_RESCAN_COMMAND", "")
+RESCAN_TIMEOUT = 3600
+# Workspaces of local extractions are on the data volume, extracted files are renamed into place.
+LOCAL_WORKSPACES = (
+    WorkspaceManager(os.path.join(DATA_DIR, ".extract_workspaces"))
+    if DATA_DIR
+    else None
+)
+
+# Levels of archives inside the archive expanded in the same job, 0 uploads them as files.
+NESTED_DEPTH = int(os.environ.get("EXTRACT_NESTED_DEPTH", "0"))
+# Nested archives expanded at the same time, next to the extraction of the outer one.
+NESTED_WORKERS = int(os.environ.get("EXTRACT_NESTED_WORKERS", "2"))
+# Entry names taken for nested archives, single compressed files are left alone.
+NESTED_SUFFIXES = (
+    ".zip",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+    ".tar.zst",
+)
+
+# Buffer used when copying an archive entry to disk.
+COPY_BUFFER_SIZE = int(os.environ.get("EXTRACT_COPY_BUFFER_KB", "1024")) * 1024
+
+# Files of at least this size go through Nextcloud's chunked upload, split into
+# CHUNK_SIZE parts with CHUNK_WORKERS parts in flight per file.
+CHUNKED_UPLOAD_THRESHOLD = (
+    int(os.environ.get("EXTRACT_CHUNKED_UPLOAD_THRESHOLD_MB", "100")) * 1024 * 1024
+)
+CHUNK_SIZE = max(int(os.environ.get("EXTRACT_CHUNK_SIZE_MB", "10")), 5) * 1024 * 1024
+CHUNK_WORKERS = int(os.environ.get("EXTRACT_CHUNK_WORKERS", "4"))
+CHUNK_RETRIES = int(os.environ.get("EXTRACT_CHUNK_RETRIES", "3"))
+
+# Archives of at least DOWNLOAD_RANGED_THRESHOLD are downloaded in DOWNLOAD_RANGE_SIZE
+# parts over DOWNLOAD_CONNECTIONS connections at once, each part retried CHUNK_RETRIES times.
+DOWNLOAD_CONNECTIONS = int(os.environ.get("EXTRACT_DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_RANGED_THRESHOLD = (
+    int(os.environ.get("EXTRACT_RANGED_DOWNLOAD_THRESHOLD_MB", "64")) * 1024 * 1024
+)
+DOWNLOAD_RANGE_SIZE = (
+    max(int(os.environ.get("EXTRACT_DOWNLOAD_RANGE_MB", "16")), 1) * 1024 * 1024
+)
+
+# Pack extracted files up to BULK_MAX_FILE_BYTES into requests to Nextcloud's bulk upload
+# endpoint, BULK_BATCH_FILES files at most, when the server advertises it.
+BULK_UPLOAD = os.environ.get("EXTRACT_BULK_UPLOAD", "1") == "1"
+BULK_MAX_FILE_BYTES = int(os.environ.get("EXTRACT_BULK_MAX_FILE_KB", "256")) * 1024
+BULK_BATCH_FILES = int(os.environ.get("EXTRACT_BULK_BATCH_FILES", "100"))
+# Body size of one bulk request, also limited to a quarter of the upload buffer.
+BULK_BATCH_BYTES = 4 * 1024 * 1024
+
+# Run downloads, uploads and folder creation as coroutines on one event loop thread
+# instead of one thread per transfer.
+ASYNC_TRANSFERS = os.environ.get("EXTRACT_ASYNC_TRANSFERS", "0") == "1"
+# Requests in flight on that loop at the same time, for all jobs together.
+ASYNC_CONCURRENCY = int(os.environ.get("EXTRACT_ASYNC_CONCURRENCY", "16"))
+
+# Limits and timeouts (in seconds) of the shared HTTP clients used for raw DAV and OCS requests.
+HTTP_MAX_CONNECTIONS = int(os.environ.get("EXTRACT_HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("EXTRACT_HTTP_MAX_KEEPALIVE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("EXTRACT_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TIMEOUT = float(os.environ.get("EXTRACT_HTTP_TIMEOUT", "60"))
+
+try:
+    import h2  # noqa: F401 pylint: disable=unused-import
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_HTTP_CLIENT: typing.Optional[httpx.Client] = None
+_HTTP_CLIENT_LOCK = threading.Lock()
 
 
 def random_string(size: int) -> str:
@@ -68,6 +240,36 @@ def random_string(size: int) -> str:
     )
 
 
+def _http_client_options() -> dict:
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        ),
+        # read/write timeouts apply to each socket operation, not the whole transfer
+        "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    }
+
+
+def get_http_client() -> httpx.Client:
+    """Returns the process-wide connection-pooled HTTP client."""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None:
+                _HTTP_CLIENT = httpx.Client(**_http_client_options())
+    return _HTTP_CLIENT
+
+
+async def close_http_clients() -> None:
+    global _HTTP_CLIENT
+    with _HTTP_CLIENT_LOCK:
+        client, _HTTP_CLIENT = _HTTP_CLIENT, None
+    if client is not None:
+        client.close()
+
+
 def get_nc_url() -> str:
     return os.environ["NEXTCLOUD_URL"].removesuffix("/index.php").removesuffix("/")
 
@@ -112,9 +314,10 @@ def dav_call(
     method: str,
     path: str,
     nc: NextcloudApp,
-    data: typing.Optional[typing.Union[str, bytes]] = None,
+    data: typing.Optional[typing.Union[str, bytes, typing.BinaryIO]] = None,
     **kwargs,
 ):
+    """Sends a WebDAV request, a file object as ``data`` is streamed in chunks."""
     headers = kwargs.pop("headers", {})
     data_bytes = None
     if data is not None:
@@ -123,29 +326,17 @@ def dav_call(
 
     print(f"Path quoted: {path}")
 
-    nc.log(LogLvl.WARNING, f"Path quoted: {path}")
-
-    folder_path = path.rsplit("/", 1)[0]
-    print(f"Folder path quoted: {folder_path}")
-
-    nc.log(LogLvl.WARNING, f"Folder path quoted: {folder_path}")
+    app_log(nc, LogLvl.DEBUG, f"Path quoted: {path}", per_file=True)
 
     sign_request(headers, kwargs.get("user", ""))
 
-    nc.log(LogLvl.WARNING, f"Full URL: {get_nc_url() + folder_path}")
-
-    # creating the folder
-    httpx.request(
-        "MKCOL", url=get_nc_url() + folder_path, headers=headers, timeout=3000
-    )
-
     # performing the request
-    return httpx.request(
+    return http_request(
+        "dav",
         method,
         url=get_nc_url() + path,
         content=data_bytes,
         headers=headers,
-        timeout=3000,
     )
 
 
@@ -166,7 +357,8 @@ def ocs_call(
         headers.update({"Content-Type": "application/json"})
         data_bytes = json.dumps(json_data).encode("utf-8")
     sign_request(headers, kwargs.get("user", ""))
-    return httpx.request(
+    return http_request(
+        "ocs",
         method,
         url=get_nc_url() + path,
         params=params,
@@ -176,6 +368,32 @@ def ocs_call(
     )
 
 
+def request_body_size(content, headers) -> int:
+    """Returns the size of a request body, streamed ones announce it as Content-Length."""
+    if isinstance(content, (bytes, str)):
+        return len(content)
+    return int((headers or {}).get("Content-Length", 0))
+
+
+def http_request(api: str, method: str, **kwargs) -> httpx.Response:
+    """Sends a request with the shared client, recording its latency, status and sizes."""
+    HTTP_BYTES.inc(
+        request_body_size(kwargs.get("content"), kwargs.get("headers")),
+        api=api,
+        direction="sent",
+    )
+    status_code = 0  # connection errors
+    start = time.monotonic()
+    try:
+        response = get_http_client().request(method, **kwargs)
+        status_code = response.status_code
+        HTTP_BYTES.inc(len(response.content), api=api, direction="received")
+        return response
+    finally:
+        HTTP_SECONDS.observe(time.monotonic() - start, api=api, method=method)
+        HTTP_REQUESTS.inc(api=api, method=method, status=status_code)
+
+
 def create_notification(user_id: str, subject: str, message: str):
     params: dict = {
         "params": {
@@ -198,106 +416,1946 @@ def create_notification(user_id: str, subject: str, message: str):
     )
 
 
-def extract_folder_name(zip_filename, nc_file_path):
-    # Open the zip file
+def send_notification(nc: NextcloudApp, user_id: str, subject: str, message: str):
+    with PHASE_SECONDS.time(phase="notify"):
+        try:
+            nc.notifications.create(subject=subject, message=message)
+        except Exception as ex:
+            create_notification(user_id, subject, message)
+
+
+def archive_stem(file_path: str) -> str:
+    """Strips the archive extension, including the ``.tar`` of ``.tar.gz`` and friends."""
+    stem = os.path.splitext(file_path)[0]
+    if stem.lower().endswith(".tar"):
+        stem = stem[:-4]
+    return stem
+
+
+def extract_folder_name(layout: ArchiveLayout, nc_file_path):
+    files = layout.root_files
+    root_folders_array = layout.root_folders
+
+    print(f"Contains: {files} files on the root level")
+    print(f"Contains: {layout.files_in_folders} files in folders on the root level")
+    print(f"Contains: {len(root_folders_array)} folders on the root level")
+
+    print(f"Parent name: {nc_file_path.parent.name}")
+    print(f"zip_file_path.stem: {archive_stem(nc_file_path.name)}")
+
+    if len(root_folders_array) >= 1 and files >= 1:
+        folder_name = archive_stem(str(nc_file_path))
+        return folder_name
+    elif len(root_folders_array) > 1:
+        print("Number of folders > 1, using zip file name!")
+        folder_name = archive_stem(str(nc_file_path))
+        return folder_name
+    elif len(root_folders_array) == 1 and nc_file_path.parent.name == archive_stem(
+        nc_file_path.name
+    ):
+        print(f"ZIP folder name is the same as the folder name: {nc_file_path.parent}")
+        return nc_file_path.parent.parent
+    elif len(root_folders_array) >= 1:
+        return nc_file_path.parent
+    else:
+        folder_name = archive_stem(str(nc_file_path))
+        return folder_name
+
+
+class ArchiveChanged(Exception):
+    """Raised when the archive on the server is not the version the job was started for."""
+
+
+class RangedDownload:
+    """Downloads a file with several Range requests at once into a preallocated file.
+
+    Every range is retried on its own. All ranges must carry the same ETag, so
+    the parts can not come from different versions of the file.
+    """
+
+    def __init__(
+        self,
+        dav_path: str,
+        user_id,
+        size: int,
+        progress: JobProgress,
+        connections: int = DOWNLOAD_CONNECTIONS,
+        range_size: int = DOWNLOAD_RANGE_SIZE,
+    ):
+        self.url = get_nc_url() + quote("/remote.php/dav" + dav_path)
+        self.user_id = user_id
+        self.size = size
+        self.progress = progress
+        self.connections = max(1, connections)
+        self.range_size = range_size
+        self.etag = None
+        self.bytes_done = 0
+        self._lock = threading.Lock()
+
+    def run(self, fp) -> str:
+        """Writes the file into ``fp`` and returns its ETag.
+
+        :raises ValueError: the server does not support ranges.
+        :raises ArchiveChanged: the ranges carry different ETags, the file changed.
+        :raises OSError: a range still failed after its retries, or the size is wrong.
+        """
+        fd = fp.fileno()
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, self.size)
+        else:
+            os.ftruncate(fd, self.size)
+        # HTTP/2 would multiplex the ranges on one connection, the point is several
+        client = httpx.Client(**dict(_http_client_options(), http2=False))
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections) as executor:
+                futures = [
+                    executor.submit(
+                        self._fetch,
+                        client,
+                        fd,
+                        start,
+                        min(start + self.range_size, self.size) - 1,
+                    )
+                    for start in range(0, self.size, self.range_size)
+                ]
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            client.close()
+        if os.fstat(fd).st_size != self.size:
+            raise OSError(f"Downloaded {os.fstat(fd).st_size} of {self.size} bytes")
+        return self.etag
+
+    def _fetch(self, client: httpx.Client, fd: int, start: int, end: int) -> None:
+        for attempt in range(1, CHUNK_RETRIES + 1):
+            try:
+                self._fetch_once(client, fd, start, end)
+                return
+            except (OSError, httpx.HTTPError) as ex:
+                if attempt == CHUNK_RETRIES:
+                    raise
+                print(
+                    f"Retrying range {start}-{end} of {self.url} ({attempt}/{CHUNK_RETRIES}): {ex}"
+                )
+
+    def _fetch_once(self, client: httpx.Client, fd: int, start: int, end: int) -> None:
+        headers = {"Range": f"bytes={start}-{end}"}
+        sign_request(headers, self.user_id)
+        status_code = 0
+        offset = start
+        started = time.monotonic()
+        try:
+            with client.stream("GET", self.url, headers=headers) as response:
+                status_code = response.status_code
+                if status_code != 206:
+                    response.raise_for_status()
+                    raise ValueError(f"Range requests are not supported for {self.url}")
+                self._check_etag(response.headers.get("ETag", ""))
+                for data in response.iter_bytes(COPY_BUFFER_SIZE):
+                    os.pwrite(fd, data, offset)
+                    offset += len(data)
+        finally:
+            HTTP_SECONDS.observe(time.monotonic() - started, api="dav", method="GET")
+            HTTP_REQUESTS.inc(api="dav", method="GET", status=status_code)
+            HTTP_BYTES.inc(offset - start, api="dav", direction="received")
+        if offset != end + 1:
+            raise OSError(f"Range {start}-{end} returned {offset - start} bytes")
+        with self._lock:
+            self.bytes_done += end + 1 - start
+        self.progress.add(bytes_done=end + 1 - start)
+
+    def _check_etag(self, etag: str) -> None:
+        with self._lock:
+            if self.etag is None:
+                self.etag = etag
+            elif etag != self.etag:
+                raise ArchiveChanged(f"{self.url} changed during the download")
+
+
+def ranged_download(input_file: FsNode, fp, nc: NextcloudApp, progress) -> bool:
+    """Downloads big archives with :py:class:`RangedDownload`, returns ``False`` when it was not used.
+
+    On failure ``fp`` is emptied again for a download as one stream.
+
+    :raises ArchiveChanged: the ranges carry another etag than ``input_file`` or each other.
+    """
+    size = input_file.info.size or 0
+    if DOWNLOAD_CONNECTIONS < 2 or size < DOWNLOAD_RANGED_THRESHOLD:
+        return False
+    download = RangedDownload(
+        f"/files/{nc.user}/{input_file.user_path.strip('/')}", nc.user, size, progress
+    )
     try:
-        with zipfile.ZipFile(zip_filename, "r") as zip_ref:
-            # Get a list of all the files and folders at the first level
-            files = [item for item in zip_ref.namelist() if not "/" in item]
-            folders = [item for item in zip_ref.namelist() if "/" in item]
-
-            root_folders_array = []
-
-            for root_folder in folders:
-                root_folders_array.append(root_folder.split("/")[0])
-
-            root_folders_array = list(set(root_folders_array))
-            root_folders_array = sorted(root_folders_array)
-
-            print(f"Contains: {len(files)} files on the root level")
-            print(f"Contains: {len(folders)} files in folders on the root level")
-            print(f"Contains: {len(root_folders_array)} folders on the root level")
-
-            print(f"Parent name: {nc_file_path.parent.name}")
-            print(f"zip_file_path.stem: {nc_file_path.stem}")
-
-            if len(root_folders_array) >= 1 and len(files) >= 1:
-                # folder_name = zip_file_path.split("/")[-1]
-                folder_name = os.path.splitext(str(nc_file_path))[0]
-                return folder_name
-            elif len(root_folders_array) > 1:
-                print("Number of folders > 1, using zip file name!")
-                folder_name = os.path.splitext(str(nc_file_path))[0]
-                return folder_name
-            elif (
-                len(root_folders_array) == 1
-                and nc_file_path.parent.name == nc_file_path.stem
-            ):
+        etag = download.run(fp)
+    except ArchiveChanged:
+        raise
+    except Exception as ex:
+        print(f"Ranged download of {input_file.name} failed, using one stream: {ex}")
+        progress.add(bytes_done=-download.bytes_done)
+        fp.seek(0)
+        fp.truncate()
+        return False
+    fp.seek(size)
+    check_etag(input_file, etag)
+    print(
+        f"Downloaded {input_file.name} in {math.ceil(size / download.range_size)} ranges "
+        f"over {download.connections} connections"
+    )
+    return True
 
-                print(
-                    f"ZIP folder name is the same as the folder name: {nc_file_path.parent}"
+
+def download_file(input_file: FsNode, downloaded_file, nc: NextcloudApp, progress):
+    progress.set_phase("download", bytes_total=input_file.info.size, files_total=1)
+    with open(downloaded_file, "wb") as tmp_in:
+        try:
+            if ranged_download(input_file, tmp_in, nc, progress):
+                pass
+            elif ASYNC_TRANSFERS:
+                TRANSFER_LOOP.run(
+                    TRANSFER_LOOP.download(
+                        f"/files/{nc.user}/{input_file.user_path.strip('/')}",
+                        nc.user,
+                        ProgressWriter(tmp_in, progress),
+                        lambda etag: check_etag(input_file, etag),
+                    )
+                ).result()
+            else:
+                with open_remote_stream(input_file, nc, nc.user) as stream:
+                    shutil.copyfileobj(
+                        stream, ProgressWriter(tmp_in, progress), COPY_BUFFER_SIZE
+                    )
+            progress.add(files_done=1)
+            TRANSFER_BYTES.inc(tmp_in.tell(), kind="downloaded")
+            track_written(downloaded_file, tmp_in.tell())
+            app_log(nc, LogLvl.WARNING, "File downloaded")
+        except ArchiveChanged:
+            raise
+        except Exception as ex:
+            app_log(nc, LogLvl.ERROR, f"Error downloading file: {ex}")
+
+        tmp_in.flush()
+
+
+class ListingNeedsDownload(Exception):
+    """Raised when an archive can only be listed by downloading all of it."""
+
+
+def archive_listing(input_file: FsNode, nc: NextcloudApp, user_id) -> tuple:
+    """Returns ``(entries, layout)`` of an archive on the server, cached by fileId and etag.
+
+    Zip archives are listed with Range requests, tar archives are streamed with
+    ``EXTRACT_STREAM_ARCHIVES``. Other formats are only listed once an extraction
+    cached their listing, downloading them belongs in a job, not in a request.
+
+    :raises ListingNeedsDownload: the archive can not be listed without a download.
+    :raises ArchiveChanged: the archive changed while it was being listed.
+    """
+    cached = LISTING_CACHE.get(input_file.file_id, input_file.etag)
+    if cached is not None:
+        return cached
+    if is_zip_file(input_file):
+        try:
+            return remote_zip_listing(input_file, nc, user_id)
+        except ArchiveChanged:
+            raise
+        except Exception as ex:
+            print(f"Remote listing of {input_file.name} failed: {ex}")
+    elif STREAM_ARCHIVES and input_file.info.mimetype in TarEngine.mimetypes:
+        try:
+            return stream_tar_engine(input_file, nc, user_id)[1]
+        except ArchiveChanged:
+            raise
+        except Exception as ex:
+            print(f"Streaming {input_file.name} failed: {ex}")
+    raise ListingNeedsDownload(
+        f"Listing {input_file.name} needs a download of the whole archive, extract it instead"
+    )
+
+
+def check_etag(input_file: FsNode, etag: str) -> None:
+    """:raises ArchiveChanged: the server sent another version than the requested one."""
+    if etag and input_file.etag and etag.strip('"') != input_file.etag.strip('"'):
+        raise ArchiveChanged(
+            f"{input_file.name} changed since the extraction was requested, "
+            f"etag {etag} instead of {input_file.etag}"
+        )
+
+
+def open_remote_file(input_file: FsNode, nc: NextcloudApp, user_id) -> RemoteFile:
+    """Returns a seekable file reading the Nextcloud file with Range requests."""
+    dav_path = f"/files/{user_id}/{input_file.user_path.strip('/')}"
+
+    def fetch(start: int, end: int) -> bytes:
+        response = dav_call(
+            "GET", dav_path, nc, user=user_id, headers={"Range": f"bytes={start}-{end}"}
+        )
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise OSError(f"Range requests are not supported for {dav_path}")
+        check_etag(input_file, response.headers.get("ETag", ""))
+        return response.content
+
+    return RemoteFile(fetch, input_file.info.size)
+
+
+def open_remote_stream(input_file: FsNode, nc: NextcloudApp, user_id):
+    """Returns a forward-only file reading the Nextcloud file with one streamed GET."""
+    path = quote(f"/remote.php/dav/files/{user_id}/{input_file.user_path.strip('/')}")
+    headers = {}
+    sign_request(headers, user_id)
+    client = get_http_client()
+    with HTTP_SECONDS.time(api="dav", method="GET"):
+        response = client.send(
+            client.build_request("GET", get_nc_url() + path, headers=headers),
+            stream=True,
+        )
+    HTTP_REQUESTS.inc(api="dav", method="GET", status=response.status_code)
+    if response.status_code != 200:
+        response.close()
+        raise OSError(f"Streaming {path} failed with status {response.status_code}")
+    try:
+        check_etag(input_file, response.headers.get("ETag", ""))
+    except ArchiveChanged:
+        response.close()
+        raise
+    return io.BufferedReader(
+        ChunkStream(response.iter_bytes(COPY_BUFFER_SIZE), response.close),
+        COPY_BUFFER_SIZE,
+    )
+
+
+def stream_tar_engine(
+    input_file: FsNode, nc: NextcloudApp, user_id
+) -> typing.Tuple[TarEngine, tuple]:
+    """Returns an engine streaming a tar archive from the server and its ``(entries, layout)``.
+
+    The listing is cached, but big listings are not and others may be evicted
+    any time, so callers use the one returned here.
+    """
+    engine = TarEngine(lambda: open_remote_stream(input_file, nc, user_id))
+    listing = LISTING_CACHE.get(input_file.file_id, input_file.etag)
+    if listing is None:
+        listing = LISTING_CACHE.put(
+            input_file.file_id, input_file.etag, engine.entries()
+        )
+    return engine, listing
+
+
+def is_zip_file(input_file: FsNode) -> bool:
+    return (
+        input_file.info.mimetype in ZipEngine.mimetypes
+        or input_file.name.lower().endswith(".zip")
+    )
+
+
+def remote_zip_listing(input_file: FsNode, nc: NextcloudApp, user_id) -> tuple:
+    """Lists a zip archive on the server reading only its central directory.
+
+    The listing is cached like the ones of downloaded archives, returns ``(entries, layout)``.
+    """
+    cached = LISTING_CACHE.get(input_file.file_id, input_file.etag)
+    if cached is not None:
+        return cached
+    remote_file = open_remote_file(input_file, nc, user_id)
+    entries = ZipEngine(remote_file).entries()
+    print(
+        f"Listed {input_file.name} remotely: {len(entries)} entries, "
+        f"{remote_file.bytes_fetched} bytes in {remote_file.requests} requests"
+    )
+    return LISTING_CACHE.put(input_file.file_id, input_file.etag, entries)
+
+
+def analyze_archive(
+    engine: typing.Optional[ArchiveEngine],
+    downloaded_file,
+    input_file: FsNode,
+    destination_path,
+):
+    """Returns ``(entries, layout)`` of the archive, listings are cached by fileId and etag.
+
+    Archives without an engine are extracted to ``destination_path`` first and
+    analyzed from disk, their entries are ``None``.
+    """
+    if engine is None:
+        Archive(downloaded_file).extractall(destination_path)
+        track_written(destination_path, directory_size(destination_path))
+        return None, analyze_directory(destination_path)
+    cached = LISTING_CACHE.get(input_file.file_id, input_file.etag)
+    if cached is not None:
+        print(f"Using cached listing of {input_file.name}")
+        return cached
+    return LISTING_CACHE.put(input_file.file_id, input_file.etag, engine.entries())
+
+
+def get_dav_save_path(filename, destination_path, dav_destination_path, user_id):
+    dav_save_file_path = str(filename).replace(
+        destination_path, f"{dav_destination_path}/"
+    )
+    dav_save_file_path = dav_save_file_path.replace("\\", "/")
+    dav_save_file_path = dav_save_file_path.replace("//", "/")
+
+    if dav_save_file_path.startswith(user_id):
+        dav_save_file_path = dav_save_file_path.split("/", 1)[-1]
+    return dav_save_file_path
+
+
+def read_file_chunk(filename, offset: int, size: int) -> bytes:
+    return read_staged(filename, offset, size)
+
+
+def upload_chunk(
+    upload_path: str,
+    index: int,
+    filename,
+    offset: int,
+    size: int,
+    destination: str,
+    nc,
+    user_id,
+) -> None:
+    """Uploads one part of a chunked upload, retrying only this part on failure."""
+    for attempt in range(1, CHUNK_RETRIES + 1):
+        try:
+            response = dav_call(
+                "PUT",
+                f"{upload_path}/{index:05d}",
+                nc,
+                data=read_file_chunk(filename, offset, size),
+                user=user_id,
+                headers={"Destination": destination},
+            )
+            response.raise_for_status()
+            return
+        except Exception as ex:
+            if attempt == CHUNK_RETRIES:
+                raise
+            print(
+                f"Retrying chunk {index} of {filename} ({attempt}/{CHUNK_RETRIES}): {ex}"
+            )
+
+
+def chunked_upload(
+    filename,
+    dav_save_file_path,
+    nc: NextcloudApp,
+    user_id,
+    chunk_size: int = CHUNK_SIZE,
+    workers: int = CHUNK_WORKERS,
+    mtime: typing.Optional[float] = None,
+) -> int:
+    """Uploads a file with Nextcloud's chunked upload (v2), returns the uploaded size.
+
+    Parts are read from disk when they are sent, several at a time, and assembled
+    on the server with a final MOVE.
+    """
+    file_size = staged_size(filename)
+    upload_path = f"/uploads/{user_id}/extract-{random_string(32)}"
+    destination = get_nc_url() + quote(
+        f"/remote.php/dav/files/{user_id}/{dav_save_file_path}"
+    )
+    response = dav_call(
+        "MKCOL", upload_path, nc, user=user_id, headers={"Destination": destination}
+    )
+    response.raise_for_status()
+    try:
+        offsets = range(0, file_size, chunk_size) if file_size else [0]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(
+                    upload_chunk,
+                    upload_path,
+                    index,
+                    filename,
+                    offset,
+                    min(chunk_size, file_size - offset),
+                    destination,
+                    nc,
+                    user_id,
                 )
-                return nc_file_path.parent.parent
+                for index, offset in enumerate(offsets, start=1)
+            ]
+            for future in futures:
+                future.result()
+
+        headers = {"Destination": destination, "OC-Total-Length": str(file_size)}
+        if mtime:
+            headers["X-OC-Mtime"] = str(int(mtime))
+        response = dav_call(
+            "MOVE", f"{upload_path}/.file", nc, user=user_id, headers=headers
+        )
+        response.raise_for_status()
+    except Exception:
+        try:
+            dav_call("DELETE", upload_path, nc, user=user_id)
+        except Exception as ex:
+            print(f"Error removing chunked upload {upload_path}: {ex}")
+        raise
+    return file_size
+
+
+class PendingUpload(typing.NamedTuple):
+    filename: typing.Any  # staged entry, see staging.py
+    dav_path: str
+    reserved: int
+    mtime: typing.Optional[float]
+    journal: typing.Optional[EntryJournal]
+
+
+def bulk_upload_supported(nc: NextcloudApp) -> bool:
+    if not BULK_UPLOAD:
+        return False
+    try:
+        return bool(nc.capabilities.get("dav", {}).get("bulkupload"))
+    except Exception as ex:
+        print(f"Error reading the server capabilities: {ex}")
+        return False
+
+
+def bulk_request_body(batch: typing.List[PendingUpload]) -> typing.Tuple[bytes, str]:
+    """Returns the multipart body of a bulk upload and its content type.
+
+    Each part carries the file's path, MD5 and modification time, the server
+    checks the MD5 and answers per file.
+    """
+    boundary = f"extract_{random_string(32)}"
+    parts = []
+    for upload in batch:
+        data = read_file_chunk(upload.filename, 0, staged_size(upload.filename))
+        parts.append(
+            (
+                f"--{boundary}\r\n"
+                f"X-File-Path: /{upload.dav_path.strip('/')}\r\n"
+                f"X-File-MD5: {hashlib.md5(data).hexdigest()}\r\n"
+                f"X-File-Mtime: {int(upload.mtime or time.time())}\r\n"
+                f"Content-Length: {len(data)}\r\n\r\n"
+            ).encode("UTF-8")
+        )
+        parts.append(data)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("UTF-8"))
+    return b"".join(parts), f'multipart/related; boundary="{boundary}"'
+
+
+def bulk_upload_errors(response, batch: typing.List[PendingUpload]) -> dict:
+    """Returns ``{dav path: error}`` of the files the server did not store."""
+    response.raise_for_status()
+    results = response.json()
+    errors = {}
+    for upload in batch:
+        result = results.get(f"/{upload.dav_path.strip('/')}")
+        if not isinstance(result, dict):
+            errors[upload.dav_path] = "missing from the response"
+        elif result.get("error"):
+            errors[upload.dav_path] = result.get("message") or "failed"
+    return errors
+
+
+def upload_extracted_file(
+    filename,
+    dav_save_file_path,
+    nc: NextcloudApp,
+    user_id,
+    mtime: typing.Optional[float] = None,
+):
+    """Uploads one staged file and discards it locally, also on failure.
+
+    Returns the uploaded size. With ``mtime`` the file keeps the modification
+    time it has in the archive, which incremental extraction relies on.
+    """
+    try:
+        return _upload_staged_file(filename, dav_save_file_path, nc, user_id, mtime)
+    finally:
+        discard_staged(filename)
+
+
+def _upload_staged_file(filename, dav_save_file_path, nc, user_id, mtime) -> int:
+    file_size = staged_size(filename)
+    print(f"Uploading: {filename} to: {dav_save_file_path}")
+    app_log(
+        nc,
+        LogLvl.DEBUG,
+        f"Uploading: {filename} to: {dav_save_file_path}",
+        per_file=True,
+    )
+    if file_size >= CHUNKED_UPLOAD_THRESHOLD:
+        chunked_upload(filename, dav_save_file_path, nc, user_id, mtime=mtime)
+    elif mtime:
+        # streamed from the staged file, at most a copy buffer is held in memory
+        with open_staged(filename) as fp:
+            response = dav_call(
+                "PUT",
+                f"/files/{user_id}/{dav_save_file_path}",
+                nc,
+                data=fp,
+                user=user_id,
+                headers={
+                    "X-OC-Mtime": str(int(mtime)),
+                    "Content-Length": str(file_size),
+                },
+            )
+        response.raise_for_status()
+    else:
+        try:
+            with open_staged(filename) as fp:
+                nc.files.upload_stream(path=dav_save_file_path, fp=fp)
+        except Exception as ex:
+            app_log(
+                nc,
+                LogLvl.WARNING,
+                f"Error uploading {dav_save_file_path}, using alt: {ex}",
+                per_file=True,
+            )
+            with open_staged(filename) as fp:
+                response = dav_call(
+                    "PUT",
+                    f"/files/{user_id}/{dav_save_file_path}",
+                    nc,
+                    data=fp,
+                    user=user_id,
+                    headers={"Content-Length": str(file_size)},
+                )
+            response.raise_for_status()
+    return file_size
+
+
+def plan_folders(dav_paths, dav_folders=(), known_folders=()) -> list:
+    """Returns every folder needed by the DAV file paths, grouped by depth.
+
+    :param dav_paths: file paths that will be uploaded.
+    :param dav_folders: extra folders to create, e.g. empty folders from the archive.
+    :param known_folders: folders that already exist, they and their parents are skipped.
+    """
+    known = set()
+    for folder in known_folders:
+        folder = str(folder).strip("/")
+        while folder not in ("", "."):
+            known.add(folder)
+            folder = str(Path(folder).parent)
+
+    folders = set()
+    for folder in [str(Path(x).parent) for x in dav_paths] + list(dav_folders):
+        folder = str(folder).strip("/")
+        while folder not in ("", ".") and folder not in folders and folder not in known:
+            folders.add(folder)
+            folder = str(Path(folder).parent)
+
+    levels = {}
+    for folder in folders:
+        levels.setdefault(folder.count("/"), []).append(folder)
+    return [sorted(levels[depth]) for depth in sorted(levels)]
+
+
+def make_folder(folder: str, nc: NextcloudApp) -> None:
+    try:
+        nc.files.mkdir(folder)
+    except NextcloudException as ex:
+        if ex.status_code != 405:  # 405 - folder already exists
+            raise
+
+
+def create_folders(plan: list, nc: NextcloudApp, workers: int = UPLOAD_WORKERS) -> None:
+    """Creates planned folders with one MKCOL each, siblings of the same depth in parallel."""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for level in plan:
+            futures = {executor.submit(make_folder, x, nc): x for x in level}
+            for future, folder in futures.items():
+                try:
+                    future.result()
+                except Exception as ex:
+                    app_log(
+                        nc,
+                        LogLvl.WARNING,
+                        f"Error creating folder {folder}: {ex}",
+                        per_file=True,
+                    )
+                    print(f"Error creating folder {folder}: {ex}")
+
+
+class ProgressWriter:
+    """File object wrapper counting written bytes into a job's progress."""
+
+    def __init__(self, fp, progress: JobProgress):
+        self.fp = fp
+        self.progress = progress
+
+    def write(self, data) -> int:
+        written = self.fp.write(data)
+        self.progress.add(bytes_done=len(data))
+        return written
+
+
+class ByteBudget:
+    """Limits the amount of extracted bytes waiting on disk for their upload."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self, size: int) -> bool:
+        """Acquires ``size`` bytes when that does not have to wait."""
+        with self._condition:
+            if self.used and self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def acquire(self, size: int) -> None:
+        with self._condition:
+            # an entry bigger than the whole budget is let through once nothing else is pending
+            while self.used and self.used + size > self.limit:
+                self._condition.wait()
+            self.used += size
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class UploadPool:
+    """Uploads extracted files in the background while the archive is still being extracted.
+
+    Callers reserve the size of an entry before writing it to disk, so at most
+    ``buffer_bytes`` of extracted data waits for its upload at any time.
+    """
+
+    def __init__(
+        self,
+        nc: NextcloudApp,
+        user_id,
+        workers: int = UPLOAD_WORKERS,
+        buffer_bytes: int = UPLOAD_BUFFER_BYTES,
+        progress: typing.Optional[JobProgress] = None,
+    ):
+        self.nc = nc
+        self.progress = progress if progress is not None else JobProgress()
+        self.user_id = user_id
+        self.workers = max(1, workers)
+        self.budget = ByteBudget(buffer_bytes)
+        self.stats = {
+            "files": 0,
+            "bytes": 0,
+            "failed": [],
+            "skipped": 0,
+            "skipped_bytes": 0,
+            "bulk_requests": 0,
+        }
+        # small files go through bulk uploads, see submit
+        self.bulk = bulk_upload_supported(nc)
+        self.batch_bytes = min(BULK_BATCH_BYTES, buffer_bytes // 4)
+        self._batch = []
+        self._batch_size = 0
+        self._lock = threading.Lock()
+        # staged path -> uploads not finished yet, see drain
+        self._outstanding = collections.Counter()
+        self._drained = threading.Condition(self._lock)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._start_time = time.monotonic()
+
+    def reserve(self, size: int) -> None:
+        if not self.budget.try_acquire(size):
+            # small files waiting for their bulk upload hold budget too, send them first
+            self._flush_batch()
+            self.budget.acquire(size)
+
+    def create_folders(self, plan: list) -> None:
+        create_folders(plan, self.nc)
+
+    def release(self, size: int) -> None:
+        self.budget.release(size)
+
+    def submit(
+        self,
+        filename,
+        dav_save_file_path,
+        reserved: int = 0,
+        mtime: typing.Optional[float] = None,
+        journal: typing.Optional[EntryJournal] = None,
+    ) -> None:
+        """Queues the upload of a staged file, acknowledged in ``journal`` once uploaded.
+
+        Small files wait for a batch of them to be sent as one bulk upload.
+        """
+        upload = PendingUpload(filename, dav_save_file_path, reserved, mtime, journal)
+        with self._lock:
+            self._outstanding[staged_path(filename)] += 1
+        if self.bulk:
+            size = staged_size(filename)
+            if size <= BULK_MAX_FILE_BYTES:
+                with self._lock:
+                    self._batch.append(upload)
+                    self._batch_size += size
+                    if (
+                        len(self._batch) < BULK_BATCH_FILES
+                        and self._batch_size < self.batch_bytes
+                    ):
+                        return
+                    batch, self._batch, self._batch_size = self._batch, [], 0
+                self._submit_batch(batch)
+                return
+        self._submit_one(upload)
+
+    def drain(self, path) -> None:
+        """Waits for the uploads of the files staged below ``path``.
+
+        A pool shared by several archives stays open, an archive waits for its own
+        uploads before its workspace and journal are closed.
+        """
+        self._flush_batch()
+        prefix = os.path.join(str(path), "")
+        with self._lock:
+            while any(x.startswith(prefix) for x in self._outstanding):
+                self._drained.wait()
+
+    def _submit_one(self, upload: PendingUpload) -> None:
+        future = self._executor.submit(
+            upload_extracted_file,
+            upload.filename,
+            upload.dav_path,
+            self.nc,
+            self.user_id,
+            upload.mtime,
+        )
+        future.add_done_callback(lambda f: self._on_done(f, upload))
+
+    def _submit_batch(self, batch: typing.List[PendingUpload]) -> None:
+        self._executor.submit(self._upload_batch, batch)
+
+    def _flush_batch(self) -> None:
+        with self._lock:
+            batch, self._batch, self._batch_size = self._batch, [], 0
+        if batch:
+            self._submit_batch(batch)
+
+    def _upload_batch(self, batch: typing.List[PendingUpload]) -> None:
+        try:
+            body, content_type = bulk_request_body(batch)
+            response = dav_call(
+                "POST",
+                "/bulk",
+                self.nc,
+                data=body,
+                user=self.user_id,
+                headers={"Content-Type": content_type},
+            )
+            errors = self._bulk_errors(response, batch)
+        except Exception as ex:
+            print(
+                f"Bulk upload of {len(batch)} files failed, uploading them alone: {ex}"
+            )
+            errors = {x.dav_path: str(ex) for x in batch}
+        for upload in batch:
+            try:
+                if upload.dav_path not in errors:
+                    size = staged_size(upload.filename)
+                    discard_staged(upload.filename)
+                else:
+                    if len(errors) < len(batch):
+                        print(
+                            f"Bulk upload of {upload.dav_path} failed, uploading it alone: "
+                            f"{errors[upload.dav_path]}"
+                        )
+                    size = upload_extracted_file(
+                        upload.filename,
+                        upload.dav_path,
+                        self.nc,
+                        self.user_id,
+                        upload.mtime,
+                    )
+            except Exception as ex:
+                self._failed(upload, ex)
+            else:
+                self._uploaded(upload, size)
+
+    def _bulk_errors(self, response, batch: typing.List[PendingUpload]) -> dict:
+        with self._lock:
+            self.stats["bulk_requests"] += 1
+        if response.status_code in (404, 405, 501):
+            # not available after all, e.g. blocked by a proxy
+            print(
+                f"Bulk upload not available ({response.status_code}), using single uploads"
+            )
+            self.bulk = False
+        return bulk_upload_errors(response, batch)
+
+    def skip(
+        self,
+        dav_save_file_path,
+        size: int,
+        journal: typing.Optional[EntryJournal] = None,
+    ) -> None:
+        """Counts a file that is already present and identical on the server."""
+        print(f"Unchanged, skipping: {dav_save_file_path}")
+        if journal is not None:
+            journal.ack(dav_save_file_path)
+        with self._lock:
+            self.stats["skipped"] += 1
+            self.stats["skipped_bytes"] += size
+        TRANSFER_FILES.inc(kind="skipped")
+        TRANSFER_BYTES.inc(size, kind="skipped")
+        self.progress.add(bytes_done=size, files_done=1)
+
+    def _on_done(self, future, upload: PendingUpload) -> None:
+        try:
+            uploaded = future.result()
+        except Exception as ex:
+            self._failed(upload, ex)
+            return
+        self._uploaded(upload, uploaded)
+
+    def _failed(self, upload: PendingUpload, ex: Exception) -> None:
+        self.budget.release(upload.reserved)
+        with self._lock:
+            self.stats["failed"].append(upload.dav_path)
+        self.progress.add(files_failed=1)
+        TRANSFER_FILES.inc(kind="failed")
+        app_log(
+            self.nc,
+            LogLvl.ERROR,
+            f"ERROR uploading {upload.dav_path}: {ex}",
+            per_file=True,
+        )
+        print(f"ERROR uploading {upload.dav_path}: {ex}")
+        self._finished(upload)
+
+    def _uploaded(self, upload: PendingUpload, uploaded: int) -> None:
+        self.budget.release(upload.reserved)
+        with self._lock:
+            self.stats["files"] += 1
+            self.stats["bytes"] += uploaded
+        self.progress.add(bytes_done=uploaded, files_done=1)
+        TRANSFER_FILES.inc(kind="uploaded")
+        TRANSFER_BYTES.inc(uploaded, kind="uploaded")
+        if upload.journal is not None:
+            upload.journal.ack(upload.dav_path)
+        self._finished(upload)
+
+    def _finished(self, upload: PendingUpload) -> None:
+        path = staged_path(upload.filename)
+        with self._lock:
+            self._outstanding[path] -= 1
+            if self._outstanding[path] <= 0:
+                del self._outstanding[path]
+            self._drained.notify_all()
+
+    def close(self) -> dict:
+        """Waits for all submitted uploads and logs the aggregate throughput."""
+        self._flush_batch()
+        self._wait()
+        self.progress.end_phase()
+        elapsed = max(time.monotonic() - self._start_time, 1e-6)
+        self.stats["seconds"] = elapsed
+        summary = (
+            f"Uploaded {self.stats['files']} files ({self.stats['bytes'] / 1048576:.2f} MB) "
+            f"in {elapsed:.2f}s: {self.stats['files'] / elapsed:.1f} files/s, "
+            f"{self.stats['bytes'] / 1048576 / elapsed:.2f} MB/s, "
+            f"{len(self.stats['failed'])} failed, {self.workers} workers"
+        )
+        if self.stats["bulk_requests"]:
+            summary += f", {self.stats['bulk_requests']} bulk requests"
+        if self.stats["skipped"]:
+            summary += (
+                f"; skipped {self.stats['skipped']} unchanged files "
+                f"({self.stats['skipped_bytes'] / 1048576:.2f} MB)"
+            )
+        app_log(self.nc, LogLvl.WARNING, summary)
+        print(summary)
+        return self.stats
+
+    def _wait(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class TransferLoop:
+    """Event loop thread running the async transfers of all jobs with one async client.
+
+    Coroutines are scheduled from job threads with :py:meth:`run`. At most
+    ``concurrency`` requests are in flight, whatever the number of jobs.
+    """
+
+    def __init__(self, concurrency: int = ASYNC_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.client = None
+        self.semaphore = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run(self, coroutine) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._start())
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                options = _http_client_options()
+                # waiting for a pooled connection must not time out the coroutines
+                options["limits"] = httpx.Limits(
+                    max_connections=max(HTTP_MAX_CONNECTIONS, self.concurrency),
+                    max_keepalive_connections=max(HTTP_MAX_KEEPALIVE, self.concurrency),
+                )
+
+                def main():
+                    asyncio.set_event_loop(loop)
+                    # an async client is bound to the loop it runs on, this loop owns it
+                    self.client = httpx.AsyncClient(**options)
+                    self.semaphore = asyncio.Semaphore(self.concurrency)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(
+                    target=main, name="transfer_loop", daemon=True
+                )
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def stop(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.aclose(), loop).result(10)
+        except Exception as ex:
+            print(f"Error closing the async HTTP client: {ex}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(10)
+        loop.close()
+
+    async def request(self, api: str, method: str, url: str, **kwargs):
+        """Async counterpart of :py:func:`http_request`."""
+        HTTP_BYTES.inc(
+            request_body_size(kwargs.get("content"), kwargs.get("headers")),
+            api=api,
+            direction="sent",
+        )
+        status_code = 0  # connection errors
+        async with self.semaphore:
+            start = time.monotonic()
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                status_code = response.status_code
+                HTTP_BYTES.inc(len(response.content), api=api, direction="received")
+                return response
+            finally:
+                HTTP_SECONDS.observe(time.monotonic() - start, api=api, method=method)
+                HTTP_REQUESTS.inc(api=api, method=method, status=status_code)
+
+    async def dav(
+        self,
+        method: str,
+        path: str,
+        user_id,
+        data: typing.Union[bytes, typing.AsyncIterable[bytes]] = None,
+        headers=None,
+    ) -> httpx.Response:
+        """Async counterpart of :py:func:`dav_call`, an async iterable ``data`` is streamed."""
+        headers = dict(headers or {})
+        sign_request(headers, user_id)
+        return await self.request(
+            "dav",
+            method,
+            get_nc_url() + quote("/remote.php/dav" + path),
+            content=data,
+            headers=headers,
+        )
+
+    async def download(self, path: str, user_id, fp, check_etag=None) -> None:
+        """Streams a WebDAV file into ``fp``, disk writes go to the default executor.
+
+        :param check_etag: called with the response's ETag before anything is written.
+        """
+        headers = {}
+        sign_request(headers, user_id)
+        loop = asyncio.get_running_loop()
+        url = get_nc_url() + quote("/remote.php/dav" + path)
+        status_code = 0
+        async with self.semaphore:
+            start = time.monotonic()
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    status_code = response.status_code
+                    response.raise_for_status()
+                    if check_etag is not None:
+                        check_etag(response.headers.get("ETag", ""))
+                    async for data in response.aiter_bytes(COPY_BUFFER_SIZE):
+                        await loop.run_in_executor(None, fp.write, data)
+                        HTTP_BYTES.inc(len(data), api="dav", direction="received")
+            finally:
+                HTTP_SECONDS.observe(time.monotonic() - start, api="dav", method="GET")
+                HTTP_REQUESTS.inc(api="dav", method="GET", status=status_code)
+
+
+TRANSFER_LOOP = TransferLoop()
+
+
+async def async_upload_staged_file(
+    transfers: TransferLoop, filename, dav_save_file_path, user_id, mtime
+) -> int:
+    """Async counterpart of :py:func:`upload_extracted_file`, without the discard."""
+    file_size = staged_size(filename)
+    print(f"Uploading: {filename} to: {dav_save_file_path}")
+    if file_size >= CHUNKED_UPLOAD_THRESHOLD:
+        await async_chunked_upload(
+            transfers, filename, dav_save_file_path, user_id, mtime
+        )
+        return file_size
+    headers = {"Content-Length": str(file_size)}
+    if mtime:
+        headers["X-OC-Mtime"] = str(int(mtime))
+    if isinstance(filename, MemoryEntry):
+        data = filename.data
+    else:
+        data = read_file_async(filename)
+    response = await transfers.dav(
+        "PUT", f"/files/{user_id}/{dav_save_file_path}", user_id, data, headers
+    )
+    response.raise_for_status()
+    return file_size
+
+
+async def read_file_async(filename):
+    """Yields a staged file in chunks of ``COPY_BUFFER_SIZE``, read in the default executor."""
+    loop = asyncio.get_running_loop()
+    with open(str(filename), "rb") as f:
+        while True:
+            data = await loop.run_in_executor(None, f.read, COPY_BUFFER_SIZE)
+            if not data:
+                break
+            yield data
+
+
+async def async_chunked_upload(
+    transfers: TransferLoop, filename, dav_save_file_path, user_id, mtime
+) -> None:
+    """Async counterpart of :py:func:`chunked_upload`."""
+    loop = asyncio.get_running_loop()
+    file_size = staged_size(filename)
+    upload_path = f"/uploads/{user_id}/extract-{random_string(32)}"
+    destination = get_nc_url() + quote(
+        f"/remote.php/dav/files/{user_id}/{dav_save_file_path}"
+    )
+    response = await transfers.dav(
+        "MKCOL", upload_path, user_id, headers={"Destination": destination}
+    )
+    response.raise_for_status()
+    # parts of one file in flight, each is held in memory while it is sent
+    parts = asyncio.Semaphore(max(1, CHUNK_WORKERS))
+
+    async def upload_part(index: int, offset: int) -> None:
+        async with parts:
+            for attempt in range(1, CHUNK_RETRIES + 1):
+                try:
+                    data = await loop.run_in_executor(
+                        None,
+                        read_file_chunk,
+                        filename,
+                        offset,
+                        min(CHUNK_SIZE, file_size - offset),
+                    )
+                    response = await transfers.dav(
+                        "PUT",
+                        f"{upload_path}/{index:05d}",
+                        user_id,
+                        data,
+                        {"Destination": destination},
+                    )
+                    response.raise_for_status()
+                    return
+                except Exception as ex:
+                    if attempt == CHUNK_RETRIES:
+                        raise
+                    print(
+                        f"Retrying chunk {index} of {filename} ({attempt}/{CHUNK_RETRIES}): {ex}"
+                    )
+
+    try:
+        offsets = range(0, file_size, CHUNK_SIZE) if file_size else [0]
+        await asyncio.gather(
+            *(upload_part(i, x) for i, x in enumerate(offsets, start=1))
+        )
+        headers = {"Destination": destination, "OC-Total-Length": str(file_size)}
+        if mtime:
+            headers["X-OC-Mtime"] = str(int(mtime))
+        response = await transfers.dav(
+            "MOVE", f"{upload_path}/.file", user_id, headers=headers
+        )
+        response.raise_for_status()
+    except Exception:
+        try:
+            await transfers.dav("DELETE", upload_path, user_id)
+        except Exception as ex:
+            print(f"Error removing chunked upload {upload_path}: {ex}")
+        raise
+
+
+async def async_create_folders(transfers: TransferLoop, plan: list, nc, user_id):
+    """Async counterpart of :py:func:`create_folders`, a level's folders all at once."""
+
+    async def make(folder: str) -> None:
+        try:
+            response = await transfers.dav(
+                "MKCOL", f"/files/{user_id}/{folder}", user_id
+            )
+            if response.status_code != 405:  # 405 - folder already exists
+                response.raise_for_status()
+        except Exception as ex:
+            app_log(
+                nc,
+                LogLvl.WARNING,
+                f"Error creating folder {folder}: {ex}",
+                per_file=True,
+            )
+            print(f"Error creating folder {folder}: {ex}")
+
+    for level in plan:
+        await asyncio.gather(*(make(x) for x in level))
+
+
+class AsyncUploadPool(UploadPool):
+    """Upload pool running its uploads on the :py:class:`TransferLoop` instead of threads.
+
+    The ``workers`` of the summary are the loop's concurrency, shared with other jobs.
+    """
+
+    def __init__(
+        self,
+        nc: NextcloudApp,
+        user_id,
+        buffer_bytes: int = UPLOAD_BUFFER_BYTES,
+        progress: typing.Optional[JobProgress] = None,
+        transfers: TransferLoop = TRANSFER_LOOP,
+    ):
+        super().__init__(nc, user_id, 1, buffer_bytes, progress)
+        self.transfers = transfers
+        self.workers = transfers.concurrency
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+
+    def create_folders(self, plan: list) -> None:
+        self.transfers.run(
+            async_create_folders(self.transfers, plan, self.nc, self.user_id)
+        ).result()
+
+    def _submit_one(self, upload: PendingUpload) -> None:
+        with self._lock:
+            self._pending += 1
+        future = self.transfers.run(
+            self._upload(upload.filename, upload.dav_path, upload.mtime)
+        )
+        future.add_done_callback(lambda f: self._on_uploaded(f, upload))
+
+    def _submit_batch(self, batch: typing.List[PendingUpload]) -> None:
+        with self._lock:
+            self._pending += 1
+        future = self.transfers.run(self._upload_batch_async(batch))
+        future.add_done_callback(lambda f: self._on_uploaded(f, None))
+
+    async def _upload_batch_async(self, batch: typing.List[PendingUpload]) -> None:
+        """Async counterpart of :py:meth:`UploadPool._upload_batch`."""
+        loop = asyncio.get_running_loop()
+        try:
+            body, content_type = await loop.run_in_executor(
+                None, bulk_request_body, batch
+            )
+            response = await self.transfers.dav(
+                "POST", "/bulk", self.user_id, body, {"Content-Type": content_type}
+            )
+            errors = self._bulk_errors(response, batch)
+        except Exception as ex:
+            print(
+                f"Bulk upload of {len(batch)} files failed, uploading them alone: {ex}"
+            )
+            errors = {x.dav_path: str(ex) for x in batch}
+        for upload in batch:
+            try:
+                if upload.dav_path not in errors:
+                    size = staged_size(upload.filename)
+                    discard_staged(upload.filename)
+                else:
+                    if len(errors) < len(batch):
+                        print(
+                            f"Bulk upload of {upload.dav_path} failed, uploading it alone: "
+                            f"{errors[upload.dav_path]}"
+                        )
+                    size = await self._upload(
+                        upload.filename, upload.dav_path, upload.mtime
+                    )
+            except Exception as ex:
+                self._failed(upload, ex)
+            else:
+                self._uploaded(upload, size)
+
+    async def _upload(self, filename, dav_save_file_path, mtime) -> int:
+        try:
+            return await async_upload_staged_file(
+                self.transfers, filename, dav_save_file_path, self.user_id, mtime
+            )
+        finally:
+            discard_staged(filename)
+
+    def _on_uploaded(self, future, upload: typing.Optional[PendingUpload]) -> None:
+        try:
+            if upload is not None:
+                self._on_done(future, upload)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def _wait(self) -> None:
+        # counted in the done callbacks, futures wake their waiters before those run
+        with self._lock:
+            while self._pending:
+                self._idle.wait()
+        self._executor.shutdown(wait=True)
+
+
+class LocalStoragePool(UploadPool):
+    """Writes extracted files straight into the user's folder in the data directory.
+
+    Staged files are renamed into place, which costs nothing as the local workspaces
+    are on the same volume. Nextcloud learns about the files from one rescan of every
+    destination once the pool is closed, see :py:func:`rescan_folders`.
+    """
+
+    def __init__(
+        self,
+        nc: NextcloudApp,
+        user_id,
+        workers: int = UPLOAD_WORKERS,
+        progress: typing.Optional[JobProgress] = None,
+    ):
+        super().__init__(nc, user_id, workers, progress=progress)
+        self.root = local_files_root(user_id)
+        self.bulk = False
+        self.rescan_paths = set()
+
+    def local_path(self, dav_path: str) -> str:
+        parts = [x for x in str(dav_path).split("/") if x not in ("", ".")]
+        if ".." in parts:
+            raise ValueError(f"Invalid path: {dav_path}")
+        return os.path.join(self.root, *parts)
+
+    def add_rescan(self, dav_path) -> None:
+        """Rescans ``dav_path`` when the pool is closed."""
+        with self._lock:
+            self.rescan_paths.add(str(dav_path).strip("/"))
+
+    def create_folders(self, plan: list) -> None:
+        for level in plan:
+            for folder in level:
+                os.makedirs(self.local_path(folder), exist_ok=True)
+
+    def _submit_one(self, upload: PendingUpload) -> None:
+        future = self._executor.submit(self._write, upload)
+        future.add_done_callback(lambda f: self._on_done(f, upload))
+
+    def _write(self, upload: PendingUpload) -> int:
+        target = self.local_path(upload.dav_path)
+        # Nextcloud's scanner ignores .part files, a concurrent rescan never sees half a file
+        part = f"{target}.extract-{random_string(8)}.part"
+        size = staged_size(upload.filename)
+        try:
+            if isinstance(upload.filename, MemoryEntry):
+                with open(part, "wb") as f:
+                    f.write(upload.filename.data)
+            else:
+                shutil.move(str(upload.filename), part)
+                track_written(upload.filename, -size)
+            if upload.mtime:
+                os.utime(part, (upload.mtime, upload.mtime))
+            os.replace(part, target)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+            if isinstance(upload.filename, MemoryEntry) or os.path.exists(
+                str(upload.filename)
+            ):
+                discard_staged(upload.filename)
+        return size
+
+    def close(self) -> dict:
+        stats = super().close()
+        with PHASE_SECONDS.time(phase="rescan"):
+            rescan_folders(self.nc, self.user_id, self.rescan_paths)
+        return stats
+
+
+def local_files_root(user_id) -> str:
+    return os.path.join(DATA_DIR, user_id, "files")
 
-            elif len(root_folders_array) >= 1:
-                return nc_file_path.parent
+
+def local_archive_path(input_file: FsNode, user_id) -> typing.Optional[str]:
+    """Returns where the archive is in the mounted data directory, ``None`` if it is not there.
+
+    Files on external storages, in group folders or encrypted are somewhere else
+    or have another size on disk, they go through WebDAV.
+    """
+    if not DATA_DIR:
+        return None
+    parts = [x for x in input_file.user_path.split("/") if x not in ("", ".")]
+    path = os.path.join(local_files_root(user_id), *parts)
+    try:
+        if ".." not in parts and os.path.getsize(path) == input_file.info.size:
+            return path
+    except OSError:
+        pass
+    print(f"{input_file.user_path} is not in {DATA_DIR}, using WebDAV")
+    return None
+
+
+class MappedFile(mmap.mmap):
+    """Read-only memory map usable as the file object of a zip archive."""
+
+    def seekable(self) -> bool:
+        return True
+
+
+def open_local_engine(path: str) -> typing.Optional[ArchiveEngine]:
+    """Returns an engine reading the archive in place, zip archives memory-mapped.
+
+    Parallel decompression opens the path in every process, so it keeps the path.
+    """
+    engine = get_engine(path)
+    if isinstance(engine, ZipEngine) and DECOMPRESS_WORKERS <= 1:
+        with open(path, "rb") as f:
+            # an empty file can not be mapped, zipfile rejects it from the path
+            if os.fstat(f.fileno()).st_size == 0:
+                return engine
+            return ZipEngine(MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ))
+    return engine
+
+
+def rescan_folders(nc: NextcloudApp, user_id, dav_paths) -> None:
+    """Makes Nextcloud pick up files written to its data directory below ``dav_paths``.
+
+    Runs ``EXTRACT_RESCAN_COMMAND`` for each folder not inside another one, or lists
+    them with PROPFIND, which rescans them when the server checks for changes.
+    """
+    paths = sorted(set(dav_paths))
+    for dav_path in paths:
+        if any(dav_path.startswith(f"{x}/") or x == "" for x in paths if x != dav_path):
+            continue
+        path = f"/{user_id}/files/{dav_path}".rstrip("/")
+        print(f"Rescanning {path}")
+        try:
+            if RESCAN_COMMAND:
+                command = [
+                    x.replace("{path}", path) for x in shlex.split(RESCAN_COMMAND)
+                ]
+                subprocess.run(
+                    command, check=True, capture_output=True, timeout=RESCAN_TIMEOUT
+                )
             else:
-                # folder_name = zip_file_path.split("/")[-1]
-                folder_name = os.path.splitext(str(nc_file_path))[0]
-                return folder_name
+                propfind_tree(dav_path, "infinity", RemoteTree({}, set()), nc, user_id)
+        except Exception as ex:
+            app_log(nc, LogLvl.ERROR, f"Error rescanning {path}: {ex}")
+            print(f"Error rescanning {path}: {ex}")
+
+
+def new_upload_pool(
+    nc: NextcloudApp,
+    user_id,
+    progress: typing.Optional[JobProgress] = None,
+    local: bool = False,
+) -> UploadPool:
+    """Returns the pool for a job's uploads, with ``local`` writing into the data directory."""
+    if local:
+        return LocalStoragePool(nc, user_id, progress=progress)
+    if ASYNC_TRANSFERS:
+        return AsyncUploadPool(nc, user_id, progress=progress)
+    return UploadPool(nc, user_id, progress=progress)
+
+
+class RemoteTree(typing.NamedTuple):
+    files: dict  # user path -> {"size": int, "mtime": float, "checksums": dict}
+    folders: set
+
+
+PROPFIND_TREE_BODY = """<?xml version="1.0"?>
+<d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">
+  <d:prop>
+    <d:getcontentlength/>
+    <d:getlastmodified/>
+    <d:resourcetype/>
+    <oc:checksums/>
+  </d:prop>
+</d:propfind>"""
+
+
+def propfind_tree(dav_path: str, depth: str, tree: RemoteTree, nc, user_id) -> None:
+    """Adds files and folders below ``dav_path`` to ``tree`` with one PROPFIND."""
+    response = dav_call(
+        "PROPFIND",
+        f"/files/{user_id}/{dav_path.strip('/')}",
+        nc,
+        data=PROPFIND_TREE_BODY,
+        user=user_id,
+        headers={"Depth": depth, "Content-Type": "application/xml"},
+    )
+    if response.status_code == 404:
+        return
+    response.raise_for_status()
+    prefix = f"/remote.php/dav/files/{user_id}/"
+    for item in ElementTree.fromstring(response.content).iter("{DAV:}response"):
+        href = unquote(item.findtext("{DAV:}href", ""))
+        user_path = href[href.find(prefix) + len(prefix) :].strip("/")
+        prop = item.find("{DAV:}propstat/{DAV:}prop")
+        if prop is None or not user_path:
+            continue
+        if prop.find("{DAV:}resourcetype/{DAV:}collection") is not None:
+            tree.folders.add(user_path)
+            continue
+        checksums = {}
+        for value in (
+            prop.findtext("{http://owncloud.org/ns}checksums/*") or ""
+        ).split():
+            algo, _, digest = value.partition(":")
+            checksums[algo.upper()] = digest.lower()
+        last_modified = prop.findtext("{DAV:}getlastmodified")
+        tree.files[user_path] = {
+            "size": int(prop.findtext("{DAV:}getcontentlength") or 0),
+            "mtime": (
+                parsedate_to_datetime(last_modified).timestamp() if last_modified else 0
+            ),
+            "checksums": checksums,
+        }
+
+
+def fetch_remote_tree(
+    dav_destination_path, layout: ArchiveLayout, nc: NextcloudApp, user_id
+) -> typing.Optional[RemoteTree]:
+    """Lists what already exists where the archive is extracted to.
+
+    Only the archive's own root folders are listed in depth, so extracting
+    next to unrelated files does not list them. Returns ``None`` on errors.
+    """
+    tree = RemoteTree({}, set())
+    destination = str(dav_destination_path).strip("/")
+    try:
+        for folder in layout.root_folders:
+            propfind_tree(f"{destination}/{folder}", "infinity", tree, nc, user_id)
+        if layout.root_files:
+            propfind_tree(destination, "1", tree, nc, user_id)
     except Exception as ex:
-        print("Error reading zip file!")
-        print(ex)
+        app_log(nc, LogLvl.WARNING, f"Error listing {destination}: {ex}")
+        print(f"Error listing {destination}, extracting everything: {ex}")
         return None
+    print(f"Found {len(tree.files)} files already in {destination}")
+    return tree
 
 
-def extract_to_auto(input_file: FsNode, nc: NextcloudApp, user_id, extract_to="auto"):
+def is_unchanged(size: int, mtime: float, remote_file: typing.Optional[dict]) -> bool:
+    """Compares size and modification time, the latter is kept on upload."""
+    return (
+        remote_file is not None
+        and remote_file["size"] == size
+        and bool(mtime)
+        and abs(remote_file["mtime"] - mtime) < 2
+    )
+
+
+def checksum_matches(filename, remote_file: typing.Optional[dict]) -> bool:
+    """Compares an extracted file with the checksum the server has for it, if any."""
+    if remote_file is None or remote_file["size"] != staged_size(filename):
+        return False
+    for algo in ("SHA1", "MD5"):
+        if algo in remote_file["checksums"]:
+            digest = hashlib.new(algo.lower())
+            with open_staged(filename) as f:
+                for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+                    digest.update(block)
+            return digest.hexdigest() == remote_file["checksums"][algo]
+    return False
+
+
+def extract_archive_to_pool(
+    engine: ArchiveEngine,
+    destination_path,
+    dav_destination_path,
+    user_id,
+    pool: UploadPool,
+    known_folders=(),
+    entries: typing.Optional[list] = None,
+    remote: typing.Optional[RemoteTree] = None,
+    nested: typing.Optional["NestedArchives"] = None,
+    depth: int = 0,
+    journal: typing.Optional[EntryJournal] = None,
+) -> None:
+    """Extracts archive entries one by one, queueing each for upload as soon as it is staged.
+
+    Small entries are staged in memory, see :py:func:`staging.stage_entry`.
+    With ``remote``, entries already present and identical on the server are skipped.
+    With ``nested``, archives among the entries are handed to it instead of being uploaded.
+    With ``journal``, entries a previous run of the job uploaded are not even read,
+    the others are acknowledged in it once uploaded.
+    """
+    if entries is None:
+        entries = engine.entries()
+    members = [x for x in entries if not x.is_dir]
+    # extraction and upload overlap here, progress follows the uploads
+    if depth == 0:
+        pool.progress.set_phase(
+            "upload",
+            bytes_total=sum(x.size for x in members),
+            files_total=len(members),
+        )
+    else:
+        pool.progress.extend(sum(x.size for x in members), len(members))
+    dav_paths = {}
+    for entry in entries:
+        filename = safe_entry_path(destination_path, entry.name)
+        if filename is None:
+            print(f"Skipping unsafe entry: {entry.name}")
+            continue
+        dav_paths[entry.name] = get_dav_save_path(
+            filename, destination_path, dav_destination_path, user_id
+        )
+    pool.create_folders(
+        plan_folders(
+            [dav_paths[x.name] for x in members if x.name in dav_paths],
+            [dav_paths[x.name] for x in entries if x.is_dir and x.name in dav_paths],
+            known_folders,
+        )
+    )
+    if journal is not None and journal.done:
+        resumed = [x for x in members if dav_paths.get(x.name) in journal.done]
+        for entry in resumed:
+            del dav_paths[entry.name]
+        pool.progress.add(
+            bytes_done=sum(x.size for x in resumed), files_done=len(resumed)
+        )
+        print(f"Resuming, {len(resumed)} entries were uploaded before")
+
+    def remote_file_of(entry):
+        return remote.files.get(dav_paths[entry.name].strip("/")) if remote else None
+
+    def is_nested(entry) -> bool:
+        return nested is not None and nested.accepts(entry.name, depth)
+
+    def on_extracted(entry, filename, error=None):
+        dav_path = dav_paths[entry.name]
+        if error is not None:
+            pool.release(entry.size)
+            app_log(
+                pool.nc,
+                LogLvl.WARNING,
+                f"Error extracting {entry.name}: {error}",
+                per_file=True,
+            )
+            print(f"Error extracting {entry.name}: {error}")
+            return
+        if is_nested(entry) and isinstance(filename, str):
+            # expanding it may take far more than its size, its reservation ends here
+            pool.release(entry.size)
+            pool.progress.add(bytes_done=entry.size, files_done=1)
+            nested.submit(filename, dav_path, depth, entry.mtime)
+            return
+        if checksum_matches(filename, remote_file_of(entry)):
+            discard_staged(filename)
+            pool.release(entry.size)
+            pool.skip(dav_path, entry.size, journal)
+            return
+        pool.submit(
+            filename, dav_path, reserved=entry.size, mtime=entry.mtime, journal=journal
+        )
+
+    if use_parallel_decompression(engine, members):
+        items = []
+        for entry in members:
+            if entry.name not in dav_paths:
+                continue
+            if is_unchanged(entry.size, entry.mtime, remote_file_of(entry)):
+                pool.skip(dav_paths[entry.name], entry.size, journal)
+                continue
+            items.append((entry, safe_entry_path(destination_path, entry.name)))
+        print(f"Decompressing {len(items)} files with {DECOMPRESS_WORKERS} processes")
+        extract_parallel(
+            engine.path, items, pool.reserve, on_extracted, COPY_BUFFER_SIZE
+        )
+        return
+
+    for entry, reader in engine.iter_files(set(dav_paths)):
+        if is_unchanged(entry.size, entry.mtime, remote_file_of(entry)):
+            pool.skip(dav_paths[entry.name], entry.size, journal)
+            continue
+        filename = safe_entry_path(destination_path, entry.name)
+        pool.reserve(entry.size)
+        try:
+            # nested archives are read from disk, never from memory
+            staged = stage_entry(
+                reader,
+                filename,
+                COPY_BUFFER_SIZE,
+                **({"memory_entry_bytes": 0} if is_nested(entry) else {}),
+            )
+        except ArchiveChanged:
+            pool.release(entry.size)
+            raise
+        except Exception as ex:
+            on_extracted(entry, filename, ex)
+            continue
+        on_extracted(entry, staged)
+
+
+def use_parallel_decompression(engine: ArchiveEngine, members: list) -> bool:
+    """Zip members on the local disk are worth a process pool when there are enough of them."""
+    return (
+        DECOMPRESS_WORKERS > 1
+        and isinstance(engine, ZipEngine)
+        and isinstance(engine.path, str)
+        and len(members) > 1
+        and sum(x.size for x in members) >= PARALLEL_MIN_BYTES
+    )
+
+
+class NestedArchives:
+    """Expands archives found inside an archive in the same job, without a round trip to the server.
+
+    Each nested archive is extracted from the temp disk into a folder next to where it
+    would have been uploaded, a few at a time while the outer archive goes on.
+    Its entries join the upload pool of the outer archive. Archives that can not be
+    read are uploaded as files.
+    """
+
+    def __init__(
+        self,
+        pool: UploadPool,
+        user_id,
+        max_depth: int = NESTED_DEPTH,
+        workers: int = NESTED_WORKERS,
+        journal: typing.Optional[EntryJournal] = None,
+    ):
+        self.pool = pool
+        self.user_id = user_id
+        self.max_depth = max_depth
+        self.journal = journal
+        self.expanded = 0
+        self._futures = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def accepts(self, name: str, depth: int) -> bool:
+        """Entries of the outer archive have depth 0."""
+        return depth < self.max_depth and name.lower().endswith(NESTED_SUFFIXES)
+
+    def submit(self, filename: str, dav_path: str, depth: int, mtime=None) -> None:
+        future = self._executor.submit(self._expand, filename, dav_path, depth, mtime)
+        with self._lock:
+            self._futures.append(future)
+
+    def close(self) -> None:
+        """Waits for all nested archives, including those found while waiting."""
+        while True:
+            with self._lock:
+                if not self._futures:
+                    break
+                future = self._futures.pop(0)
+            try:
+                future.result()
+            except Exception as ex:
+                print(f"Error expanding a nested archive: {ex}")
+        self._executor.shutdown(wait=True)
+
+    def _expand(self, filename: str, dav_path: str, depth: int, mtime) -> None:
+        nc = self.pool.nc
+        engine = get_engine(filename)
+        try:
+            entries = engine.entries() if engine is not None else None
+        except Exception as ex:
+            print(f"Error reading nested archive {dav_path}: {ex}")
+            entries = None
+        if entries is None:
+            print(f"Not an archive, uploading: {dav_path}")
+            self.pool.progress.extend(os.path.getsize(filename), 1)
+            self.pool.submit(filename, dav_path, mtime=mtime, journal=self.journal)
+            return
+        try:
+            layout = analyze_entries(entries)
+            dav_destination_path = str(
+                extract_folder_name(layout, Path(dav_path))
+            ).strip("/")
+            if dav_destination_path == ".":
+                dav_destination_path = ""
+            print(f"Expanding nested archive {dav_path} to {dav_destination_path}")
+            app_log(
+                nc,
+                LogLvl.INFO,
+                f"Expanding nested archive {dav_path} to {dav_destination_path}",
+                per_file=True,
+            )
+            remote = None
+            if INCREMENTAL:
+                remote = fetch_remote_tree(
+                    dav_destination_path, layout, nc, self.user_id
+                )
+            known_folders = [str(Path(dav_path).parent)]
+            if remote is not None:
+                known_folders.extend(remote.folders)
+            extract_archive_to_pool(
+                engine,
+                filename + ".extracted",
+                dav_destination_path,
+                self.user_id,
+                self.pool,
+                known_folders,
+                entries,
+                remote,
+                self,
+                depth + 1,
+                self.journal,
+            )
+            with self._lock:
+                self.expanded += 1
+        except Exception as ex:
+            app_log(nc, LogLvl.WARNING, f"Error expanding {dav_path}: {ex}")
+            print(f"Error expanding {dav_path}: {ex}")
+        finally:
+            discard_staged(filename)
+
+
+def estimate_temp_bytes(
+    input_file: FsNode, downloaded: bool, listing: typing.Optional[tuple] = None
+) -> int:
+    """Returns the temp space an extraction needs at most: the download and the extracted data.
+
+    Engines extract entry by entry, so the upload buffer bounds their extracted data,
+    except for an entry bigger than the buffer, which is let through alone.
+
+    :param listing: ``(entries, layout)`` of the archive, else the cached one is used.
+    """
+    if listing is None:
+        listing = LISTING_CACHE.get(input_file.file_id, input_file.etag)
+    if listing is not None:
+        largest = max((x.size for x in listing[0]), default=0)
+        size = min(listing[1].total_size, max(UPLOAD_BUFFER_BYTES, largest))
+    else:
+        size = input_file.info.size * ESTIMATED_COMPRESSION_RATIO
+        if input_file.info.mimetype in supported_mimetypes():
+            # raised with workspace.grow once the archive is listed
+            size = min(size, UPLOAD_BUFFER_BYTES)
+    return size + (input_file.info.size if downloaded else 0)
+
+
+def extract_to_auto(
+    input_file: FsNode,
+    nc: NextcloudApp,
+    user_id,
+    extract_to="auto",
+    progress: typing.Optional[JobProgress] = None,
+    selection: typing.Optional[dict] = None,
+    pool: typing.Optional["UploadPool"] = None,
+    notify: bool = True,
+    job_id: typing.Optional[str] = None,
+):
+    """Extracts an archive and uploads its content next to it.
+
+    :param selection: only extract entries matching ``patterns`` (globs) or
+        ``names`` (entry names, folders include their content).
+    :param pool: upload pool shared with other archives, left open for its owner.
+    :param notify: send the "finished" notification when done.
+    :param job_id: queued job running the extraction, its journal of uploaded
+        entries lets a restarted job resume where it stopped.
+    """
+    if progress is None:
+        progress = JobProgress()
+    journal = None
+    if job_id is not None:
+        journal = JOB_QUEUE.journal(job_id, f"{input_file.file_id}:{input_file.etag}")
     print(input_file)
-    nc.log(LogLvl.WARNING, f"Input_file: {input_file}")
+    app_log(nc, LogLvl.WARNING, f"Input_file: {input_file}")
 
     print(f"user: {user_id}")
     print(f"Directory separator: {os.sep}")
 
     input_file_name = input_file.user_path.split(os.sep)[-1]
 
-    nc.log(LogLvl.WARNING, f"input_file_name path: {input_file_name}")
+    app_log(nc, LogLvl.WARNING, f"input_file_name path: {input_file_name}")
     print(f"input_file_name path: {input_file_name}")
 
     dav_file_path = input_file.user_path.replace("\\", "/")
     # user_id, dav_file_path = dav_file_path.split("/", 1)[]
 
-    nc.log(LogLvl.WARNING, f"DAV file path: {dav_file_path}")
+    app_log(nc, LogLvl.WARNING, f"DAV file path: {dav_file_path}")
     print(f"DAV file path: {dav_file_path}")
 
-    temp_path = tempfile.gettempdir()
-
-    downloaded_file = os.path.join(temp_path, input_file_name)
-
-    nc.log(LogLvl.WARNING, f"Processing: {input_file.user_path} -> {downloaded_file}")
-
-    date_and_time = time.strftime("%Y%m%d%H%M%S")
-
+    workspace = None
+    engine = None
+    listing = None
+    local_archive = local_archive_path(input_file, user_id)
+    # a batch shares its pool, it writes locally only when all its archives are local
+    local = local_archive is not None and (
+        pool is None or isinstance(pool, LocalStoragePool)
+    )
     try:
-        with open(downloaded_file, "wb") as tmp_in:
+        if local_archive is not None:
+            print(f"Reading {input_file.name} from {local_archive}")
+            engine = open_local_engine(local_archive)
+        elif is_zip_file(input_file):
+            # a few KB instead of the whole archive, the download below then reuses the listing
+            progress.set_phase("analyze")
+            try:
+                listing = remote_zip_listing(input_file, nc, user_id)
+                if selection is not None or STREAM_ARCHIVES or journal and journal.done:
+                    # members are read remotely, the archive is never downloaded,
+                    # a resumed job only reads what it did not upload yet
+                    engine = ZipEngine(open_remote_file(input_file, nc, user_id))
+            except ArchiveChanged:
+                raise
+            except Exception as ex:
+                print(f"Remote listing of {input_file.name} failed: {ex}")
+        elif STREAM_ARCHIVES and input_file.info.mimetype in TarEngine.mimetypes:
+            progress.set_phase("analyze")
             try:
-                nc.files.download2stream(path=dav_file_path, fp=tmp_in)
-                nc.log(LogLvl.WARNING, "File downloaded")
+                engine, listing = stream_tar_engine(input_file, nc, user_id)
+            except ArchiveChanged:
+                raise
             except Exception as ex:
-                nc.log(LogLvl.ERROR, f"Error downloading file: {ex}")
+                print(f"Streaming {input_file.name} failed: {ex}")
 
-            tmp_in.flush()
+        progress.set_phase("waiting")
+        downloaded = engine is None and local_archive is None
+        workspace = (LOCAL_WORKSPACES if local else WORKSPACES).open(
+            estimate_temp_bytes(input_file, downloaded, listing), input_file_name
+        )
+        downloaded_file = workspace.file(input_file_name)
+        destination_path = workspace.directory("extracted")
+        app_log(
+            nc,
+            LogLvl.WARNING,
+            f"Processing: {input_file.user_path} -> {downloaded_file}",
+        )
 
-        destination_path = os.path.join(temp_path, "Extracted", date_and_time)
-        dav_destination_path = None
+        archive_file = local_archive or downloaded_file
+        if downloaded:
+            download_file(input_file, downloaded_file, nc, progress)
 
-        if not os.path.exists(destination_path):
-            os.makedirs(destination_path)
+        dav_destination_path = None
 
         print(f"Checking dest path for archive {input_file.name}")
+        if engine is None:
+            engine = get_engine(archive_file)
+        entries = None
+        layout = None
+        # archives without an engine are extracted before they can be analyzed
+        progress.set_phase("analyze" if engine is not None else "extract")
         try:
+            entries, layout = analyze_archive(
+                engine, archive_file, input_file, destination_path
+            )
             if extract_to == "auto":
                 dav_destination_path = extract_folder_name(
-                    downloaded_file, Path(input_file.user_path)
+                    layout, Path(input_file.user_path)
                 )
             elif extract_to == "parent":
                 dav_destination_path = Path(input_file.user_path).parent
@@ -305,118 +2363,523 @@ def extract_to_auto(input_file: FsNode, nc: NextcloudApp, user_id, extract_to="a
             if str(dav_destination_path).startswith(user_id):
                 dav_destination_path = str(dav_destination_path).split("/", 1)[-1]
 
-            nc.log(LogLvl.WARNING, f"Extracting to: {dav_destination_path}")
+            app_log(nc, LogLvl.WARNING, f"Extracting to: {dav_destination_path}")
             print(f"Extracting to: {dav_destination_path}")
         except Exception as ex:
-            nc.log(LogLvl.WARNING, f"ERROR: Checking dest path for archive: {ex}")
+            app_log(nc, LogLvl.WARNING, f"ERROR: Checking dest path for archive: {ex}")
             print(f"ERROR: Checking dest path for archive: {ex}")
-
-        print(f"Extracting archive {input_file.name}")
-        try:
-            Archive(downloaded_file).extractall(destination_path)
-        except Exception as ex:
-            nc.log(LogLvl.WARNING, f"Error extracting archive: {ex}")
-            print(f"Error extracting archive: {ex}")
-
-        for filename in Path(destination_path).rglob("*.*"):
-            nc.log(LogLvl.WARNING, f"File: {str(filename)}")
-            print(f"File: {str(filename)}")
-            # print(f"DAV save path originally: {dav_save_file_path}")
-            dav_save_file_path = str(filename).replace(
-                destination_path, f"{dav_destination_path}/"
+        if entries is not None and listing is None:
+            # estimated with the upload buffer, an entry may be bigger than that
+            workspace.grow(
+                estimate_temp_bytes(input_file, downloaded, (entries, layout)),
+                input_file_name,
             )
-            # print(f"DAV save path replacing destination path: {dav_save_file_path}")
-            dav_save_file_path = dav_save_file_path.replace("\\", "/")
-            # print(f"Replacing the forward slashes: {dav_save_file_path}")
-            dav_save_file_path = dav_save_file_path.replace("//", "/")
-
-            if dav_save_file_path.startswith(user_id):
-                dav_save_file_path = dav_save_file_path.split("/", 1)[-1]
 
-            nc.log(LogLvl.WARNING, f"Final DAV path: {dav_save_file_path}")
-            print(f"Final DAV path: {dav_save_file_path}")
-
-            nc.log(LogLvl.WARNING, f"Uploading: {filename} to: {dav_save_file_path}")
-            try:
-                nc.files.upload_stream(path=dav_save_file_path, fp=filename)
-            except Exception as ex:
-                nc.log(LogLvl.WARNING, "Error uploading, using alt")
-                dav_save_file_path = f"/files/{user_id}/{dav_save_file_path}"
+        if selection is not None and entries is not None:
+            entries = select_entries(
+                entries, selection.get("patterns", ()), selection.get("names", ())
+            )
+            layout = analyze_entries(entries)
+            print(f"Selected {len(entries)} entries")
 
-                nc.log(
-                    LogLvl.WARNING, f"dav_save_file_path becomes: {dav_save_file_path}"
+        print(f"Extracting archive {input_file.name}")
+        # the folder holding the archive exists, no need to create it again
+        known_folders = [str(Path(dav_file_path).parent)]
+        remote = None
+        if INCREMENTAL and layout is not None:
+            remote = fetch_remote_tree(dav_destination_path, layout, nc, user_id)
+        if remote is not None:
+            known_folders.extend(remote.folders)
+        shared_pool = pool is not None
+        if not shared_pool:
+            pool = new_upload_pool(nc, user_id, progress, local=local)
+        if isinstance(pool, LocalStoragePool) and dav_destination_path is not None:
+            pool.add_rescan(dav_destination_path)
+        nested = None
+        if NESTED_DEPTH > 0:
+            nested = NestedArchives(pool, user_id, journal=journal)
+        try:
+            if engine is not None:
+                print(f"Extracting with the {engine.name} engine")
+                extract_archive_to_pool(
+                    engine,
+                    destination_path,
+                    dav_destination_path,
+                    user_id,
+                    pool,
+                    known_folders,
+                    entries,
+                    remote,
+                    nested,
+                    journal=journal,
                 )
-
-                dav_call(
-                    "PUT",
-                    dav_save_file_path,
-                    nc,
-                    data=open(str(filename), "rb").read(),
-                    user=user_id,
+            else:
+                uploads = [
+                    (
+                        filename,
+                        get_dav_save_path(
+                            filename, destination_path, dav_destination_path, user_id
+                        ),
+                    )
+                    for filename in Path(destination_path).rglob("*")
+                    if filename.is_file()
+                    and (
+                        selection is None
+                        or is_selected(
+                            os.path.relpath(filename, destination_path),
+                            selection.get("patterns", ()),
+                            selection.get("names", ()),
+                        )
+                    )
+                ]
+                pool.create_folders(
+                    plan_folders(
+                        [dav_path for _, dav_path in uploads],
+                        [
+                            get_dav_save_path(
+                                x, destination_path, dav_destination_path, user_id
+                            )
+                            for x in Path(destination_path).rglob("*")
+                            if x.is_dir()
+                        ],
+                        known_folders,
+                    )
                 )
-
-                nc.log(LogLvl.ERROR, f"ERROR: {ex}")
-
-            os.remove(str(filename))
+                progress.set_phase(
+                    "upload",
+                    bytes_total=sum(os.path.getsize(x) for x, _ in uploads),
+                    files_total=len(uploads),
+                )
+                for filename, dav_path in uploads:
+                    remote_file = (
+                        remote.files.get(dav_path.strip("/")) if remote else None
+                    )
+                    mtime = os.path.getmtime(filename)
+                    if journal is not None and dav_path in journal.done:
+                        pool.progress.add(
+                            bytes_done=os.path.getsize(filename), files_done=1
+                        )
+                        discard_staged(filename)
+                    elif nested is not None and nested.accepts(filename.name, 0):
+                        pool.progress.add(
+                            bytes_done=os.path.getsize(filename), files_done=1
+                        )
+                        nested.submit(str(filename), dav_path, 0, mtime)
+                    elif is_unchanged(os.path.getsize(filename), mtime, remote_file):
+                        discard_staged(filename)
+                        pool.skip(dav_path, remote_file["size"], journal)
+                    else:
+                        pool.submit(filename, dav_path, mtime=mtime, journal=journal)
+        except ArchiveChanged:
+            raise
+        except Exception as ex:
+            app_log(nc, LogLvl.WARNING, f"Error extracting archive: {ex}")
+            print(f"Error extracting archive: {ex}")
+        finally:
+            if nested is not None:
+                nested.close()
+                print(f"Expanded {nested.expanded} nested archives")
+            if not shared_pool:
+                pool.close()
 
         try:
-            nc.log(LogLvl.WARNING, "Removing original file")
+            app_log(nc, LogLvl.WARNING, "Removing original file")
             print("Removing original file")
-            os.remove(downloaded_file)
+            if os.path.exists(downloaded_file):
+                discard_staged(downloaded_file)
         except Exception as ex:
-            nc.log(LogLvl.WARNING, f"Error removing file: {ex}")
+            app_log(nc, LogLvl.WARNING, f"Error removing file: {ex}")
             print(f"Error removing file: {ex}")
 
-        nc.log(LogLvl.WARNING, "Result uploaded")
+        app_log(nc, LogLvl.WARNING, "Result uploaded")
         print(f"{input_file_name} finished!", f"{input_file_name} is waiting for you!")
 
-        try:
-            nc.notifications.create(
-                subject=f"{input_file_name} finished!",
-                message=f"{input_file_name} is waiting for you!",
-            )
-        except Exception as ex:
-            create_notification(
+        if notify:
+            send_notification(
+                nc,
                 user_id,
                 f"{input_file_name} finished!",
-                "Extracted file(s) are waiting for you!",
+                f"{input_file_name} is waiting for you!",
             )
 
+    except ArchiveChanged as e:
+        # listing and journal were keyed by the old etag but describe other bytes
+        LISTING_CACHE.discard(input_file.file_id, input_file.etag)
+        if journal is not None:
+            journal.discard()
+        app_log(nc, LogLvl.ERROR, str(e))
+        print(f"Stopping extraction: {e}")
+        if notify:
+            send_notification(
+                nc,
+                user_id,
+                f"{input_file_name} was not extracted",
+                "The file changed while it was being extracted, run the action again.",
+            )
+        raise
+    except WorkspaceFull as e:
+        app_log(nc, LogLvl.ERROR, str(e))
+        print(f"Refusing extraction: {e}")
+        if notify:
+            send_notification(
+                nc,
+                user_id,
+                f"{input_file_name} was not extracted",
+                "Not enough temporary disk space, try again later.",
+            )
+        raise
     except Exception as e:
-        nc.log(LogLvl.ERROR, str(e))
+        app_log(nc, LogLvl.ERROR, str(e))
         print("Error occurred", "Error information was written to log file")
+        raise
+    finally:
+        progress.end_phase()
+        if pool is not None and workspace is not None:
+            # a shared pool is still open, this archive's uploads and their journal
+            # acks must finish before the journal is flushed and the workspace removed
+            pool.drain(workspace.path)
+        if journal is not None:
+            journal.flush()
+        if engine is not None and isinstance(engine.path, mmap.mmap):
+            engine.path.close()
+        if workspace is not None:
+            workspace.close()
+        flush_logs()
+
+
+def batch_archives(files: typing.List[ActionFileInfo], nc: NextcloudApp) -> list:
+    """Returns the archives of a multi-selection, largest first.
+
+    Selected folders contribute the archives directly inside them.
+    """
+    mimetypes = set(supported_mimetypes())
+    archives = {}
+    for file in files:
+        node = file.to_fs_node()
+        if not node.is_dir:
+            archives[node.info.fileid] = node
+            continue
+        try:
+            nodes = nc.files.listdir(node)
+        except Exception as ex:
+            app_log(nc, LogLvl.WARNING, f"Error listing {node.user_path}: {ex}")
+            print(f"Error listing {node.user_path}: {ex}")
+            continue
+        for x in nodes:
+            if not x.is_dir and x.info.mimetype in mimetypes:
+                archives[x.info.fileid] = x
+    # the largest archives start first, small ones fill the gaps at the end
+    return sorted(archives.values(), key=lambda x: x.info.size, reverse=True)
+
+
+def extract_batch(
+    files: typing.List[ActionFileInfo],
+    nc: NextcloudApp,
+    user_id,
+    extract_to="auto",
+    progress: typing.Optional[JobProgress] = None,
+    job_id: typing.Optional[str] = None,
+) -> dict:
+    """Extracts many archives as one job, with one upload pool and one notification.
+
+    Progress counts archives and their compressed size.
+    """
+    if progress is None:
+        progress = JobProgress()
+    archives = batch_archives(files, nc)
+    progress.set_phase(
+        "batch",
+        bytes_total=sum(x.info.size for x in archives),
+        files_total=len(archives),
+    )
+    print(f"Extracting {len(archives)} archives")
+    failed = []
+    local = bool(DATA_DIR) and all(local_archive_path(x, user_id) for x in archives)
+    pool = new_upload_pool(nc, user_id, local=local)
+
+    def extract_one(node: FsNode) -> None:
+        try:
+            extract_to_auto(
+                node,
+                nc,
+                user_id,
+                extract_to,
+                pool=pool,
+                notify=False,
+                job_id=job_id,
+            )
+        except Exception as ex:
+            failed.append(node.name)
+            progress.add(files_failed=1)
+            app_log(nc, LogLvl.ERROR, f"Error extracting {node.user_path}: {ex}")
+            print(f"Error extracting {node.user_path}: {ex}")
+            return
+        progress.add(bytes_done=node.info.size, files_done=1)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, BATCH_WORKERS)) as executor:
+            list(executor.map(extract_one, archives))
+    finally:
+        stats = pool.close()
+
+    subject = f"{len(archives) - len(failed)} of {len(archives)} archives extracted"
+    message = f"{stats['files']} file(s) uploaded, {stats['skipped']} unchanged."
+    if stats["failed"]:
+        message += f" {len(stats['failed'])} file(s) could not be uploaded."
+    if failed:
+        message += f" Failed: {', '.join(sorted(failed))}"
+    send_notification(nc, user_id, subject, message)
+    flush_logs()
+    return {"archives": len(archives), "failed": failed, "uploads": stats}
+
+
+def run_extraction_job(job: dict, progress: JobProgress) -> None:
+    nc = NextcloudApp()
+    nc.set_user(job["user_id"])
+    if job["action"] == "batch":
+        extract_batch(
+            [ActionFileInfo.model_validate(x) for x in job["payload"]["files"]],
+            nc,
+            job["user_id"],
+            "auto",
+            progress,
+            job["id"],
+        )
+        return
+    file = UiActionFileInfo.model_validate(job["payload"]["file"])
+    extract_to_auto(
+        file.to_fs_node(),
+        nc,
+        job["user_id"],
+        job["action"],
+        progress,
+        job["payload"].get("selection"),
+        job_id=job["id"],
+    )
+
+
+JOB_QUEUE = JobQueue(run_extraction_job)
+
+REGISTRY.gauge(
+    "extract_jobs", "Jobs waiting or running.", lambda: JOB_QUEUE.counts(), ("state",)
+)
+
+
+def workspace_bytes() -> dict:
+    usage = WORKSPACES.usage()
+    return {"reserved": usage["reserved_bytes"], "used": usage["used_bytes"]}
+
+
+REGISTRY.gauge(
+    "extract_workspace_bytes",
+    "Temp disk space reserved for and used by running extractions.",
+    workspace_bytes,
+    ("kind",),
+)
+REGISTRY.gauge(
+    "extract_staged_memory_bytes",
+    "Extracted entries held in memory until their upload.",
+    lambda: MEMORY_BUDGET.used,
+)
+
+
+def enqueue_extraction(
+    file: UiActionFileInfo,
+    user_id: str,
+    extract_to: str,
+    selection: typing.Optional[dict] = None,
+):
+    payload = {"file": file.model_dump(mode="json"), "selection": selection}
+    return enqueue_job(user_id, extract_to, payload, file.name)
+
+
+def enqueue_job(user_id: str, action: str, payload: dict, description: str):
+    try:
+        job_id = JOB_QUEUE.enqueue(user_id, action, payload)
+    except JobQueueFull as ex:
+        print(f"Refusing extraction of {description}: {ex}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(ex)
+        )
+    return responses.JSONResponse({"job_id": job_id})
 
 
 @APP.post("/extract_to_auto")
 async def endpoint_extract_to_auto(
     file: UiActionFileInfo,
     request: Request,
-    nc: Annotated[NextcloudApp, Depends(nc_app)],
-    background_tasks: BackgroundTasks,
 ):
     try:
         user_id = sign_check(request)
     except ValueError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    background_tasks.add_task(extract_to_auto, file.to_fs_node(), nc, user_id, "auto")
-    return Response()
+    return enqueue_extraction(file, user_id, "auto")
 
 
 @APP.post("/extract_to_parent")
 async def endpoint_extract_to_parent(
     file: UiActionFileInfo,
     request: Request,
+):
+    try:
+        user_id = sign_check(request)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    return enqueue_extraction(file, user_id, "parent")
+
+
+@APP.post("/extract_batch")
+async def endpoint_extract_batch(
+    files: ActionFileInfoEx,
+    request: Request,
+):
+    try:
+        user_id = sign_check(request)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    return enqueue_job(
+        user_id,
+        "batch",
+        {"files": [x.model_dump(mode="json") for x in files.files]},
+        f"{len(files.files)} selected item(s)",
+    )
+
+
+class SelectiveExtraction(BaseModel):
+    file: UiActionFileInfo
+    patterns: typing.List[str] = []
+    names: typing.List[str] = []
+    extract_to: str = "auto"
+
+
+@APP.post("/archive/list")
+def endpoint_archive_list(
+    file: UiActionFileInfo,
+    request: Request,
     nc: Annotated[NextcloudApp, Depends(nc_app)],
-    background_tasks: BackgroundTasks,
 ):
     try:
         user_id = sign_check(request)
     except ValueError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    background_tasks.add_task(extract_to_auto, file.to_fs_node(), nc, user_id, "parent")
-    return Response()
+    try:
+        entries, layout = archive_listing(file.to_fs_node(), nc, user_id)
+    except ListingNeedsDownload as ex:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(ex)
+        )
+    except ArchiveChanged as ex:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(ex))
+    return responses.JSONResponse(
+        {
+            "entry_count": layout.entry_count,
+            "total_size": layout.total_size,
+            "root_folders": layout.root_folders,
+            "root_files": layout.root_files,
+            "entries": [
+                {
+                    "name": x.name,
+                    "size": x.size,
+                    "compressed_size": x.compressed_size,
+                    "is_dir": x.is_dir,
+                }
+                for x in entries
+            ],
+        }
+    )
+
+
+@APP.post("/extract_selected")
+async def endpoint_extract_selected(
+    request_data: SelectiveExtraction, request: Request
+):
+    try:
+        user_id = sign_check(request)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    if not request_data.patterns and not request_data.names:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either patterns or names must be given",
+        )
+    if request_data.extract_to not in ("auto", "parent"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid extract_to: {request_data.extract_to}",
+        )
+    return enqueue_extraction(
+        request_data.file,
+        user_id,
+        request_data.extract_to,
+        {"patterns": request_data.patterns, "names": request_data.names},
+    )
+
+
+@APP.get("/metrics")
+async def endpoint_metrics(request: Request):
+    """Prometheus metrics of this process."""
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+        ):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    else:
+        try:
+            sign_check(request)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    return responses.PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@APP.get("/jobs")
+async def endpoint_jobs(request: Request, limit: int = 100):
+    try:
+        user_id = sign_check(request)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    return responses.JSONResponse(
+        [_job_status(job) for job in JOB_QUEUE.list(user_id, limit)]
+    )
+
+
+@APP.get("/jobs/{job_id}")
+async def endpoint_job(job_id: str, request: Request):
+    try:
+        user_id = sign_check(request)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    job = JOB_QUEUE.get(job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return responses.JSONResponse(_job_status(job))
+
+
+def _job_status(job: dict) -> dict:
+    return {
+        "id": job["id"],
+        "action": job["action"],
+        "file": (
+            job["payload"]["file"].get("name")
+            if "file" in job["payload"]
+            else [x.get("name") for x in job["payload"]["files"]]
+        ),
+        "state": job["state"],
+        "created": job["created"],
+        "started": job["started"],
+        "finished": job["finished"],
+        "error": job["error"],
+        "progress": job["progress"],
+    }
 
 
 def enabled_handler(enabled: bool, nc: NextcloudApp) -> str:
@@ -427,32 +2890,38 @@ def enabled_handler(enabled: bool, nc: NextcloudApp) -> str:
                 "extract_to_here",
                 "Extract To Auto",
                 "/extract_to_auto",
-                mime="application/zip",
+                mime=",".join(supported_mimetypes()),
             )
 
             nc.ui.files_dropdown_menu.register(
                 "extract_to_parent",
                 "Extract To Parent",
                 "/extract_to_parent",
-                mime="application/zip",
+                mime=",".join(supported_mimetypes()),
             )
         else:
             nc.ui.files_dropdown_menu.unregister("extract_to_here")
             nc.ui.files_dropdown_menu.unregister("extract_to_parent")
     except Exception as e:
         return str(e)
+    try:
+        if enabled:
+            # multi-selection needs the v2 file actions of AppAPI 2.6
+            nc.ui.files_dropdown_menu.register_ex(
+                "extract_batch",
+                "Extract All",
+                "/extract_batch",
+                mime=",".join(supported_mimetypes() + ["httpd/unix-directory"]),
+            )
+        else:
+            nc.ui.files_dropdown_menu.unregister("extract_batch")
+    except Exception as e:
+        print(f"Batch extraction action not available: {e}")
     return ""
 
 
 if __name__ == "__main__":
-    main_temp_path = tempfile.gettempdir()
-    main_destination_path = os.path.join(main_temp_path, "Extracted")
-
-    try:
-        shutil.rmtree(main_destination_path)
-    except OSError as e:
-        print("Error: %s - %s." % (e.filename, e.strerror))
-
+    # workspaces of jobs that did not finish are removed by age, see workspace.py
     run_app(
         "main:APP",
         log_level="trace",
@@ -0,0 +1,246 @@
+"""Process-wide counters and latency histograms, rendered in the Prometheus text format."""
+
+import bisect
+import contextlib
+import threading
+import time
+import typing
+
+# Upper bounds of the latency buckets, in seconds.
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    1800,
+)
+
+
+class Metric:
+    """Base of the metric types, values are kept per label set."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}")
+        return tuple(str(labels[x]) for x in self.labels)
+
+    def _label_text(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> typing.List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence = ()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> typing.List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self._label_text(k)} {_number(v)}" for k, v in values]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: typing.Sequence = (),
+        buckets: typing.Sequence = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., sum]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the duration of the ``with`` block, also when it raises."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            values = self._values.get(self._key(labels))
+            return sum(values[:-1]) if values else 0
+
+    def samples(self) -> typing.List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, values in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                labels = self._label_text(key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{self._label_text(key)} {_number(values[-1])}"
+            )
+            lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+
+class Gauge(Metric):
+    """Value read from ``callback`` on collection, a number or ``{label values: number}``."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: typing.Callable[[], dict],
+        labels: typing.Sequence = (),
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self) -> typing.List[str]:
+        try:
+            values = self.callback()
+        except Exception as ex:
+            print(f"Error collecting {self.name}: {ex}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = []
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{self._label_text(key)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"{metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(
+        self, name: str, documentation: str, labels=(), **kwargs
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, **kwargs))
+
+    def gauge(self, name: str, documentation: str, callback, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, callback, labels))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(x.render() for x in metrics) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.histogram(
+    "extract_phase_seconds",
+    "Time spent in each phase of an extraction.",
+    ("phase",),
+)
+JOB_WAIT_SECONDS = REGISTRY.histogram(
+    "extract_job_wait_seconds", "Time jobs spent in the queue before they started."
+)
+JOBS_FINISHED = REGISTRY.counter(
+    "extract_jobs_finished_total",
+    "Finished jobs by action and final state.",
+    ("action", "state"),
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "extract_http_request_seconds",
+    "Latency of WebDAV and OCS requests to Nextcloud.",
+    ("api", "method"),
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    "extract_http_requests_total",
+    "WebDAV and OCS requests to Nextcloud by method and status, 0 for connection errors.",
+    ("api", "method", "status"),
+)
+HTTP_BYTES = REGISTRY.counter(
+    "extract_http_bytes_total",
+    "Request and response bodies of WebDAV and OCS requests.",
+    ("api", "direction"),
+)
+TRANSFER_BYTES = REGISTRY.counter(
+    "extract_transfer_bytes_total",
+    "Archive bytes downloaded, extracted bytes uploaded or skipped as unchanged.",
+    ("kind",),
+)
+TRANSFER_FILES = REGISTRY.counter(
+    "extract_transfer_files_total",
+    "Extracted files uploaded, skipped as unchanged or failed.",
+    ("kind",),
+)
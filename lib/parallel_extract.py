@@ -0,0 +1,151 @@
+"""Zip decompression spread over a pool of processes.
+
+Zip members are compressed independently, so batches of members can be
+decompressed by different processes, each with its own handle on the archive.
+"""
+
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import typing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from workspace import track_written
+
+# Processes decompressing zip members, 1 decompresses in the job's own thread.
+DECOMPRESS_WORKERS = int(os.environ.get("EXTRACT_DECOMPRESS_WORKERS", "1"))
+# Zip archives smaller than this are always decompressed in the job's own thread.
+PARALLEL_MIN_BYTES = int(os.environ.get("EXTRACT_PARALLEL_MIN_MB", "64")) * 1024 * 1024
+# Members handed to a process at once, small members are grouped to save round trips.
+BATCH_BYTES = 16 * 1024 * 1024
+BATCH_FILES = 256
+
+_POOL: typing.Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_process_pool(workers: int = DECOMPRESS_WORKERS) -> ProcessPoolExecutor:
+    """Returns the process pool shared by all jobs."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # the app runs threads, forking it could copy held locks into the children
+            _POOL = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _POOL
+
+
+def shutdown_process_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def plan_batches(
+    items: list, batch_bytes: int = BATCH_BYTES, batch_files: int = BATCH_FILES
+):
+    """Groups ``(entry, filename)`` items into batches of about ``batch_bytes``."""
+    batches = []
+    batch = []
+    batch_size = 0
+    for entry, filename in items:
+        if batch and (
+            batch_size + entry.size > batch_bytes or len(batch) >= batch_files
+        ):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append((entry, filename))
+        batch_size += entry.size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def extract_members(zip_path: str, members: list, buffer_size: int) -> list:
+    """Runs in a worker process, returns ``(name, error)`` for every ``(name, filename)`` member."""
+    results = []
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for name, filename in members:
+            try:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with zip_ref.open(name) as reader, open(filename, "wb") as f:
+                    shutil.copyfileobj(reader, f, buffer_size)
+                results.append((name, None))
+            except Exception as ex:
+                results.append((name, str(ex)))
+    return results
+
+
+def extract_parallel(
+    zip_path: str,
+    items: list,
+    reserve,
+    on_extracted,
+    buffer_size: int,
+    workers: int = DECOMPRESS_WORKERS,
+) -> None:
+    """Decompresses zip members in the process pool.
+
+    :param items: ``(entry, filename)`` pairs to extract.
+    :param reserve: called with a batch's size before it is dispatched, may block.
+    :param on_extracted: called with ``(entry, filename, error)`` for every member,
+        from the calling thread, as soon as its batch is done.
+    """
+    pool = get_process_pool(workers)
+    batches = plan_batches(items)
+    # finished batches, then (None, dispatched batches, error) once all are dispatched
+    results = queue.Queue()
+
+    def dispatch():
+        dispatched = 0
+        try:
+            for batch in batches:
+                # blocks until on_extracted, running in the calling thread, frees space
+                reserve(sum(entry.size for entry, _ in batch))
+                future = pool.submit(
+                    extract_members,
+                    zip_path,
+                    [(entry.name, filename) for entry, filename in batch],
+                    buffer_size,
+                )
+                future.add_done_callback(lambda f, b=batch: results.put((b, f, None)))
+                dispatched += 1
+        except Exception as ex:
+            results.put((None, dispatched, ex))
+            return
+        results.put((None, dispatched, None))
+
+    dispatcher = threading.Thread(target=dispatch, name="decompress_dispatch")
+    dispatcher.start()
+    handled = 0
+    dispatched = None
+    error = None
+    while dispatched is None or handled < dispatched:
+        batch, outcome, ex = results.get()
+        if batch is None:
+            dispatched, error = outcome, ex
+            continue
+        _batch_done(outcome, batch, on_extracted)
+        handled += 1
+    dispatcher.join()
+    if error is not None:
+        raise error
+
+
+def _batch_done(future, batch: list, on_extracted) -> None:
+    try:
+        errors = dict(future.result())
+    except Exception as ex:
+        errors = {entry.name: str(ex) for entry, _ in batch}
+    for entry, filename in batch:
+        error = errors.get(entry.name)
+        if error is None:
+            track_written(filename, os.path.getsize(filename))
+        on_extracted(entry, filename, error)
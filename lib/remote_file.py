@@ -0,0 +1,141 @@
+"""Read-only files over HTTP: seekable through Range requests, or streamed."""
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+# Size of one cached block and number of blocks kept per remote file.
+REMOTE_BLOCK_SIZE = int(os.environ.get("EXTRACT_REMOTE_BLOCK_KB", "256")) * 1024
+REMOTE_CACHE_BLOCKS = int(os.environ.get("EXTRACT_REMOTE_CACHE_BLOCKS", "64"))
+
+
+class RemoteFile(io.RawIOBase):
+    """File object reading a remote file with Range requests through a block cache.
+
+    ``zipfile`` can open it directly, so only the central directory and the
+    members actually read are transferred.
+
+    :param fetch: callable ``fetch(start, end)`` returning bytes ``start..end`` inclusive.
+    :param size: size of the remote file.
+    """
+
+    def __init__(
+        self,
+        fetch,
+        size: int,
+        block_size: int = REMOTE_BLOCK_SIZE,
+        cache_blocks: int = REMOTE_CACHE_BLOCKS,
+    ):
+        super().__init__()
+        self.fetch = fetch
+        self.size = size
+        self.block_size = block_size
+        self.cache_blocks = max(1, cache_blocks)
+        self.position = 0
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise OSError("Negative seek position")
+        self.position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size:
+            return 0
+        end = min(self.position + len(buffer), self.size)
+        data = self._read_range(self.position, end)
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def readall(self) -> bytes:
+        data = self._read_range(self.position, self.size)
+        self.position = self.size
+        return data
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        """Returns bytes ``start..end`` (exclusive), fetching missing blocks in one request."""
+        if start >= end:
+            return b""
+        first = start // self.block_size
+        last = (end - 1) // self.block_size
+        with self._lock:
+            missing = [i for i in range(first, last + 1) if i not in self._blocks]
+            if missing:
+                self._fetch_blocks(missing[0], missing[-1])
+            data = b"".join(self._block(i) for i in range(first, last + 1))
+        offset = first * self.block_size
+        return data[start - offset : end - offset]
+
+    def _fetch_blocks(self, first: int, last: int) -> None:
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        data = self.fetch(start, end)
+        if len(data) != end - start + 1:
+            raise OSError(f"Range {start}-{end} returned {len(data)} bytes")
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        for i in range(first, last + 1):
+            offset = (i - first) * self.block_size
+            self._blocks[i] = data[offset : offset + self.block_size]
+            self._blocks.move_to_end(i)
+        while len(self._blocks) > max(self.cache_blocks, last - first + 1):
+            self._blocks.popitem(last=False)
+
+    def _block(self, index: int) -> bytes:
+        self._blocks.move_to_end(index)
+        return self._blocks[index]
+
+
+class ChunkStream(io.RawIOBase):
+    """Forward-only file object over an iterator of byte chunks, e.g. a streamed response.
+
+    :param close: called once when the file is closed, e.g. to release the connection.
+    """
+
+    def __init__(self, chunks, close=None):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._close = close
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed and self._close is not None:
+            self._close()
+        super().close()
@@ -0,0 +1,137 @@
+"""Extracted entries waiting for their upload, kept in memory or on the temp disk.
+
+A staged entry is either the path of a temp file or a :py:class:`MemoryEntry`.
+"""
+
+import io
+import os
+import shutil
+import threading
+
+from workspace import track_written
+
+# Entries up to this size are kept in memory instead of a temp file, 0 always uses the disk.
+MEMORY_ENTRY_BYTES = int(os.environ.get("EXTRACT_MEMORY_ENTRY_KB", "1024")) * 1024
+# Memory shared by all entries kept in memory, further entries spill to the disk.
+MEMORY_BUDGET_BYTES = (
+    int(os.environ.get("EXTRACT_MEMORY_BUDGET_MB", "128")) * 1024 * 1024
+)
+
+
+class MemoryBudget:
+    """Process-wide limit of the memory used by staged entries, never blocks."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, size: int) -> bool:
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def release(self, size: int) -> None:
+        with self._lock:
+            self.used -= size
+
+
+MEMORY_BUDGET = MemoryBudget(MEMORY_BUDGET_BYTES)
+
+
+class MemoryEntry:
+    """Content of an extracted entry held in memory, in place of its temp file."""
+
+    def __init__(self, path: str, data: bytes, budget: MemoryBudget = MEMORY_BUDGET):
+        self.path = path
+        self.data = data
+        self.budget = budget
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def discard(self) -> None:
+        if self.data is not None:
+            self.budget.release(len(self.data))
+            self.data = None
+
+    def __str__(self):
+        return f"{self.path} (in memory)"
+
+
+def stage_entry(
+    reader,
+    filename: str,
+    buffer_size: int,
+    memory_entry_bytes: int = MEMORY_ENTRY_BYTES,
+    budget: MemoryBudget = MEMORY_BUDGET,
+):
+    """Stages one entry, in memory when it is small and the budget allows, else in ``filename``.
+
+    The size is taken from the data, not from the archive's headers.
+    """
+    head = b""
+    if memory_entry_bytes > 0:
+        head = read_up_to(reader, memory_entry_bytes + 1)
+        if len(head) <= memory_entry_bytes and budget.try_acquire(len(head)):
+            return MemoryEntry(filename, head, budget)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "wb") as f:
+        f.write(head)
+        shutil.copyfileobj(reader, f, buffer_size)
+        track_written(filename, f.tell())
+    return filename
+
+
+def read_up_to(reader, size: int) -> bytes:
+    """Reads ``size`` bytes or up to the end, some decompressors return less per call."""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = reader.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+def staged_path(staged) -> str:
+    """Returns where the entry is or would be staged on disk."""
+    if isinstance(staged, MemoryEntry):
+        return staged.path
+    return str(staged)
+
+
+def staged_size(staged) -> int:
+    if isinstance(staged, MemoryEntry):
+        return staged.size
+    return os.path.getsize(staged)
+
+
+def open_staged(staged):
+    if isinstance(staged, MemoryEntry):
+        return io.BytesIO(staged.data)
+    return open(str(staged), "rb")
+
+
+def read_staged(staged, offset: int, size: int) -> bytes:
+    if isinstance(staged, MemoryEntry):
+        return staged.data[offset : offset + size]
+    with open(str(staged), "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def discard_staged(staged) -> None:
+    if isinstance(staged, MemoryEntry):
+        staged.discard()
+    else:
+        size = os.path.getsize(str(staged))
+        os.remove(str(staged))
+        track_written(staged, -size)
@@ -0,0 +1,250 @@
+"""Per-job temp directories with admission by free disk space."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import typing
+
+# Directory holding one workspace per running extraction.
+WORKSPACE_ROOT = os.environ.get(
+    "EXTRACT_WORKSPACE_DIR", os.path.join(tempfile.gettempdir(), "Extracted")
+)
+# Workspaces not touched for this long belong to crashed jobs and are removed.
+WORKSPACE_MAX_AGE = float(os.environ.get("EXTRACT_WORKSPACE_MAX_AGE_HOURS", "6")) * 3600
+# Free space left untouched on the temp disk.
+DISK_RESERVE_BYTES = int(os.environ.get("EXTRACT_DISK_RESERVE_MB", "512")) * 1024 * 1024
+# Seconds a job waits for temp space held by other jobs before it is refused.
+DISK_WAIT_SECONDS = float(os.environ.get("EXTRACT_DISK_WAIT_SECONDS", "600"))
+
+# Seconds between two garbage collections triggered by new workspaces.
+GC_INTERVAL = 600
+
+# Every manager, files are counted against the workspace holding them.
+_MANAGERS = []
+
+
+class WorkspaceFull(Exception):
+    """Raised when the temp disk can not hold a job's workspace."""
+
+
+class Workspace:
+    """Unique directory of one job, removed with everything in it on :py:meth:`close`.
+
+    ``written`` counts the bytes reported with :py:func:`track_written`, the
+    directory is never walked.
+    """
+
+    def __init__(self, manager: "WorkspaceManager", path: str, reserved: int):
+        self.manager = manager
+        self.path = path
+        self.reserved = reserved
+        self.written = 0
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, os.path.basename(name))
+
+    def directory(self, name: str) -> str:
+        path = os.path.join(self.path, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def used_bytes(self) -> int:
+        return max(self.written, 0)
+
+    def grow(self, estimate: int, label: str = "") -> None:
+        """Raises the workspace's estimate to ``estimate`` once the extra space is free.
+
+        :raises WorkspaceFull: the space does not become available in time.
+        """
+        self.manager.grow(self, estimate, label)
+
+    def close(self) -> None:
+        self.manager.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class WorkspaceManager:
+    """Hands out workspaces and tracks the temp space reserved for them.
+
+    A workspace is only created when the space estimated for it is free, taking
+    into account what running jobs reserved but did not write yet. Jobs wait for
+    running ones to finish and are refused when they could never fit.
+    """
+
+    def __init__(
+        self,
+        root: str = WORKSPACE_ROOT,
+        reserve_bytes: int = DISK_RESERVE_BYTES,
+        max_age: float = WORKSPACE_MAX_AGE,
+        wait_seconds: float = DISK_WAIT_SECONDS,
+    ):
+        self.root = root
+        self.reserve_bytes = reserve_bytes
+        self.max_age = max_age
+        self.wait_seconds = wait_seconds
+        self._active = {}
+        self._condition = threading.Condition()
+        self._last_gc = 0.0
+        _MANAGERS.append(self)
+
+    def open(self, estimate: int, label: str = "") -> Workspace:
+        """Creates a workspace for a job expected to write ``estimate`` bytes.
+
+        :raises WorkspaceFull: the space does not become available in time.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        if time.monotonic() - self._last_gc > GC_INTERVAL:
+            self.collect_garbage()
+        with self._condition:
+            self._wait_for_space(estimate, label)
+            path = tempfile.mkdtemp(
+                prefix=time.strftime("%Y%m%d%H%M%S_"), dir=self.root
+            )
+            workspace = Workspace(self, path, estimate)
+            self._active[path] = workspace
+        return workspace
+
+    def grow(self, workspace: Workspace, estimate: int, label: str = "") -> None:
+        """Raises the estimate of an open workspace, e.g. once its archive was listed.
+
+        :raises WorkspaceFull: the space does not become available in time.
+        """
+        with self._condition:
+            if estimate > workspace.reserved:
+                self._wait_for_space(estimate - workspace.reserved, label)
+                workspace.reserved = estimate
+
+    def _wait_for_space(self, estimate: int, label: str) -> None:
+        """Waits until ``estimate`` bytes are available, the condition must be held.
+
+        :raises WorkspaceFull: the space does not become available in time.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            available, capacity = self._space()
+            if estimate <= available:
+                return
+            if estimate > capacity:
+                raise WorkspaceFull(
+                    f"{label} needs about {estimate // 1048576} MB of temp space, "
+                    f"at most {max(capacity, 0) // 1048576} MB can be freed"
+                )
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WorkspaceFull(
+                    f"{label} needs about {estimate // 1048576} MB of temp space, "
+                    f"{max(available, 0) // 1048576} MB are available"
+                )
+            print(f"Waiting for temp space for {label}")
+            self._condition.wait(min(remaining, 5))
+
+    def release(self, workspace: Workspace) -> None:
+        shutil.rmtree(workspace.path, ignore_errors=True)
+        with self._condition:
+            self._active.pop(workspace.path, None)
+            self._condition.notify_all()
+
+    def track(self, path: str, size: int) -> bool:
+        """Adds ``size`` to the written bytes of the workspace holding ``path``, if any."""
+        path = os.path.abspath(path)
+        with self._condition:
+            for workspace in self._active.values():
+                if path.startswith(os.path.abspath(workspace.path) + os.sep):
+                    workspace.written += size
+                    if size < 0:
+                        self._condition.notify_all()
+                    return True
+        return False
+
+    def _space(self) -> typing.Tuple[int, int]:
+        """Returns the space available now and the space available once running jobs end."""
+        free = shutil.disk_usage(self.root).free - self.reserve_bytes
+        pending = 0
+        written = 0
+        for workspace in self._active.values():
+            used = workspace.used_bytes()
+            written += used
+            pending += max(workspace.reserved - used, 0)
+        return free - pending, free + written
+
+    def usage(self) -> dict:
+        with self._condition:
+            workspaces = len(self._active)
+            reserved = sum(x.reserved for x in self._active.values())
+            used = sum(x.used_bytes() for x in self._active.values())
+        return {
+            "workspaces": workspaces,
+            "reserved_bytes": reserved,
+            "used_bytes": used,
+            "free_bytes": (
+                shutil.disk_usage(self.root).free if os.path.isdir(self.root) else 0
+            ),
+        }
+
+    def collect_garbage(self) -> int:
+        """Removes workspaces left behind by crashed jobs, returns how many were removed."""
+        self._last_gc = time.monotonic()
+        removed = 0
+        now = time.time()
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(self.root, name)
+            with self._condition:
+                if path in self._active:
+                    continue
+            try:
+                age = now - latest_mtime(path)
+            except OSError:
+                continue
+            if age < self.max_age:
+                continue
+            print(f"Removing abandoned workspace {path}")
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            removed += 1
+        return removed
+
+
+def track_written(path, size: int) -> None:
+    """Counts ``size`` bytes written at ``path``, negative when removed, against its workspace."""
+    for manager in _MANAGERS:
+        if manager.track(str(path), size):
+            return
+
+
+def directory_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def latest_mtime(path: str) -> float:
+    """Returns the newest modification time of ``path`` and everything below it."""
+    latest = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return latest
+
+
+WORKSPACES = WorkspaceManager()
@@ -0,0 +1,13 @@
+"""The app's modules in lib/ import each other by name, main.py reads its settings on import."""
+
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib")
+)
+
+os.environ.setdefault("NEXTCLOUD_URL", "http://nextcloud.local")
+os.environ.setdefault("APP_ID", "extract_archives_nc_py_api")
+os.environ.setdefault("APP_SECRET", "secret")
+os.environ.setdefault("APP_VERSION", "1.0.0")
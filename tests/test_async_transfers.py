@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import main
+from main import AsyncUploadPool, TransferLoop
+from staging import MemoryEntry
+
+
+@pytest.fixture
+def transfers(monkeypatch):
+    """Starts a :py:class:`TransferLoop` on ``transfers.handler``, an async mock handler."""
+
+    async def handle(request):
+        return await loop.handler(request)
+
+    options = main._http_client_options
+    monkeypatch.setattr(
+        main,
+        "_http_client_options",
+        lambda: dict(options(), transport=httpx.MockTransport(handle)),
+    )
+    loop = TransferLoop(concurrency=2)
+    yield loop
+    loop.stop()
+
+
+def test_requests_in_flight_are_limited_to_the_concurrency(transfers):
+    active = []
+    peak = []
+
+    async def handler(request):
+        active.append(request)
+        peak.append(len(active))
+        await asyncio.sleep(0.02)
+        active.remove(request)
+        return httpx.Response(201)
+
+    transfers.handler = handler
+
+    async def upload(i):
+        response = await transfers.dav("PUT", f"/files/alice/{i}.txt", "alice", b"x")
+        return response.status_code
+
+    futures = [transfers.run(upload(i)) for i in range(6)]
+    assert [x.result(5) for x in futures] == [201] * 6
+    assert max(peak) == 2
+
+
+def test_request_errors_reach_the_caller(transfers):
+    async def handler(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    transfers.handler = handler
+    future = transfers.run(transfers.dav("MKCOL", "/files/alice/Docs", "alice"))
+    with pytest.raises(httpx.ConnectError):
+        future.result(5)
+
+
+def test_close_waits_for_pending_uploads(transfers, tmp_path):
+    release = asyncio.Event()
+    stored = {}
+
+    async def handler(request):
+        await release.wait()
+        path = request.url.path.rsplit("/", 1)[-1]
+        if path == "full.txt":
+            return httpx.Response(507)
+        stored[path] = request.read()
+        return httpx.Response(201)
+
+    transfers.handler = handler
+    pool = AsyncUploadPool(None, "alice", buffer_bytes=100, transfers=transfers)
+    on_disk = tmp_path / "b.txt"
+    on_disk.write_bytes(b"second")
+    pool.reserve(5)
+    pool.submit(MemoryEntry("a.txt", b"first"), "Docs/a.txt", 5)
+    pool.reserve(6)
+    pool.submit(str(on_disk), "Docs/b.txt", 6, mtime=1700000000)
+    pool.reserve(4)
+    pool.submit(MemoryEntry("full.txt", b"full"), "Docs/full.txt", 4)
+
+    closed = []
+    closing = threading.Thread(target=lambda: closed.append(pool.close()))
+    closing.start()
+    closing.join(0.2)
+    assert closing.is_alive()
+    transfers._loop.call_soon_threadsafe(release.set)
+    closing.join(5)
+    assert not closing.is_alive()
+
+    [stats] = closed
+    assert stats["files"] == 2
+    assert stats["failed"] == ["Docs/full.txt"]
+    assert stored == {"a.txt": b"first", "b.txt": b"second"}
+    assert pool.budget.used == 0
+    assert pool.progress.files_failed == 1
+    assert not on_disk.exists()
@@ -0,0 +1,157 @@
+import io
+import tarfile
+import threading
+import time
+import types
+from urllib.parse import unquote
+
+import httpx
+import pytest
+from nc_py_api import FsNode
+
+import main
+from jobs import JobQueue
+from workspace import WorkspaceManager
+
+# above EXTRACT_MEMORY_ENTRY_KB, the entries are staged on disk
+ENTRY_SIZE = 1024 * 1024 + 1
+
+
+class NextcloudApp:
+    """The parts of the Nextcloud client an extraction uses besides WebDAV."""
+
+    user = "alice"
+    capabilities = {}
+
+    def __init__(self, dav):
+        self.files = types.SimpleNamespace(mkdir=dav.folders.append)
+
+    def log(self, *args, **kwargs):
+        pass
+
+
+class Dav:
+    """Mock WebDAV server serving archives and storing uploads, a little slowly."""
+
+    def __init__(self, archives: dict, delay: float = 0.05):
+        self.archives = archives
+        self.delay = delay
+        self.uploaded = {}
+        self.folders = []
+        self.lock = threading.Lock()
+
+    def handler(self, request):
+        path = unquote(request.url.path).removeprefix("/remote.php/dav/files/alice/")
+        if request.method == "GET":
+            return httpx.Response(200, content=self.archives[path])
+        if request.method == "PUT":
+            time.sleep(self.delay)
+            with self.lock:
+                self.uploaded[path] = request.read()
+        elif request.method == "MKCOL":
+            self.folders.append(path)
+        return httpx.Response(201)
+
+
+def tar_gz(names) -> bytes:
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as tar:
+        for name in names:
+            content = name.encode().ljust(ENTRY_SIZE, b".")
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+@pytest.fixture(params=[False, True], ids=["threads", "async"])
+def batch(request, tmp_path, monkeypatch):
+    """Runs extract_batch on tar.gz archives against :py:class:`Dav`."""
+    archives = {
+        "Docs/a.tar.gz": tar_gz(["a/1.txt", "a/2.txt"]),
+        "Docs/b.tar.gz": tar_gz(["b/1.txt", "b/2.txt", "b/3.txt"]),
+    }
+    dav = Dav(archives)
+    options = main._http_client_options
+    monkeypatch.setattr(
+        main,
+        "_http_client_options",
+        lambda: dict(options(), transport=httpx.MockTransport(dav.handler)),
+    )
+    monkeypatch.setattr(main, "_HTTP_CLIENT", None)
+    monkeypatch.setattr(main, "ASYNC_TRANSFERS", request.param)
+    monkeypatch.setattr(main, "NESTED_DEPTH", 0)
+    monkeypatch.setattr(
+        main, "WORKSPACES", WorkspaceManager(str(tmp_path / "ws"), 0, wait_seconds=0)
+    )
+    monkeypatch.setattr(main, "send_notification", lambda *args: None)
+    nodes = [
+        FsNode(
+            f"files/alice/{path}",
+            size=len(data),
+            mimetype="application/gzip",
+            fileid=i,
+            file_id=str(i),
+        )
+        for i, (path, data) in enumerate(archives.items(), 1)
+    ]
+    monkeypatch.setattr(main, "batch_archives", lambda files, nc: nodes)
+    nc = NextcloudApp(dav)
+
+    def run(job_id=None):
+        result = main.extract_batch([], nc, "alice", job_id=job_id)
+        main.get_http_client().close()
+        monkeypatch.setattr(main, "_HTTP_CLIENT", None)
+        return result
+
+    run.dav = dav
+    run.workspaces = tmp_path / "ws"
+    yield run
+    # the async pool uses the module's loop, it restarts with the next test's transport
+    main.TRANSFER_LOOP.stop()
+
+
+def test_shared_pool_uploads_disk_staged_entries_of_every_archive(batch):
+    result = batch()
+    assert result["failed"] == []
+    assert result["uploads"]["failed"] == []
+    assert sorted(batch.dav.uploaded) == [
+        "Docs/a/1.txt",
+        "Docs/a/2.txt",
+        "Docs/b/1.txt",
+        "Docs/b/2.txt",
+        "Docs/b/3.txt",
+    ]
+    assert batch.dav.uploaded["Docs/b/3.txt"] == b"b/3.txt".ljust(ENTRY_SIZE, b".")
+    assert sorted(batch.dav.folders) == ["Docs/a", "Docs/b"]
+    assert list(batch.workspaces.iterdir()) == []
+
+
+def test_journals_hold_the_uploads_of_the_shared_pool(batch, tmp_path, monkeypatch):
+    queue = JobQueue(lambda job, progress: None, str(tmp_path / "jobs.sqlite"))
+    queue.start()
+    queue.stop()
+    monkeypatch.setattr(main, "JOB_QUEUE", queue)
+    batch(job_id="job")
+    assert queue.journal("job", "1:").done == {"Docs/a/1.txt", "Docs/a/2.txt"}
+    assert queue.journal("job", "2:").done == {
+        "Docs/b/1.txt",
+        "Docs/b/2.txt",
+        "Docs/b/3.txt",
+    }
+
+
+def test_resumed_batch_skips_journaled_entries(batch, tmp_path, monkeypatch):
+    queue = JobQueue(lambda job, progress: None, str(tmp_path / "jobs.sqlite"))
+    queue.start()
+    queue.stop()
+    monkeypatch.setattr(main, "JOB_QUEUE", queue)
+    assert batch(job_id="job")["uploads"]["files"] == 5
+    assert len(batch.dav.uploaded) == 5
+    batch.dav.uploaded.clear()
+    # the job was interrupted before it finished, all its entries are journaled
+    result = batch(job_id="job")
+    assert result["failed"] == []
+    assert result["uploads"]["files"] == 0
+    assert batch.dav.uploaded == {}
+    assert list(batch.workspaces.iterdir()) == []
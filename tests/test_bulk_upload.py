@@ -0,0 +1,97 @@
+import email
+import hashlib
+import threading
+import types
+
+import httpx
+import pytest
+
+import main
+from main import PendingUpload, UploadPool, bulk_request_body, bulk_upload_errors
+from staging import MemoryEntry
+
+
+def upload(filename, dav_path, mtime=None):
+    return PendingUpload(filename, dav_path, 0, mtime, None)
+
+
+def test_bulk_request_body_has_one_part_per_file(tmp_path):
+    on_disk = tmp_path / "b.bin"
+    on_disk.write_bytes(b"\x00" * 10)
+    batch = [
+        upload(MemoryEntry("a.txt", b"first"), "Docs/a.txt", 1700000000.5),
+        upload(str(on_disk), "/Docs/sub/b.bin", 1600000000),
+    ]
+    body, content_type = bulk_request_body(batch)
+    message = email.message_from_bytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    parts = message.get_payload()
+    assert [x["X-File-Path"] for x in parts] == ["/Docs/a.txt", "/Docs/sub/b.bin"]
+    assert [x["X-File-Mtime"] for x in parts] == ["1700000000", "1600000000"]
+    assert [x["Content-Length"] for x in parts] == ["5", "10"]
+    assert parts[0]["X-File-MD5"] == hashlib.md5(b"first").hexdigest()
+    assert parts[1].get_payload(decode=True) == b"\x00" * 10
+
+
+def response(status_code, json):
+    return httpx.Response(
+        status_code, json=json, request=httpx.Request("POST", "http://nc/bulk")
+    )
+
+
+def test_bulk_upload_errors_lists_files_not_stored():
+    batch = [upload("a", "Docs/a.txt"), upload("b", "Docs/b.txt"), upload("c", "c")]
+    errors = bulk_upload_errors(
+        response(
+            200,
+            {
+                "/Docs/a.txt": {"error": False, "etag": "1"},
+                "/Docs/b.txt": {"error": True, "message": "quota exceeded"},
+            },
+        ),
+        batch,
+    )
+    assert errors == {"Docs/b.txt": "quota exceeded", "c": "missing from the response"}
+
+
+def test_bulk_upload_errors_raises_for_failed_requests():
+    with pytest.raises(httpx.HTTPStatusError):
+        bulk_upload_errors(response(507, {}), [upload("a", "a")])
+
+
+def test_large_reservations_send_the_pending_bulk_batch(monkeypatch):
+    posted = []
+
+    def handler(request):
+        message = email.message_from_bytes(
+            f"Content-Type: {request.headers['Content-Type']}\r\n\r\n".encode()
+            + request.read()
+        )
+        paths = [x["X-File-Path"] for x in message.get_payload()]
+        posted.append(paths)
+        return httpx.Response(200, json={x: {"error": False} for x in paths})
+
+    options = main._http_client_options
+    monkeypatch.setattr(
+        main,
+        "_http_client_options",
+        lambda: dict(options(), transport=httpx.MockTransport(handler)),
+    )
+    monkeypatch.setattr(main, "_HTTP_CLIENT", None)
+    monkeypatch.setattr(main, "BULK_UPLOAD", True)
+    nc = types.SimpleNamespace(capabilities={"dav": {"bulkupload": "1.0"}})
+    pool = UploadPool(nc, "alice", buffer_bytes=1000)
+    for name in ("a", "b"):
+        pool.reserve(100)
+        pool.submit(MemoryEntry(name, b"x" * 100), f"Docs/{name}.txt", 100)
+    assert posted == []
+    # the batch holds 200 bytes of the budget until it is sent
+    reserved = threading.Thread(target=pool.reserve, args=(900,), daemon=True)
+    reserved.start()
+    reserved.join(5)
+    assert not reserved.is_alive()
+    pool.release(900)
+    assert pool.close()["files"] == 2
+    assert posted == [["/Docs/a.txt", "/Docs/b.txt"]]
+    main.get_http_client().close()
@@ -0,0 +1,122 @@
+import bz2
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import engines
+from engines import (
+    ESTIMATED_COMPRESSION_RATIO,
+    CompressedFileEngine,
+    TarEngine,
+    ZipEngine,
+    get_engine,
+    safe_entry_path,
+)
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("docs/a.txt", os.path.join("dest", "docs", "a.txt")),
+        ("./docs//a.txt", os.path.join("dest", "docs", "a.txt")),
+        ("docs\\a.txt", os.path.join("dest", "docs", "a.txt")),
+        ("/etc/passwd", os.path.join("dest", "etc", "passwd")),
+    ],
+)
+def test_safe_entry_path_stays_in_destination(name, expected):
+    assert safe_entry_path("dest", name) == expected
+
+
+@pytest.mark.parametrize("name", ["../a.txt", "docs/../../a.txt", "C:/a.txt", "", "./"])
+def test_safe_entry_path_rejects_escaping_names(name):
+    assert safe_entry_path("dest", name) is None
+
+
+def make_zip(path):
+    with zipfile.ZipFile(path, "w") as zip_ref:
+        zip_ref.writestr("docs/", "")
+        zip_ref.writestr("docs/a.txt", "first")
+        zip_ref.writestr("docs/b.txt", "second")
+    return str(path)
+
+
+def make_tar(path):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in (("docs/a.txt", b"first"), ("docs/b.txt", b"second")):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+def test_get_engine_detects_the_format(tmp_path):
+    gz = tmp_path / "notes.txt.gz"
+    gz.write_bytes(gzip.compress(b"notes"))
+    plain = tmp_path / "plain.txt"
+    plain.write_bytes(b"plain")
+    assert isinstance(get_engine(make_zip(tmp_path / "a.zip")), ZipEngine)
+    assert isinstance(get_engine(make_tar(tmp_path / "a.tar.gz")), TarEngine)
+    assert isinstance(get_engine(gz), CompressedFileEngine)
+    assert get_engine(plain) is None
+
+
+@pytest.mark.parametrize("make", [make_zip, make_tar])
+def test_engine_lists_and_reads_entries(tmp_path, make):
+    engine = get_engine(make(tmp_path / "archive"))
+    files = [x for x in engine.entries() if not x.is_dir]
+    assert [(x.name, x.size) for x in files] == [("docs/a.txt", 5), ("docs/b.txt", 6)]
+    assert [(entry.name, reader.read()) for entry, reader in engine.iter_files()] == [
+        ("docs/a.txt", b"first"),
+        ("docs/b.txt", b"second"),
+    ]
+
+
+@pytest.mark.parametrize("make", [make_zip, make_tar])
+def test_engine_reads_only_requested_names(tmp_path, make):
+    engine = get_engine(make(tmp_path / "archive"))
+    names = [entry.name for entry, _ in engine.iter_files({"docs/b.txt"})]
+    assert names == ["docs/b.txt"]
+
+
+def test_compressed_file_engine_strips_the_extension(tmp_path):
+    path = tmp_path / "notes.txt.gz"
+    path.write_bytes(gzip.compress(b"some notes"))
+    engine = CompressedFileEngine(path)
+    (entry,) = engine.entries()
+    assert (entry.name, entry.size) == ("notes.txt", 10)
+    assert [reader.read() for _, reader in engine.iter_files()] == [b"some notes"]
+
+
+def test_compressed_files_without_their_size_are_estimated(tmp_path):
+    data = b"some notes " * 100
+    path = tmp_path / "notes.txt.bz2"
+    path.write_bytes(bz2.compress(data))
+    (entry,) = CompressedFileEngine(path).entries()
+    assert entry.size == entry.compressed_size * ESTIMATED_COMPRESSION_RATIO > 0
+
+
+def test_large_gzip_files_are_not_sized_by_the_wrapped_trailer(tmp_path, monkeypatch):
+    path = tmp_path / "notes.txt.gz"
+    path.write_bytes(gzip.compress(b"some notes"))
+    monkeypatch.setattr(engines, "GZIP_ISIZE_MODULO", 16)
+    (entry,) = CompressedFileEngine(path).entries()
+    assert entry.size == entry.compressed_size * ESTIMATED_COMPRESSION_RATIO
+
+
+def test_zstd_files_use_the_frame_size_when_it_is_there(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    data = b"some notes " * 100
+    path = tmp_path / "notes.txt.zst"
+    path.write_bytes(zstandard.ZstdCompressor().compress(data))
+    (entry,) = get_engine(path).entries()
+    assert (entry.name, entry.size) == ("notes.txt", len(data))
+    streamed = io.BytesIO()
+    with zstandard.ZstdCompressor().stream_writer(streamed, closefd=False) as writer:
+        writer.write(data)
+    path.write_bytes(streamed.getvalue())
+    (entry,) = get_engine(path).entries()
+    assert entry.size == entry.compressed_size * ESTIMATED_COMPRESSION_RATIO
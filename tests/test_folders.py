@@ -0,0 +1,23 @@
+from main import plan_folders
+
+
+def test_plan_folders_groups_parents_by_depth():
+    plan = plan_folders(["Docs/a/b/one.txt", "Docs/a/two.txt", "Docs/c/three.txt"])
+    assert plan == [["Docs"], ["Docs/a", "Docs/c"], ["Docs/a/b"]]
+
+
+def test_plan_folders_adds_empty_folders():
+    plan = plan_folders(["Docs/one.txt"], dav_folders=["Docs/empty/inner"])
+    assert plan == [["Docs"], ["Docs/empty"], ["Docs/empty/inner"]]
+
+
+def test_plan_folders_skips_known_folders_and_their_parents():
+    plan = plan_folders(
+        ["/Docs/archive/a/one.txt", "/Docs/archive/two.txt"],
+        known_folders=["/Docs/archive"],
+    )
+    assert plan == [["Docs/archive/a"]]
+
+
+def test_plan_folders_without_folders():
+    assert plan_folders(["one.txt", "/two.txt"]) == []
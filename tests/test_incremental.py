@@ -0,0 +1,85 @@
+import hashlib
+
+import httpx
+
+import main
+from layout import ArchiveLayout
+from main import checksum_matches, fetch_remote_tree, is_unchanged
+from staging import MemoryEntry
+
+
+def test_is_unchanged_compares_size_and_mtime():
+    remote = {"size": 5, "mtime": 1000.0, "checksums": {}}
+    assert is_unchanged(5, 1001.5, remote)
+    assert not is_unchanged(6, 1000.0, remote)
+    assert not is_unchanged(5, 1003.0, remote)
+    assert not is_unchanged(5, 0, remote)
+    assert not is_unchanged(5, 1000.0, None)
+
+
+def test_checksum_matches_uses_the_server_checksum(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"content")
+    sha1 = hashlib.sha1(b"content").hexdigest()
+    md5 = hashlib.md5(b"content").hexdigest()
+    assert checksum_matches(str(path), {"size": 7, "checksums": {"SHA1": sha1}})
+    assert checksum_matches(
+        MemoryEntry("a.txt", b"content"), {"size": 7, "checksums": {"MD5": md5}}
+    )
+    assert not checksum_matches(str(path), {"size": 7, "checksums": {"MD5": sha1}})
+    assert not checksum_matches(str(path), {"size": 7, "checksums": {}})
+    assert not checksum_matches(str(path), {"size": 8, "checksums": {"SHA1": sha1}})
+
+
+def response(status_code, text=""):
+    return httpx.Response(
+        status_code, text=text, request=httpx.Request("PROPFIND", "http://nc/dav")
+    )
+
+
+MULTISTATUS = """<?xml version="1.0"?>
+<d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">
+  <d:response>
+    <d:href>/remote.php/dav/files/alice/Docs/photos/</d:href>
+    <d:propstat><d:prop><d:resourcetype><d:collection/></d:resourcetype></d:prop></d:propstat>
+  </d:response>
+  <d:response>
+    <d:href>/remote.php/dav/files/alice/Docs/photos/a%20b.jpg</d:href>
+    <d:propstat><d:prop>
+      <d:getcontentlength>12</d:getcontentlength>
+      <d:getlastmodified>Tue, 14 Nov 2023 22:13:20 GMT</d:getlastmodified>
+      <d:resourcetype/>
+      <oc:checksums><oc:checksum>SHA1:ABCDEF MD5:0123</oc:checksum></oc:checksums>
+    </d:prop></d:propstat>
+  </d:response>
+</d:multistatus>"""
+
+
+def test_fetch_remote_tree_lists_the_archive_folders(monkeypatch):
+    calls = []
+
+    def dav_call(method, path, nc, data=None, user="", headers=None):
+        calls.append((method, path, headers["Depth"]))
+        return response(207, MULTISTATUS)
+
+    monkeypatch.setattr(main, "dav_call", dav_call)
+    tree = fetch_remote_tree(
+        "/Docs", ArchiveLayout(0, ["photos"], 1, 12, 2), None, "alice"
+    )
+    assert calls == [("PROPFIND", "/files/alice/Docs/photos", "infinity")]
+    assert tree.folders == {"Docs/photos"}
+    assert tree.files == {
+        "Docs/photos/a b.jpg": {
+            "size": 12,
+            "mtime": 1700000000.0,
+            "checksums": {"SHA1": "abcdef", "MD5": "0123"},
+        }
+    }
+
+
+def test_fetch_remote_tree_gives_up_on_errors(monkeypatch):
+    monkeypatch.setattr(main, "dav_call", lambda *args, **kwargs: response(500))
+    monkeypatch.setattr(main, "app_log", lambda *args, **kwargs: None)
+    assert (
+        fetch_remote_tree("Docs", ArchiveLayout(1, [], 0, 1, 1), None, "alice") is None
+    )
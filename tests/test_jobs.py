@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, JobQueueFull
+
+
+def wait_for(queue, job_id, state, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["state"] == state:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {queue.get(job_id)['state']}, not {state}")
+
+
+@pytest.fixture
+def release():
+    """Event blocking handlers until the test ends."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_jobs_run_and_finish(tmp_path):
+    def handler(job, progress):
+        if job["payload"]["fail"]:
+            raise ValueError("broken archive")
+        progress.set_phase("upload", files_total=1)
+        progress.add(files_done=1)
+
+    queue = JobQueue(handler, str(tmp_path / "jobs.sqlite"), workers=2)
+    queue.start()
+    try:
+        done = wait_for(queue, queue.enqueue("alice", "extract", {"fail": False}), DONE)
+        failed = wait_for(
+            queue, queue.enqueue("alice", "extract", {"fail": True}), FAILED
+        )
+    finally:
+        queue.stop()
+    assert done["progress"]["files_done"] == 1
+    assert done["attempts"] == 1
+    assert failed["error"] == "broken archive"
+    assert [x["id"] for x in queue.list("alice")] == [failed["id"], done["id"]]
+
+
+def test_admission_limits(tmp_path, release):
+    queue = JobQueue(
+        lambda job, progress: release.wait(),
+        str(tmp_path / "jobs.sqlite"),
+        workers=1,
+        queue_limit=1,
+        user_limit=2,
+    )
+    queue.start()
+    try:
+        wait_for(queue, queue.enqueue("alice", "extract", {}), RUNNING)
+        queue.enqueue("alice", "extract", {})
+        with pytest.raises(JobQueueFull):
+            queue.enqueue("bob", "extract", {})
+        assert queue.counts() == {QUEUED: 1, RUNNING: 1}
+        queue.queue_limit = 10
+        with pytest.raises(JobQueueFull):
+            queue.enqueue("alice", "extract", {})
+        queue.enqueue("bob", "extract", {})
+    finally:
+        queue.stop(timeout=0)
+
+
+def test_interrupted_jobs_run_again_until_the_attempt_limit(tmp_path, release):
+    db_path = str(tmp_path / "jobs.sqlite")
+    job_id = None
+    for attempt in range(1, 4):
+        # the previous queue's worker never finishes, as if the app had crashed
+        queue = JobQueue(lambda job, progress: release.wait(), db_path, max_attempts=3)
+        queue.start()
+        if job_id is None:
+            job_id = queue.enqueue("alice", "extract", {})
+        assert wait_for(queue, job_id, RUNNING)["attempts"] == attempt
+        queue.stop(timeout=0)
+    queue = JobQueue(lambda job, progress: release.wait(), db_path, max_attempts=3)
+    queue.start()
+    queue.stop(timeout=0)
+    job = queue.get(job_id)
+    assert (job["state"], job["attempts"]) == (FAILED, 3)
+    assert job["error"] == "Stopped after 3 attempts"
+
+
+def test_jobs_failing_during_the_shutdown_are_resumed(tmp_path):
+    started = threading.Event()
+    shutdown = threading.Event()
+
+    def handler(job, progress):
+        started.set()
+        shutdown.wait(5)
+        if job["payload"]["fail"]:
+            raise OSError("process pool was shut down")
+
+    db_path = str(tmp_path / "jobs.sqlite")
+    queue = JobQueue(handler, db_path, workers=1)
+    queue.start()
+    job_id = queue.enqueue("alice", "extract", {"fail": True})
+    journal = queue.journal(job_id, "12:etag")
+    journal.ack("Docs/a.txt")
+    journal.flush()
+    started.wait(5)
+    threading.Timer(0.1, shutdown.set).start()
+    queue.stop()
+    job = queue.get(job_id)
+    assert (job["state"], job["attempts"]) == (RUNNING, 0)
+    assert queue.journal(job_id, "12:etag").done == {"Docs/a.txt"}
+
+    queue = JobQueue(handler, db_path, workers=1)
+    queue.start()
+    try:
+        assert wait_for(queue, job_id, FAILED)["attempts"] == 1
+    finally:
+        queue.stop()
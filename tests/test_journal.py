@@ -0,0 +1,81 @@
+import zipfile
+
+from engines import ZipEngine
+from jobs import JobProgress, JobQueue
+from main import extract_archive_to_pool
+from staging import discard_staged
+
+
+def new_queue(tmp_path) -> JobQueue:
+    queue = JobQueue(lambda job, progress: None, str(tmp_path / "jobs.sqlite"))
+    queue.start()
+    queue.stop()
+    return queue
+
+
+def test_journal_survives_a_restart_per_archive(tmp_path):
+    journal = new_queue(tmp_path).journal("job", "12:etag")
+    journal.ack("Docs/a.txt")
+    journal.ack("Docs/b.txt")
+    assert new_queue(tmp_path).journal("job", "12:etag").done == set()
+    journal.flush()
+    queue = new_queue(tmp_path)
+    assert queue.journal("job", "12:etag").done == {"Docs/a.txt", "Docs/b.txt"}
+    assert queue.journal("job", "12:other").done == set()
+    queue.journal("job", "12:etag").discard()
+    assert new_queue(tmp_path).journal("job", "12:etag").done == set()
+
+
+class Pool:
+    """Upload pool acknowledging every submitted file at once."""
+
+    def __init__(self):
+        self.progress = JobProgress()
+        self.uploaded = []
+
+    def create_folders(self, plan):
+        pass
+
+    def reserve(self, size):
+        pass
+
+    def release(self, size):
+        pass
+
+    def skip(self, dav_path, size, journal=None):
+        raise AssertionError(f"{dav_path} is not on the server")
+
+    def submit(self, filename, dav_path, reserved=0, mtime=None, journal=None):
+        discard_staged(filename)
+        self.uploaded.append(dav_path)
+        journal.ack(dav_path)
+
+
+def test_resumed_extraction_skips_journaled_entries(tmp_path):
+    archive = tmp_path / "a.zip"
+    with zipfile.ZipFile(archive, "w") as zip_ref:
+        for name in ("a.txt", "b.txt", "c.txt"):
+            zip_ref.writestr(f"docs/{name}", name)
+
+    def extract(journal) -> Pool:
+        pool = Pool()
+        extract_archive_to_pool(
+            ZipEngine(str(archive)),
+            str(tmp_path / "extracted"),
+            "Docs",
+            "alice",
+            pool,
+            journal=journal,
+        )
+        return pool
+
+    first = extract(new_queue(tmp_path).journal("job", "12:etag"))
+    assert len(first.uploaded) == 3
+    # only the first upload made it to the database before the crash
+    journal = new_queue(tmp_path).journal("job", "12:etag")
+    journal.ack(first.uploaded[0])
+    journal.flush()
+
+    resumed = extract(new_queue(tmp_path).journal("job", "12:etag"))
+    assert resumed.uploaded == first.uploaded[1:]
+    assert resumed.progress.snapshot()["files_done"] == 1
@@ -0,0 +1,61 @@
+from engines import ArchiveEntry
+from layout import ArchiveLayout, ListingCache, analyze_directory, analyze_entries
+
+
+def entry(name, size=0, is_dir=False):
+    return ArchiveEntry(name, size, size, is_dir, 0.0)
+
+
+def test_analyze_entries():
+    layout = analyze_entries(
+        [
+            entry("readme.txt", 3),
+            entry("docs/", is_dir=True),
+            entry("docs/a.txt", 5),
+            entry("./photos\\b.jpg", 7),
+            entry("./"),
+        ]
+    )
+    assert layout == ArchiveLayout(
+        root_files=1,
+        root_folders=["docs", "photos"],
+        files_in_folders=3,
+        total_size=15,
+        entry_count=5,
+    )
+
+
+def test_analyze_directory_matches_the_extracted_tree(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "a.txt").write_bytes(b"12345")
+    (tmp_path / "readme.txt").write_bytes(b"123")
+    layout = analyze_directory(tmp_path)
+    assert layout == ArchiveLayout(1, ["docs"], 1, 8, 3)
+
+
+def test_listing_cache_keys_by_file_id_and_etag():
+    cache = ListingCache(max_entries=10)
+    entries = [entry("a.txt", 1)]
+    assert cache.put(1, "etag1", entries) == (entries, analyze_entries(entries))
+    assert cache.get(1, "etag1") == (entries, analyze_entries(entries))
+    assert cache.get(1, "etag2") is None
+    cache.discard(1, "etag1")
+    assert cache.get(1, "etag1") is None
+
+
+def test_listing_cache_evicts_least_recently_used():
+    cache = ListingCache(max_entries=4)
+    cache.put(1, "e", [entry("a"), entry("b")])
+    cache.put(2, "e", [entry("c"), entry("d")])
+    cache.get(1, "e")
+    cache.put(3, "e", [entry("f")])
+    assert cache.get(1, "e") is not None
+    assert cache.get(2, "e") is None
+    assert cache.get(3, "e") is not None
+
+
+def test_listing_cache_skips_listings_larger_than_the_cache():
+    cache = ListingCache(max_entries=1)
+    entries, layout = cache.put(1, "e", [entry("a"), entry("b")])
+    assert layout.entry_count == 2
+    assert cache.get(1, "e") is None
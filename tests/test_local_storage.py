@@ -0,0 +1,58 @@
+import mmap
+import zipfile
+
+import pytest
+from nc_py_api import FsNode
+
+import main
+from main import local_archive_path, open_local_engine
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    (tmp_path / "alice" / "files" / "Docs").mkdir(parents=True)
+    return tmp_path
+
+
+def test_archives_of_the_right_size_are_read_in_place(data_dir):
+    path = data_dir / "alice" / "files" / "Docs" / "a.zip"
+    path.write_bytes(b"12345")
+    assert local_archive_path(FsNode("files/alice/Docs/a.zip", size=5), "alice") == str(
+        path
+    )
+    assert local_archive_path(FsNode("files/alice/Docs/a.zip", size=6), "alice") is None
+    assert local_archive_path(FsNode("files/alice/Docs/b.zip", size=5), "alice") is None
+    assert local_archive_path(FsNode("files/alice/../a.zip", size=5), "alice") is None
+
+
+def test_zip_archives_are_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DECOMPRESS_WORKERS", 1)
+    path = tmp_path / "a.zip"
+    with zipfile.ZipFile(path, "w") as zip_ref:
+        zip_ref.writestr("a.txt", "a")
+    engine = open_local_engine(str(path))
+    try:
+        assert isinstance(engine.path, mmap.mmap)
+        assert [x.name for x in engine.entries()] == ["a.txt"]
+    finally:
+        engine.path.close()
+
+
+def test_archives_emptied_after_detection_are_not_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DECOMPRESS_WORKERS", 1)
+    path = tmp_path / "a.zip"
+    with zipfile.ZipFile(path, "w") as zip_ref:
+        zip_ref.writestr("a.txt", "a")
+    get_engine = main.get_engine
+
+    def truncating_get_engine(archive):
+        engine = get_engine(archive)
+        path.write_bytes(b"")
+        return engine
+
+    monkeypatch.setattr(main, "get_engine", truncating_get_engine)
+    engine = open_local_engine(str(path))
+    assert engine.path == str(path)
+    with pytest.raises(zipfile.BadZipFile):
+        engine.entries()
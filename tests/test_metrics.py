@@ -0,0 +1,58 @@
+import pytest
+
+from metrics import Registry
+
+
+def test_counter_renders_labelled_samples():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("method", "status"))
+    requests.inc(method="GET", status=200)
+    requests.inc(2, method="PUT", status=201)
+    requests.inc(method="GET", status=200)
+    assert requests.value(method="GET", status=200) == 2
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{method="GET",status="200"} 2\n'
+        'requests_total{method="PUT",status="201"} 2\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    seconds = registry.histogram("seconds", "Durations.", buckets=(1, 5))
+    for value in (0.5, 1, 3, 7.5):
+        seconds.observe(value)
+    assert seconds.count() == 4
+    assert registry.render().splitlines()[2:] == [
+        'seconds_bucket{le="1"} 2',
+        'seconds_bucket{le="5"} 3',
+        'seconds_bucket{le="+Inf"} 4',
+        "seconds_sum 12.0",
+        "seconds_count 4",
+    ]
+
+
+def test_gauge_reads_its_callback_and_escapes_labels():
+    registry = Registry()
+    registry.gauge("plain", "A number.", lambda: 3)
+    registry.gauge("bytes", "By kind.", lambda: {'a"b': 1.5, "c\\d": 2}, ("kind",))
+    lines = registry.render().splitlines()
+    assert "plain 3" in lines
+    assert 'bytes{kind="a\\"b"} 1.5' in lines
+    assert 'bytes{kind="c\\\\d"} 2' in lines
+
+
+def test_failing_gauges_render_no_samples():
+    registry = Registry()
+    registry.gauge("broken", "Fails.", lambda: 1 / 0)
+    assert registry.render() == "# HELP broken Fails.\n# TYPE broken gauge\n"
+
+
+def test_labels_and_names_are_checked():
+    registry = Registry()
+    counter = registry.counter("total", "Total.", ("kind",))
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+    with pytest.raises(ValueError):
+        registry.counter("total", "Again.")
@@ -0,0 +1,95 @@
+import io
+import os
+import threading
+import zipfile
+
+from engines import ZipEngine
+from jobs import JobProgress
+from main import NestedArchives, extract_archive_to_pool
+from staging import discard_staged, read_staged, staged_size
+
+
+class Pool:
+    """Upload pool recording the submitted files with their content."""
+
+    nc = None
+
+    def __init__(self):
+        self.progress = JobProgress()
+        self.uploaded = {}
+        self._lock = threading.Lock()
+
+    def create_folders(self, plan):
+        pass
+
+    def reserve(self, size):
+        pass
+
+    def release(self, size):
+        pass
+
+    def submit(self, filename, dav_path, reserved=0, mtime=None, journal=None):
+        data = read_staged(filename, 0, staged_size(filename))
+        discard_staged(filename)
+        with self._lock:
+            self.uploaded[dav_path] = data
+
+
+def zip_bytes(files: dict) -> bytes:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as zip_ref:
+        for name, content in files.items():
+            zip_ref.writestr(name, content)
+    return data.getvalue()
+
+
+def expand(tmp_path, max_depth: int) -> Pool:
+    deepest = zip_bytes({"c.txt": "third"})
+    inner = zip_bytes({"b.txt": "second", "deep.zip": deepest})
+    archive = tmp_path / "outer.zip"
+    archive.write_bytes(
+        zip_bytes({"a.txt": "first", "inner.zip": inner, "bad.zip": "not a zip"})
+    )
+    pool = Pool()
+    nested = NestedArchives(pool, "alice", max_depth=max_depth)
+    extract_archive_to_pool(
+        ZipEngine(str(archive)),
+        str(tmp_path / "extracted"),
+        "Docs",
+        "alice",
+        pool,
+        nested=nested,
+    )
+    nested.close()
+    return pool
+
+
+def staged_files(path) -> list:
+    return [name for _, _, files in os.walk(path) for name in files]
+
+
+def test_nested_archives_are_expanded_up_to_the_depth_limit(tmp_path):
+    pool = expand(tmp_path, max_depth=1)
+    assert sorted(pool.uploaded) == [
+        "Docs/a.txt",
+        "Docs/bad.zip",
+        "Docs/inner/b.txt",
+        "Docs/inner/deep.zip",
+    ]
+    assert pool.uploaded["Docs/bad.zip"] == b"not a zip"
+    assert zipfile.ZipFile(
+        io.BytesIO(pool.uploaded["Docs/inner/deep.zip"])
+    ).namelist() == ["c.txt"]
+    assert staged_files(tmp_path / "extracted") == []
+
+
+def test_deeper_archives_are_expanded_and_their_staged_files_removed(tmp_path):
+    pool = expand(tmp_path, max_depth=2)
+    assert sorted(pool.uploaded) == [
+        "Docs/a.txt",
+        "Docs/bad.zip",
+        "Docs/inner/b.txt",
+        "Docs/inner/deep/c.txt",
+    ]
+    assert pool.uploaded["Docs/inner/deep/c.txt"] == b"third"
+    assert staged_files(tmp_path / "extracted") == []
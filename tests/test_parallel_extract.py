@@ -0,0 +1,58 @@
+import os
+import threading
+import zipfile
+
+from engines import ArchiveEntry
+from parallel_extract import extract_parallel, plan_batches, shutdown_process_pool
+
+
+def entry(name, size):
+    return ArchiveEntry(name, size, size, False, 0.0)
+
+
+def test_plan_batches_by_bytes_and_files():
+    items = [(entry(str(i), 40), str(i)) for i in range(5)]
+    assert [len(x) for x in plan_batches(items, batch_bytes=100)] == [2, 2, 1]
+    assert [len(x) for x in plan_batches(items, batch_files=3)] == [3, 2]
+
+
+def test_plan_batches_keeps_big_members_alone():
+    items = [(entry("a", 10), "a"), (entry("big", 500), "big"), (entry("b", 10), "b")]
+    assert [[x[1] for x in batch] for batch in plan_batches(items, 100)] == [
+        ["a"],
+        ["big"],
+        ["b"],
+    ]
+
+
+def test_extract_parallel_reports_in_the_calling_thread(tmp_path):
+    archive = tmp_path / "a.zip"
+    with zipfile.ZipFile(archive, "w") as zip_ref:
+        for i in range(20):
+            zip_ref.writestr(f"docs/{i}.txt", f"file {i}")
+    items = [
+        (entry(f"docs/{i}.txt", 6), str(tmp_path / "out" / f"{i}.txt"))
+        for i in range(20)
+    ]
+    items.append((entry("missing.txt", 1), str(tmp_path / "out" / "missing.txt")))
+    reserved = []
+    done = []
+    try:
+        extract_parallel(
+            str(archive),
+            items,
+            reserved.append,
+            lambda *args: done.append(args + (threading.current_thread(),)),
+            65536,
+            workers=2,
+        )
+    finally:
+        shutdown_process_pool()
+    assert sum(reserved) == 121
+    assert {x[3] for x in done} == {threading.current_thread()}
+    errors = {x[0].name: x[2] for x in done}
+    assert len(errors) == 21
+    assert errors["missing.txt"] is not None
+    assert all(errors[f"docs/{i}.txt"] is None for i in range(20))
+    with open(os.path.join(tmp_path, "out", "7.txt")) as f:
+        assert f.read() == "file 7"
@@ -0,0 +1,121 @@
+import types
+
+import httpx
+import pytest
+from nc_py_api import FsNode
+
+import main
+from jobs import JobProgress
+from main import ArchiveChanged, RangedDownload, ranged_download
+
+DATA = bytes(range(256)) * 40
+
+
+def serve(etag='"v1"', ranges=True):
+    """Mock transport answering Range requests for DATA, recording them."""
+    requested = []
+
+    def handler(request):
+        start, end = map(int, request.headers["Range"][6:].split("-"))
+        requested.append((start, end))
+        if not ranges:
+            return httpx.Response(200, content=DATA, headers={"ETag": etag})
+        return httpx.Response(
+            206, content=DATA[start : end + 1], headers={"ETag": etag}
+        )
+
+    return httpx.MockTransport(handler), requested
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    def use(mock):
+        options = main._http_client_options
+        monkeypatch.setattr(
+            main, "_http_client_options", lambda: dict(options(), transport=mock)
+        )
+
+    monkeypatch.setattr(main, "_HTTP_CLIENT", None)
+    monkeypatch.setattr(main, "DOWNLOAD_CONNECTIONS", 3)
+    monkeypatch.setattr(main, "DOWNLOAD_RANGED_THRESHOLD", 0)
+    return use
+
+
+def test_ranges_are_written_in_place(tmp_path, transport):
+    mock, requested = serve()
+    transport(mock)
+    download = RangedDownload(
+        "/files/alice/a.zip", "alice", len(DATA), JobProgress(), 3, 4096
+    )
+    with open(tmp_path / "a.zip", "wb+") as fp:
+        assert download.run(fp) == '"v1"'
+    assert (tmp_path / "a.zip").read_bytes() == DATA
+    assert sorted(requested) == [(0, 4095), (4096, 8191), (8192, 10239)]
+
+
+def archive(etag):
+    return FsNode("files/alice/a.zip", etag=etag, size=len(DATA))
+
+
+def test_another_etag_stops_the_extraction(tmp_path, transport):
+    transport(serve('"v2"')[0])
+    nc = types.SimpleNamespace(user="alice")
+    with open(tmp_path / "a.zip", "wb+") as fp, pytest.raises(ArchiveChanged):
+        ranged_download(archive("v1"), fp, nc, JobProgress())
+
+
+def test_servers_without_ranges_fall_back_to_one_stream(tmp_path, transport):
+    transport(serve(ranges=False)[0])
+    nc = types.SimpleNamespace(user="alice")
+    progress = JobProgress()
+    with open(tmp_path / "a.zip", "wb+") as fp:
+        assert not ranged_download(archive("v1"), fp, nc, progress)
+        assert fp.tell() == 0
+    assert (tmp_path / "a.zip").read_bytes() == b""
+    assert progress.bytes_done == 0
+
+
+def test_ranges_of_different_versions_stop_the_extraction(tmp_path, transport):
+    def handler(request):
+        start, end = map(int, request.headers["Range"][6:].split("-"))
+        etag = '"v1"' if start == 0 else '"v2"'
+        return httpx.Response(
+            206, content=DATA[start : end + 1], headers={"ETag": etag}
+        )
+
+    transport(httpx.MockTransport(handler))
+    download = RangedDownload(
+        "/files/alice/a.zip", "alice", len(DATA), JobProgress(), 3, 4096
+    )
+    with open(tmp_path / "a.zip", "wb+") as fp, pytest.raises(ArchiveChanged):
+        download.run(fp)
+
+
+def serve_stream(etag):
+    def handler(request):
+        assert "Range" not in request.headers
+        return httpx.Response(200, content=DATA, headers={"ETag": etag})
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.parametrize("async_transfers", [False, True])
+def test_small_downloads_check_the_etag(
+    tmp_path, transport, monkeypatch, async_transfers
+):
+    monkeypatch.setattr(main, "DOWNLOAD_RANGED_THRESHOLD", len(DATA) + 1)
+    monkeypatch.setattr(main, "ASYNC_TRANSFERS", async_transfers)
+    monkeypatch.setattr(main, "TRANSFER_LOOP", main.TransferLoop())
+    nc = types.SimpleNamespace(user="alice")
+    transport(serve_stream('"v1"'))
+    try:
+        main.download_file(archive("v1"), tmp_path / "a.zip", nc, JobProgress())
+        assert (tmp_path / "a.zip").read_bytes() == DATA
+        main.TRANSFER_LOOP.stop()
+        monkeypatch.setattr(main, "_HTTP_CLIENT", None)
+        transport(serve_stream('"v2"'))
+        with pytest.raises(ArchiveChanged):
+            main.download_file(archive("v1"), tmp_path / "b.zip", nc, JobProgress())
+        assert (tmp_path / "b.zip").read_bytes() == b""
+    finally:
+        main.TRANSFER_LOOP.stop()
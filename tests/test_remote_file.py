@@ -0,0 +1,77 @@
+import io
+import zipfile
+
+import pytest
+from nc_py_api import FsNode
+
+from main import ArchiveChanged, check_etag
+from remote_file import RemoteFile
+
+
+class Server:
+    """Answers ``fetch(start, end)`` from bytes in memory and records the ranges."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges = []
+
+    def fetch(self, start: int, end: int) -> bytes:
+        self.ranges.append((start, end))
+        return self.data[start : end + 1]
+
+
+def test_reads_cover_whole_blocks_and_hit_the_cache():
+    server = Server(bytes(range(256)) * 4)
+    remote = RemoteFile(server.fetch, 1024, block_size=100, cache_blocks=4)
+    assert remote.read(10) == server.data[:10]
+    assert remote.read(150) == server.data[10:160]
+    assert server.ranges == [(0, 99), (100, 199)]
+    remote.seek(-24, io.SEEK_END)
+    assert remote.read() == server.data[1000:]
+    assert server.ranges[-1] == (1000, 1023)
+    remote.seek(50)
+    assert remote.read(100) == server.data[50:150]
+    assert remote.requests == 3
+    assert remote.bytes_fetched == 224
+
+
+def test_missing_blocks_are_fetched_in_one_request():
+    server = Server(b"x" * 1000)
+    remote = RemoteFile(server.fetch, 1000, block_size=100, cache_blocks=2)
+    remote.read(1000)
+    assert server.ranges == [(0, 999)]
+
+
+def test_least_recently_used_blocks_are_evicted():
+    server = Server(b"x" * 1000)
+    remote = RemoteFile(server.fetch, 1000, block_size=100, cache_blocks=2)
+    for start in (0, 100, 200, 0):
+        remote.seek(start)
+        remote.read(1)
+    assert server.ranges == [(0, 99), (100, 199), (200, 299), (0, 99)]
+
+
+def test_short_responses_are_an_error():
+    remote = RemoteFile(lambda start, end: b"short", 1000, block_size=100)
+    with pytest.raises(OSError):
+        remote.read(10)
+
+
+def test_zipfile_reads_only_the_directory_and_the_member():
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_STORED) as zip_ref:
+        zip_ref.writestr("big.bin", b"b" * 200000)
+        zip_ref.writestr("small.txt", b"small")
+    server = Server(data.getvalue())
+    remote = RemoteFile(server.fetch, len(server.data), block_size=4096)
+    with zipfile.ZipFile(remote) as zip_ref:
+        assert zip_ref.read("small.txt") == b"small"
+    assert remote.bytes_fetched < 4 * 4096
+
+
+def test_check_etag_raises_for_another_version():
+    node = FsNode("files/user/a.zip", etag="abc")
+    check_etag(node, '"abc"')
+    check_etag(node, "")
+    with pytest.raises(ArchiveChanged):
+        check_etag(node, '"def"')
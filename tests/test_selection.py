@@ -0,0 +1,43 @@
+import pytest
+
+from engines import ArchiveEntry, glob_match, is_selected, select_entries
+
+
+@pytest.mark.parametrize(
+    "name, pattern, expected",
+    [
+        ("docs/a.txt", "docs/*", True),
+        ("docs/sub/a.txt", "docs/*", False),
+        ("docs/sub/a.txt", "docs/**", True),
+        ("a.jpg", "**/*.jpg", True),
+        ("photos/2020/a.jpg", "**/*.jpg", True),
+        ("photos/2020/a.png", "**/*.jpg", False),
+        ("photos/a.jpg", "*.jpg", False),
+        ("./docs\\a.txt", "docs/?.txt", True),
+        ("docs/b.txt", "docs/[ab].txt", True),
+        ("docs/c.txt", "docs/[ab].txt", False),
+        ("docs/A.txt", "docs/a.txt", False),
+    ],
+)
+def test_glob_match_is_segment_aware(name, pattern, expected):
+    assert glob_match(name, pattern) is expected
+
+
+def test_is_selected_by_name_takes_everything_below_a_folder():
+    assert is_selected("docs/sub/a.txt", names=["docs"])
+    assert is_selected("docs", names=["docs/"])
+    assert not is_selected("docs2/a.txt", names=["docs"])
+
+
+def test_is_selected_needs_a_name_or_a_pattern():
+    assert not is_selected("docs/a.txt")
+    assert is_selected("docs/a.txt", patterns=["*.md", "docs/*"])
+
+
+def test_select_entries_keeps_the_archive_order():
+    entries = [
+        ArchiveEntry(name, 1, 1, False, 0.0)
+        for name in ("b/1.jpg", "a/2.txt", "a/3.jpg")
+    ]
+    selected = select_entries(entries, patterns=["**/*.jpg"])
+    assert [x.name for x in selected] == ["b/1.jpg", "a/3.jpg"]
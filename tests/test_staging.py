@@ -0,0 +1,46 @@
+import io
+
+from staging import (
+    MemoryBudget,
+    MemoryEntry,
+    discard_staged,
+    open_staged,
+    read_staged,
+    stage_entry,
+    staged_size,
+)
+
+
+def test_small_entries_stay_in_memory(tmp_path):
+    budget = MemoryBudget(100)
+    filename = str(tmp_path / "docs" / "a.txt")
+    staged = stage_entry(io.BytesIO(b"small"), filename, 4, 10, budget)
+    assert isinstance(staged, MemoryEntry)
+    assert (staged_size(staged), budget.used) == (5, 5)
+    assert open_staged(staged).read() == b"small"
+    assert read_staged(staged, 1, 3) == b"mal"
+    discard_staged(staged)
+    assert budget.used == 0
+    assert not (tmp_path / "docs").exists()
+
+
+def test_large_entries_and_a_full_budget_use_the_disk(tmp_path):
+    budget = MemoryBudget(8)
+    large = stage_entry(io.BytesIO(b"x" * 20), str(tmp_path / "large"), 4, 10, budget)
+    budget.try_acquire(5)
+    spilled = stage_entry(
+        io.BytesIO(b"y" * 6), str(tmp_path / "spilled"), 4, 10, budget
+    )
+    assert (large, spilled) == (str(tmp_path / "large"), str(tmp_path / "spilled"))
+    assert (staged_size(large), staged_size(spilled)) == (20, 6)
+    assert read_staged(spilled, 2, 10) == b"yyyy"
+    assert budget.used == 5
+    discard_staged(large)
+    assert not (tmp_path / "large").exists()
+
+
+def test_memory_can_be_disabled(tmp_path):
+    budget = MemoryBudget(100)
+    staged = stage_entry(io.BytesIO(b"small"), str(tmp_path / "a"), 4, 0, budget)
+    assert staged == str(tmp_path / "a")
+    assert budget.used == 0
@@ -0,0 +1,109 @@
+import httpx
+import pytest
+
+import main
+from main import (
+    TransferLoop,
+    async_upload_staged_file,
+    chunked_upload,
+    upload_extracted_file,
+)
+
+
+class Requests(list):
+    """Requests received by the mock server, methods in ``failing`` are answered with 500."""
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Mock WebDAV server recording every request with its body."""
+    requests = Requests()
+    requests.failing = set()
+
+    def handler(request):
+        requests.append((request, request.read()))
+        if request.method in requests.failing:
+            return httpx.Response(500)
+        return httpx.Response(201)
+
+    options = main._http_client_options
+    monkeypatch.setattr(
+        main,
+        "_http_client_options",
+        lambda: dict(options(), transport=httpx.MockTransport(handler)),
+    )
+    monkeypatch.setattr(main, "_HTTP_CLIENT", None)
+    yield requests
+    if main._HTTP_CLIENT is not None:
+        main._HTTP_CLIENT.close()
+
+
+def whole_file_read(*args):
+    raise AssertionError("the file is read into memory")
+
+
+@pytest.mark.parametrize("async_transfers", [False, True])
+def test_files_with_mtime_are_streamed(tmp_path, server, monkeypatch, async_transfers):
+    monkeypatch.setattr(main, "read_file_chunk", whole_file_read)
+    monkeypatch.setattr(main, "COPY_BUFFER_SIZE", 1000)
+    data = bytes(range(256)) * 20
+    staged = tmp_path / "a.bin"
+    staged.write_bytes(data)
+    if async_transfers:
+        transfers = TransferLoop()
+        try:
+            transfers.run(
+                async_upload_staged_file(
+                    transfers, str(staged), "Docs/a.bin", "alice", 1700000000.5
+                )
+            ).result(10)
+        finally:
+            transfers.stop()
+    else:
+        upload_extracted_file(str(staged), "Docs/a.bin", None, "alice", 1700000000.5)
+    [(request, body)] = server
+    assert request.method == "PUT"
+    assert request.url.path == "/remote.php/dav/files/alice/Docs/a.bin"
+    assert request.headers["X-OC-Mtime"] == "1700000000"
+    assert request.headers["Content-Length"] == str(len(data))
+    assert body == data
+
+
+def test_chunked_uploads_are_moved_to_their_destination(tmp_path, server):
+    data = bytes(range(256)) * 10
+    staged = tmp_path / "a.bin"
+    staged.write_bytes(data)
+    assert chunked_upload(
+        str(staged), "Docs/a b.bin", None, "alice", 1000, 2, 1700000000
+    ) == len(data)
+    mkcol, *parts, move = server
+    destination = "http://nextcloud.local/remote.php/dav/files/alice/Docs/a%20b.bin"
+    upload_path = mkcol[0].url.path
+    assert mkcol[0].method == "MKCOL"
+    assert upload_path.startswith("/remote.php/dav/uploads/alice/extract-")
+    assert sorted((x.url.path, x.headers["Destination"]) for x, _ in parts) == [
+        (f"{upload_path}/{i:05d}", destination) for i in (1, 2, 3)
+    ]
+    assert (
+        b"".join(body for _, body in sorted(parts, key=lambda x: x[0].url.path)) == data
+    )
+    assert move[0].method == "MOVE"
+    assert move[0].url.path == f"{upload_path}/.file"
+    assert move[0].headers["Destination"] == destination
+    assert move[0].headers["OC-Total-Length"] == str(len(data))
+    assert move[0].headers["X-OC-Mtime"] == "1700000000"
+
+
+@pytest.mark.parametrize("failing", ["PUT", "MOVE"])
+def test_failed_chunked_uploads_are_removed(tmp_path, server, monkeypatch, failing):
+    monkeypatch.setattr(main, "CHUNK_RETRIES", 2)
+    server.failing.add(failing)
+    staged = tmp_path / "a.bin"
+    staged.write_bytes(b"x" * 2500)
+    with pytest.raises(httpx.HTTPStatusError):
+        chunked_upload(str(staged), "Docs/a.bin", None, "alice", 1000, 1)
+    upload_path = server[0][0].url.path
+    delete = server[-1][0]
+    assert (delete.method, delete.url.path) == ("DELETE", upload_path)
+    if failing == "PUT":
+        assert "MOVE" not in [x.method for x, _ in server]
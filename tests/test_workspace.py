@@ -0,0 +1,96 @@
+import io
+import os
+import shutil
+import time
+
+import pytest
+from nc_py_api import FsNode
+
+import main
+from engines import ArchiveEntry
+from layout import analyze_entries
+from staging import MemoryBudget, discard_staged, stage_entry
+from workspace import WorkspaceFull, WorkspaceManager, track_written
+
+
+@pytest.fixture
+def free_bytes(monkeypatch):
+    """Pretends the temp disk has ``free_bytes[0]`` free bytes."""
+    free = [1000]
+    usage = shutil.disk_usage(os.getcwd())
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: usage._replace(free=free[0]))
+    return free
+
+
+def test_staged_files_count_against_their_workspace(tmp_path, free_bytes):
+    manager = WorkspaceManager(str(tmp_path), reserve_bytes=0, wait_seconds=0)
+    with manager.open(300, "a.zip") as workspace:
+        filename = os.path.join(workspace.directory("extracted"), "a.txt")
+        staged = stage_entry(io.BytesIO(b"x" * 120), filename, 64, 0, MemoryBudget(0))
+        assert workspace.used_bytes() == 120
+        assert manager.usage()["used_bytes"] == 120
+        assert manager.usage()["reserved_bytes"] == 300
+        track_written(str(tmp_path / "elsewhere"), 50)
+        assert workspace.used_bytes() == 120
+        discard_staged(staged)
+        assert workspace.used_bytes() == 0
+    assert manager.usage()["workspaces"] == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_admission_counts_what_running_jobs_did_not_write_yet(tmp_path, free_bytes):
+    manager = WorkspaceManager(str(tmp_path), reserve_bytes=100, wait_seconds=0)
+    first = manager.open(600, "first")
+    with pytest.raises(WorkspaceFull, match="are available"):
+        manager.open(400, "second")
+    track_written(first.file("archive"), 600)
+    free_bytes[0] = 400
+    with pytest.raises(WorkspaceFull, match="can be freed"):
+        manager.open(1000, "too big")
+    manager.open(300, "third").close()
+    first.close()
+
+
+def test_workspaces_grow_when_the_space_is_free(tmp_path, free_bytes):
+    manager = WorkspaceManager(str(tmp_path), reserve_bytes=0, wait_seconds=0)
+    first = manager.open(300, "first")
+    second = manager.open(300, "second")
+    with pytest.raises(WorkspaceFull, match="are available"):
+        first.grow(800, "first")
+    second.close()
+    first.grow(600, "first")
+    first.grow(200, "first")
+    assert manager.usage()["reserved_bytes"] == 600
+    first.close()
+
+
+def test_estimates_cover_the_largest_entry(monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_BUFFER_BYTES", 100)
+    archive = FsNode(
+        "files/alice/a.tar", size=50, mimetype="application/x-tar", file_id="estimate"
+    )
+    assert main.estimate_temp_bytes(archive, False) == 100
+    assert main.estimate_temp_bytes(archive, True) == 150
+
+    def listing(*sizes):
+        entries = [
+            ArchiveEntry(f"{i}.bin", x, x, False, 0) for i, x in enumerate(sizes)
+        ]
+        return entries, analyze_entries(entries)
+
+    assert main.estimate_temp_bytes(archive, False, listing(30, 40)) == 70
+    assert main.estimate_temp_bytes(archive, False, listing(30, 40, 50)) == 100
+    assert main.estimate_temp_bytes(archive, False, listing(30, 2000)) == 2000
+
+
+def test_old_workspaces_are_collected(tmp_path):
+    manager = WorkspaceManager(str(tmp_path), max_age=60)
+    old = tmp_path / "old"
+    old.mkdir()
+    (old / "a.txt").write_bytes(b"a")
+    past = time.time() - 120
+    for path in (old / "a.txt", old):
+        os.utime(path, (past, past))
+    (tmp_path / "new").mkdir()
+    assert manager.collect_garbage() == 1
+    assert os.listdir(tmp_path) == ["new"]